@@ -6,12 +6,11 @@ from logging.handlers import RotatingFileHandler
 from flask import Flask
 from app.data_ingestor import DataIngestor
 from app.task_runner import ThreadPool
+from app.reloader import DataReloader
 
 webserver = Flask(__name__)
 webserver.tasks_runner = ThreadPool()
 
-webserver.data_ingestor = DataIngestor("./nutrition_activity_obesity_usa_subset.csv")
-
 if not os.path.exists('logs'):
     os.makedirs('logs')
 
@@ -28,9 +27,45 @@ webserver.logger.addHandler(handler)
 
 webserver.logger.setLevel(logging.INFO)
 
-webserver.tasks_runner.start(webserver.data_ingestor, webserver.logger)
+start_time = time.time()
+# If DI_SNAPSHOT is set, the data is loaded from (or saved to) that binary snapshot
+# If DI_INGEST_WORKERS is greater than 1, the csv file is parsed by that many processes
+CSV_PATH = "./nutrition_activity_obesity_usa_subset.csv"
+SNAPSHOT_PATH = os.environ.get('DI_SNAPSHOT') or None
+INGEST_WORKERS = int(os.environ.get('DI_INGEST_WORKERS', 1))
+webserver.data_ingestor = DataIngestor(CSV_PATH, SNAPSHOT_PATH, INGEST_WORKERS)
+webserver.logger.info("Loaded %d rows in %.3f seconds",
+                      len(webserver.data_ingestor), time.time() - start_time)
+
+# If DI_MATERIALIZE_AGGREGATES=1, precompute the sum/count groups of all the endpoints
+if os.environ.get('DI_MATERIALIZE_AGGREGATES', '0') == '1':
+    start_time = time.time()
+    webserver.data_ingestor.materialize_aggregates()
+    webserver.logger.info("Materialized %d aggregate groups in %.3f seconds",
+                          len(webserver.data_ingestor.aggregates), time.time() - start_time)
+
+# If DI_ENGINE=numpy, answer the queries with NumPy grouped reductions
+if os.environ.get('DI_ENGINE', 'python') == 'numpy':
+    webserver.data_ingestor.use_numpy_engine()
+    webserver.logger.info("Using the numpy engine")
+
+def start_worker():
+    """ Start the ThreadPool that computes the jobs of this process """
+    webserver.tasks_runner.start(webserver.data_ingestor, webserver.logger)
+
+def stop_worker():
+    """ Stop the ThreadPool of this process after the jobs that are already queued """
+    if webserver.tasks_runner.accepting_jobs:
+        webserver.tasks_runner.stop()
+
+# With TP_START_AFTER_FORK=1 (set by prefork_server.py), the ThreadPool is started by
+# start_worker in each worker process, once it is forked, instead of here
+webserver.prefork = os.environ.get('TP_START_AFTER_FORK', '0') == '1'
+if not webserver.prefork:
+    start_worker()
 
-webserver.job_counter = 1
+# New data releases are loaded through /api/admin/reload, without a restart
+webserver.reloader = DataReloader(webserver.tasks_runner, CSV_PATH, SNAPSHOT_PATH)
 
 if not os.path.exists('results'):
     os.makedirs('results')
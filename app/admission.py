@@ -0,0 +1,102 @@
+""" This module contains the admission control of the job submissions:
+    - ServiceTimes measures the service time of each command (exponentially weighted moving
+      average), from which the time to drain the queue is estimated
+    - TokenBucketLimiter limits the rate of the submissions of each client
+A rejected submission raises Overloaded, with the HTTP status code to answer with and the
+number of seconds after which the client should retry.
+"""
+import math
+import time
+from threading import Lock
+
+# The service time of a command that was never measured, in seconds
+DEFAULT_SERVICE_TIME = 0.01
+
+# The weight of a new measure in the moving average of the service times
+EWMA_ALPHA = 0.2
+
+# The number of clients above which the idle clients are forgotten
+MAX_CLIENTS = 10000
+
+
+class Overloaded(Exception):
+    """ Raised when a submission is not admitted: 429 if the client sends too many requests,
+        503 if the server has too many queued jobs."""
+    def __init__(self, status_code, reason, retry_after):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        # whole seconds, as sent in the Retry-After header
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class ServiceTimes:
+    """
+    This class keeps, for each command, the exponentially weighted moving average of the
+    time a thread spends computing one of its jobs. Each new measure has a weight of alpha.
+    """
+    def __init__(self, alpha=EWMA_ALPHA):
+        self.alpha = alpha
+        self.averages = {}
+        self.lock = Lock()
+
+    def record(self, command, seconds):
+        """ Add a measured service time of the command."""
+        with self.lock:
+            average = self.averages.get(command)
+            self.averages[command] = seconds if average is None else \
+                                     average + self.alpha * (seconds - average)
+
+    def estimate(self, command):
+        """ Return the expected service time of a job of the command, in seconds."""
+        return self.averages.get(command, DEFAULT_SERVICE_TIME)
+
+    def drain_time(self, num_jobs, num_threads):
+        """ Return the expected time, in seconds, for num_threads threads to compute the jobs
+            given as a dictionary from their command to their number."""
+        return sum(count * self.estimate(command)
+                   for command, count in num_jobs.items()) / max(num_threads, 1)
+
+
+class TokenBucketLimiter:  # pylint: disable=too-few-public-methods
+    """
+    This class gives every client a bucket of at most burst tokens, refilled with rate tokens
+    per second. A submission of n jobs takes n tokens from the bucket of its client and it is
+    rejected if there are not enough of them. A submission of more than burst jobs needs a
+    full bucket. A rate of 0 disables the limit.
+    """
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        # client -> [tokens, time of the last refill]
+        self.buckets = {}
+        self.lock = Lock()
+
+    def acquire(self, client, tokens=1):
+        """ Take the tokens of a submission from the bucket of the client.
+            Raise Overloaded if the bucket does not have enough of them."""
+        if self.rate <= 0:
+            return
+
+        tokens = min(tokens, self.burst)
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                if len(self.buckets) >= MAX_CLIENTS:
+                    self._forget_idle_clients(now)
+                bucket = self.buckets[client] = [self.burst, now]
+            else:
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+
+            if bucket[0] < tokens:
+                raise Overloaded(429, "Too many requests", (tokens - bucket[0]) / self.rate)
+            bucket[0] -= tokens
+
+    def _forget_idle_clients(self, now):
+        """ Remove the buckets that are full again, a new bucket would be the same.
+            Must be called with the lock held."""
+        for client in [client for client, (tokens, last) in self.buckets.items()
+                       if tokens + (now - last) * self.rate >= self.burst]:
+            del self.buckets[client]
@@ -0,0 +1,108 @@
+""" This module contains the helpers that sum and count the Data_Value column by groups
+and the AggregateCube, which materializes all the groups needed by the API at startup.
+Every group is stored as a [sum, count] pair, from which the mean is computed on request.
+It also contains the QuestionSummary, the intermediate results shared by the endpoints.
+"""
+
+def _add(groups, key, value, count=1):
+    """ Add the value (a sum of count values) to the [sum, count] pair of the key."""
+    group = groups.get(key)
+    if group is None:
+        groups[key] = [value, count]
+    else:
+        group[0] += value
+        group[1] += count
+
+
+def sum_by(keys, values):
+    """ Sum and count the values, grouped by the key found at the same position.
+        The groups keep the order in which their keys are first seen."""
+    groups = {}
+    for key, value in zip(keys, values):
+        _add(groups, key, value)
+    return groups
+
+
+def merge_by(groups, key_of):
+    """ Merge [sum, count] groups into coarser groups, keyed by key_of(key)."""
+    merged = {}
+    for key, (total, count) in groups.items():
+        _add(merged, key_of(key), total, count)
+    return merged
+
+
+class AggregateCube:
+    """
+    This class holds the sum and the count of the Data_Value column grouped by:
+        - question
+        - question and state
+        - question, state, StratificationCategory1 and Stratification1
+    All the groups are computed in a single pass over the columns of the data ingestor.
+    The keys are the integer codes of the data ingestor.
+    """
+    def __init__(self, data_ingestor):
+        # question -> [sum, count]
+        self.by_question = {}
+        # question -> {state -> [sum, count]}
+        self.by_state = {}
+        # (question, state) -> {(category, stratification) -> [sum, count]}
+        self.by_state_category = {}
+
+        self.add_rows(data_ingestor, slice(0, len(data_ingestor)))
+
+    def __len__(self):
+        """ Return the number of materialized groups."""
+        return len(self.by_question) + \
+               sum(len(groups) for groups in self.by_state.values()) + \
+               sum(len(groups) for groups in self.by_state_category.values())
+
+    def extended(self, data_ingestor, rows):
+        """ Return a new cube with the given slice of rows of the data ingestor folded into
+            the groups of this one. The groups of the questions without rows in the slice
+            are shared, the others are copied, so this cube is not modified."""
+        questions = set(data_ingestor.question_column[rows])
+
+        cube = AggregateCube.__new__(AggregateCube)
+        cube.by_question = {question: list(group) if question in questions else group
+                            for question, group in self.by_question.items()}
+        cube.by_state = {question: {state: list(group) for state, group in groups.items()}
+                         if question in questions else groups
+                         for question, groups in self.by_state.items()}
+        cube.by_state_category = {key: {pair: list(group) for pair, group in groups.items()}
+                                  if key[0] in questions else groups
+                                  for key, groups in self.by_state_category.items()}
+
+        cube.add_rows(data_ingestor, rows)
+        return cube
+
+    def add_rows(self, data_ingestor, rows):
+        """ Fold the given slice of rows of the data ingestor into the groups."""
+        for question, state, category, stratification, value in \
+                zip(data_ingestor.question_column[rows], data_ingestor.state_column[rows],
+                    data_ingestor.category_column[rows],
+                    data_ingestor.stratification_column[rows],
+                    data_ingestor.value_column[rows]):
+            _add(self.by_question, question, value)
+            _add(self.by_state.setdefault(question, {}), state, value)
+            _add(self.by_state_category.setdefault((question, state), {}),
+                 (category, stratification), value)
+
+
+class QuestionSummary:  # pylint: disable=too-few-public-methods
+    """
+    This class holds the intermediate results of a question that are shared by the endpoints
+    derived from them (states_mean, state_mean, global_mean, diff_from_mean,
+    state_diff_from_mean, best5 and worst5):
+        - states_mean: the mean of each state, sorted ascendingly
+        - global_mean: the mean of all the values of the question (None if there are none)
+        - ranking: the (state, mean) pairs sorted from the best state to the worst one
+    """
+    def __init__(self, states_mean, global_mean, best_is_min):
+        self.states_mean = dict(sorted(states_mean.items(), key=lambda item: item[1]))
+        self.global_mean = global_mean
+
+        # Check how the states should be sorted according to the question
+        if best_is_min:
+            self.ranking = sorted(self.states_mean.items(), key=lambda x: x[1])
+        else:
+            self.ranking = sorted(self.states_mean.items(), key=lambda x: x[1], reverse=True)
@@ -0,0 +1,271 @@
+""" This module contains an ASGI front-end for the same /api/* routes as the Flask application.
+The requests are served by an asyncio event loop instead of a WSGI thread each: the jobs are
+still computed by the ThreadPool, the calls that may block (the synchronous computation of cheap
+jobs, the registration of the jobs, the lookups of the job registry and the reads of the result
+store, which go to the SharedState database of a pre-fork server, the shutdown) run in the
+default executor of the loop, and a client that waits for a job awaits a future that is
+resolved when the job finishes, so a single process can hold thousands of waiting clients.
+
+The application is created by create_application(webserver), from the Flask application that
+holds the ThreadPool, the reloader and the logger, so both front-ends share the same state, and
+the requests are handled by app/handlers.py, so they give the same responses.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import parse_qs
+from app import handlers
+from app.job import COMMANDS
+from app.job_registry import RemoteJob, POLL_INTERVAL
+from app.result_stream import ResultStream
+
+# The headers of the JSON responses
+JSON_HEADERS = [(b'content-type', b'application/json')]
+
+
+class Request:  # pylint: disable=too-few-public-methods
+    """ This class holds the parts of an HTTP request used by the routes. """
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.path = scope['path']
+        self.args = {name: values[-1] for name, values in
+                     parse_qs(scope.get('query_string', b'').decode('latin-1')).items()}
+        self.remote_addr = (scope.get('client') or ('', 0))[0]
+        self.body = body
+
+    def json(self):
+        """ Return the JSON body of the request. Raise ValueError if it is not valid JSON."""
+        return json.loads(self.body or b'null')
+
+
+async def send_json(send, payload, status=200, headers=()):
+    """ Send a complete JSON response."""
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': JSON_HEADERS + list(headers)})
+    await send({'type': 'http.response.body', 'body': json.dumps(payload).encode('utf-8')})
+
+
+async def send_reply(send, reply):
+    """ Send a handlers.Reply."""
+    await send_json(send, reply.payload, reply.status_code,
+                    [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                     for name, value in reply.headers.items()])
+
+
+async def job_status(job):
+    """ Return the status of the job. The status of the job of another worker process is
+        read from the shared state in the default executor, so the loop is not blocked."""
+    if isinstance(job, RemoteJob):
+        return await asyncio.get_running_loop().run_in_executor(None, getattr, job, 'status')
+    return job.status
+
+
+async def wait_for_job(job, timeout):
+    """ Wait at most timeout seconds for the job to finish, without blocking a thread.
+        Return True if the job finished."""
+    if await job_status(job) != "running" or timeout <= 0:
+        return await job_status(job) != "running"
+
+    if isinstance(job, RemoteJob):
+        # the job of another worker process is polled in the shared state
+        deadline = time.monotonic() + timeout
+        while await job_status(job) == "running" and time.monotonic() < deadline:
+            await asyncio.sleep(min(POLL_INTERVAL, deadline - time.monotonic()))
+        return await job_status(job) != "running"
+
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+
+    def resolve():
+        if not future.done():
+            future.set_result(True)
+
+    def wake_up():
+        # called by the thread that finishes the job
+        loop.call_soon_threadsafe(resolve)
+
+    job.add_done_callback(wake_up)
+    try:
+        await asyncio.wait_for(future, timeout)
+    except asyncio.TimeoutError:
+        pass
+    finally:
+        job.remove_done_callback(wake_up)
+    return job.status != "running"
+
+
+class AsgiApplication:
+    """
+    This class is the ASGI application. Each route is an async method that answers
+    a Request, with the same responses as the corresponding route of app/routes.py.
+    """
+    def __init__(self, webserver):
+        self.webserver = webserver
+        self.routes = {
+            ('POST', '/api/batch'): self.batch_request,
+            ('POST', '/api/get_results'): self.get_batch_response,
+            ('GET', '/api/graceful_shutdown'): self.graceful_shutdown_request,
+            ('GET', '/api/jobs'): self.jobs_request,
+            ('GET', '/api/num_jobs'): self.num_jobs_request,
+            ('GET', '/api/cache_stats'): self.cache_stats_request,
+            ('GET', '/api/result_store_stats'): self.result_store_stats_request,
+            ('POST', '/api/admin/reload'): self.reload_request,
+            ('GET', '/api/admin/reload'): self.reload_status_request,
+            ('POST', '/api/post_endpoint'): self.post_endpoint,
+        }
+        for command in COMMANDS:
+            self.routes[('POST', command)] = self.job_request
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        # read the whole body of the request
+        body = b''
+        more_body = True
+        while more_body:
+            message = await receive()
+            body += message.get('body', b'')
+            more_body = message.get('more_body', False)
+
+        request = Request(scope, body)
+        route = self.routes.get((request.method, request.path))
+        if route is None and request.method == 'GET' and \
+                request.path.startswith('/api/get_results/'):
+            route = self.get_response
+        if route is None:
+            await send_json(send, {"status": "error", "reason": "Not found"}, 404)
+            return
+
+        try:
+            await route(request, send)
+        except ValueError:
+            # the body of the request is not valid JSON
+            await send_json(send, {"status": "error", "reason": "Invalid request"}, 400)
+
+    async def lifespan(self, receive, send):
+        """ Answer the startup and shutdown events of the server. At shutdown, the jobs
+            that are already queued are still computed."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.webserver.tasks_runner.accepting_jobs:
+                    await self.run_blocking(self.webserver.tasks_runner.stop)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def run_blocking(function, *args):
+        """ Run a call that may block in the default executor of the loop."""
+        return await asyncio.get_running_loop().run_in_executor(None, function, *args)
+
+    async def job_request(self, request, send):
+        """ Register a job for the endpoint, see handlers.submit_job."""
+        self.webserver.logger.info("Received request for %s", request.path)
+        await send_reply(send, await self.run_blocking(
+            handlers.submit_job, self.webserver, request.remote_addr, request.json(),
+            request.path, request.args.get('sync') in ('1', 'true')))
+
+    async def batch_request(self, request, send):
+        """ Register a batch of jobs, see handlers.submit_batch."""
+        self.webserver.logger.info("Received request for batch")
+        await send_reply(send, await self.run_blocking(
+            handlers.submit_batch, self.webserver, request.remote_addr, request.json()))
+
+    async def get_response(self, request, send):
+        """ Get the result of a job, waiting for it with ?wait=, see routes.get_response."""
+        job, reply = await self.run_blocking(handlers.find_job, self.webserver,
+                                             request.path.rsplit('/', 1)[-1])
+        if job is not None:
+            await wait_for_job(job, handlers.get_wait_time(request))
+            reply = await self.run_blocking(handlers.job_reply, self.webserver, job)
+        await send_reply(send, reply)
+
+    async def get_batch_response(self, request, send):
+        """ Stream the results of a list of jobs as JSON lines, see routes.get_batch_response.
+            The lines are sent as the jobs finish."""
+        job_ids = handlers.batch_job_ids(request.json())
+        if job_ids is None:
+            await send_reply(send, handlers.error_reply("Invalid request", 400))
+            return
+        self.webserver.logger.info("Received request for the results of %d jobs", len(job_ids))
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'application/x-ndjson')]})
+        async for line in self.stream_results(job_ids, handlers.get_wait_time(request),
+                                              handlers.get_batch_results_max_bytes()):
+            await send({'type': 'http.response.body', 'body': line.encode('utf-8'),
+                        'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def stream_results(self, job_ids, wait, max_bytes):
+        """ Generate the JSON lines with the results of the jobs, as they finish, see
+            routes.stream_results."""
+        loop = asyncio.get_running_loop()
+        finished = asyncio.Event()
+        stream = await self.run_blocking(ResultStream, self.webserver.tasks_runner, job_ids,
+                                         max_bytes,
+                                         lambda: loop.call_soon_threadsafe(finished.set))
+        deadline = time.monotonic() + wait
+        try:
+            while True:
+                finished.clear()
+                for line in await self.run_blocking(stream.take_lines):
+                    yield line
+                if not stream.pending:
+                    return
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    for line in stream.running_lines():
+                        yield line
+                    return
+                # wait for any running job without blocking the loop
+                try:
+                    await asyncio.wait_for(finished.wait(), stream.wait_time(remaining))
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            stream.close()
+
+    async def post_endpoint(self, request, send):
+        """ Example POST endpoint, echoes back the received data."""
+        await send_json(send, {"message": "Received data successfully", "data": request.json()})
+
+    async def graceful_shutdown_request(self, _request, send):
+        """ Stop the ThreadPool after the queued jobs, see handlers.shut_down."""
+        self.webserver.logger.info("Received request for graceful_shutdown")
+        await send_reply(send, await self.run_blocking(handlers.shut_down, self.webserver))
+
+    async def jobs_request(self, _request, send):
+        """ Get the list of all jobs and their status."""
+        await send_reply(send, await self.run_blocking(handlers.list_jobs, self.webserver))
+
+    async def num_jobs_request(self, _request, send):
+        """ Get the number of queued jobs, in total and for each cost class."""
+        await send_reply(send, handlers.count_jobs(self.webserver))
+
+    async def cache_stats_request(self, _request, send):
+        """ Get the hit/miss counters and the size of the result cache."""
+        await send_json(send, self.webserver.tasks_runner.result_cache.stats())
+
+    async def result_store_stats_request(self, _request, send):
+        """ Get the number of stored results and the bytes they use."""
+        await send_json(send, self.webserver.tasks_runner.result_store.stats())
+
+    async def reload_request(self, request, send):
+        """ Load a new data release in the background, see handlers.start_reload."""
+        await send_reply(send, handlers.start_reload(self.webserver, request.json()))
+
+    async def reload_status_request(self, _request, send):
+        """ Get the generation of the data and the state of the last reload."""
+        await send_json(send, self.webserver.reloader.stats())
+
+
+def create_application(webserver):
+    """ Create the ASGI application that serves the /api/* routes of the webserver."""
+    return AsgiApplication(webserver)
@@ -0,0 +1,138 @@
+""" This module contains the compact columnar storage of the needed columns of the csv file:
+the text columns are dictionary-encoded into arrays of integer codes and Data_Value is stored
+in an array of floats.
+"""
+import math
+from array import array
+from itertools import islice
+from operator import itemgetter
+
+# The columns read from the csv file
+NEEDED_COLUMNS = ('Question', 'LocationDesc', 'StratificationCategory1', 'Stratification1',
+                  'Data_Value')
+
+# The number of rows parsed before they are appended to the columns
+CHUNK_ROWS = 1024
+
+
+def parse_value(text):
+    """ Return the Data_Value as a float, or None if it is empty or not a number."""
+    try:
+        value = float(text)
+    except ValueError:
+        return None
+    return None if math.isnan(value) else value
+
+
+class StringDictionary:
+    """
+    This class dictionary-encodes a text column: every distinct string is stored once
+    and the column itself only keeps the integer code of each value.
+    """
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        # repr of each value, see labels
+        self.reprs = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def encode(self, value):
+        """ Return the code of the value, assigning a new code if the value is new."""
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def lookup(self, value):
+        """ Return the code of the value or None if the value was never seen."""
+        return self.codes.get(value)
+
+    def decode(self, code):
+        """ Return the string that corresponds to the code."""
+        return self.values[code]
+
+    def labels(self):
+        """ Return the repr of each value, by code: the way the value is shown inside the
+            str of a tuple, the key of a result. They are built again once values are added."""
+        reprs = self.reprs
+        if len(reprs) != len(self.values):
+            reprs = self.reprs = [repr(value) for value in self.values]
+        return reprs
+
+
+class ColumnStore:  # pylint: disable=too-many-instance-attributes
+    """
+    This class holds the needed columns of the csv file: one array of floats for Data_Value
+    and one array of integer codes, with its string dictionary, for each of Question,
+    LocationDesc, StratificationCategory1 and Stratification1.
+    """
+    def __init__(self):
+        # string dictionaries for the text columns
+        self.questions = StringDictionary()
+        self.states = StringDictionary()
+        self.categories = StringDictionary()
+        self.stratifications = StringDictionary()
+
+        # one compact array per needed column
+        self.question_column = array('I')
+        self.state_column = array('I')
+        self.category_column = array('I')
+        self.stratification_column = array('I')
+        self.value_column = array('d')
+
+    def __len__(self):
+        return len(self.value_column)
+
+    def checkpoint(self):
+        """ Return the number of rows and of values of each dictionary, see rollback."""
+        return len(self), [len(dictionary) for dictionary in self._dictionaries()]
+
+    def rollback(self, checkpoint):
+        """ Remove the rows and the dictionary values added after the checkpoint."""
+        num_rows, sizes = checkpoint
+        for column in (self.question_column, self.state_column, self.category_column,
+                       self.stratification_column, self.value_column):
+            del column[num_rows:]
+        for dictionary, size in zip(self._dictionaries(), sizes):
+            for value in dictionary.values[size:]:
+                del dictionary.codes[value]
+            del dictionary.values[size:]
+            dictionary.reprs = []
+
+    def _dictionaries(self):
+        """ Return the string dictionaries of the text columns."""
+        return self.questions, self.states, self.categories, self.stratifications
+
+    def read_rows(self, reader, positions):
+        """ Append the rows of the csv reader to the columns. Only the values at the given
+            positions are kept from each row and they are appended in chunks of CHUNK_ROWS
+            rows, so at most one chunk of values is held in memory besides the columns."""
+        needed_values = map(itemgetter(*positions), reader)
+        for chunk in iter(lambda: list(islice(needed_values, CHUNK_ROWS)), []):
+            self.append_rows(chunk)
+
+    def append_rows(self, rows):
+        """ Append the rows, given as tuples of the values of NEEDED_COLUMNS, to the columns.
+            The rows with an empty or non-numeric Data_Value are skipped: they have no value
+            to aggregate."""
+        questions, states, categories, stratifications, values = zip(*rows)
+        # Data_Value is parsed only once, here
+        try:
+            values = array('d', map(float, values))
+        except ValueError:
+            values = None
+        if values is None or any(map(math.isnan, values)):
+            valid_rows = [row for row in rows if parse_value(row[-1]) is not None]
+            if valid_rows:
+                self.append_rows(valid_rows)
+            return
+
+        self.question_column.extend(map(self.questions.encode, questions))
+        self.state_column.extend(map(self.states.encode, states))
+        self.category_column.extend(map(self.categories.encode, categories))
+        self.stratification_column.extend(map(self.stratifications.encode, stratifications))
+        self.value_column.extend(values)
@@ -1,15 +1,35 @@
 """
-This module is responsible for reading the csv file and storing the data in a list of dictionaries.
-From the csv file, only the columns that are needed are stored, for a more efficient use of memory.
+This module is responsible for reading the csv file and storing the data in a columnar format.
+From the csv file, only the columns that are needed are stored, for a more efficient use of memory:
+Data_Value is parsed once into a typed array of floats and the text columns are dictionary-encoded
+into arrays of integer codes. The rows are grouped by question and state, so the rows of a question
+(or of a question and a state) can be found through an index instead of scanning the whole dataset.
 """
 import csv
+from array import array
+from collections import Counter
+from app.aggregates import AggregateCube, QuestionSummary, sum_by, merge_by
+from app.columns import ColumnStore, NEEDED_COLUMNS
+from app.parallel_ingest import read_in_parallel
+from app.snapshot import load_snapshot, write_snapshot
 
-class DataIngestor:  # pylint: disable=too-few-public-methods
+class DataIngestor(ColumnStore):  # pylint: disable=too-many-instance-attributes
     """
     This class receives a csv file path and reads the data from the file.
-    The data is stored in a list of dictionaries.
+    The data is stored column by column: one array of floats for Data_Value and one array
+    of integer codes for each of Question, LocationDesc, StratificationCategory1 and
+    Stratification1.
+    After reading, the rows are sorted by question and state (keeping the order from the file
+    inside each group) and indexed, so each question and each (question, state) pair maps to
+    a contiguous slice of rows.
+    If a snapshot_path is given, the columns are loaded from that binary snapshot when it is
+    still valid for the csv file, otherwise the snapshot is written after reading the csv file.
+    With num_workers > 1, the csv file is parsed by a pool of processes (see parallel_ingest).
+    If a base data ingestor is given, the new one is its next generation: it holds the rows of
+    the base followed by the rows of the csv file (see _append_csv). The base is not modified,
+    so the jobs that use it can still run while the new generation is built.
     """
-    def __init__(self, csv_path: str):
+    def __init__(self, csv_path: str, snapshot_path=None, num_workers=1, base=None):
         self.questions_best_is_min = [
             'Percent of adults aged 18 years and older who have an overweight classification',
             'Percent of adults aged 18 years and older who have obesity',
@@ -33,18 +53,296 @@ class DataIngestor:  # pylint: disable=too-few-public-methods
                 week',
         ]
 
-        # read each row of the csv file and store it in a list of dictionaries
-        self.data = []
-        with open(csv_path, encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            for row in reader:
-                # Select only the columns that are needed
-                short_row = {
-                    '' : row[''], # this
-                    'LocationDesc': row['LocationDesc'],
-                    'Question': row['Question'],
-                    'Data_Value': row['Data_Value'],
-                    'StratificationCategory1': row['StratificationCategory1'],
-                    'Stratification1': row['Stratification1']
-                }
-                self.data.append(short_row)
+        # string dictionaries and arrays of the needed columns
+        super().__init__()
+
+        # group the rows by question and state and index the groups
+        self.question_index = {}
+        self.question_state_index = {}
+
+        # optional sum/count groups for every endpoint, see materialize_aggregates
+        self.aggregates = None
+
+        # optional engine for the sum/count queries, see use_numpy_engine
+        self.engine = None
+
+        # intermediate results of each question, computed on first use
+        self.summaries = {}
+
+        # the questions whose rows were appended to the base generation (None without a base)
+        self.appended_questions = None
+
+        if base is not None:
+            self._append_csv(base, csv_path, num_workers)
+        # a valid snapshot already has the columns sorted and indexed
+        elif snapshot_path is None or not load_snapshot(self, csv_path, snapshot_path):
+            self._read_csv(csv_path, num_workers)
+            self._build_index()
+            if snapshot_path is not None:
+                write_snapshot(self, csv_path, snapshot_path)
+
+    def _read_csv(self, csv_path, num_workers):
+        """ Stream the rows of the csv file with csv.reader. The positions of the needed columns
+            are found once in the header and only these values are kept from each row, whatever
+            the number of unused columns (see read_rows)."""
+        with open(csv_path, encoding='utf-8', newline='') as file:
+            reader = csv.reader(file)
+            header = next(reader, None)
+            if header is None:
+                return
+
+            positions = [header.index(name) for name in NEEDED_COLUMNS]
+            if num_workers > 1:
+                checkpoint = self.checkpoint()
+                if read_in_parallel(self, csv_path, positions, num_workers):
+                    return
+                # a quoted value spans two ranges, the rows merged so far are read again
+                self.rollback(checkpoint)
+            self.read_rows(reader, positions)
+
+    def _append_csv(self, base, csv_path, num_workers):
+        """ Copy the rows of the base generation and append the rows of the csv file.
+            The codes of the base stay the same, so its aggregates are updated with the
+            appended rows only: the groups of the other questions are shared with the base.
+            The summaries of the questions without appended rows are kept as well."""
+        for name in ('questions', 'states', 'categories', 'stratifications'):
+            for value in getattr(base, name).values:
+                getattr(self, name).encode(value)
+        for name in ('question_column', 'state_column', 'category_column',
+                     'stratification_column', 'value_column'):
+            # the columns of the base may be views over a snapshot, so they are copied as bytes
+            getattr(self, name).frombytes(memoryview(getattr(base, name)).cast('B'))
+
+        self._read_csv(csv_path, num_workers)
+        appended_rows = slice(len(base), len(self))
+        self.appended_questions = {self.questions.decode(question)
+                                   for question in set(self.question_column[appended_rows])}
+
+        if base.aggregates is not None:
+            self.aggregates = base.aggregates.extended(self, appended_rows)
+        # the jobs that still run on the base add their summaries meanwhile, so a copy
+        # of the summaries is iterated
+        self.summaries = {question: summary for question, summary in dict(base.summaries).items()
+                          if question not in self.appended_questions}
+
+        # the appended rows are moved to the groups of their question and state
+        self._build_index()
+        if base.engine is not None:
+            self.use_numpy_engine()
+
+    def _build_index(self):
+        """ Sort the rows by (question, state) and store, for every question and for every
+            (question, state) pair, the slice of rows that belongs to it.
+            The rows are placed by a counting sort, which keeps the order from the file inside
+            each group: the rows of each group are counted, the groups are laid out in the
+            order of their keys and each row is written at the next position of its group.
+            Besides the columns, the only allocation per row is the array of the positions."""
+        counts = Counter(zip(self.question_column, self.state_column))
+
+        # the first position of each group, and the groups of each question, are contiguous
+        next_positions = {}
+        self.question_index = {}
+        self.question_state_index = {}
+        start = 0
+        for key in sorted(counts):
+            end = start + counts[key]
+            next_positions[key] = start
+            self.question_state_index[key] = slice(start, end)
+            question_rows = self.question_index.get(key[0])
+            self.question_index[key[0]] = slice(start if question_rows is None
+                                                else question_rows.start, end)
+            start = end
+
+        # order[position] is the row that moves to that position
+        order = array('I', bytes(4 * len(self)))
+        for row, key in enumerate(zip(self.question_column, self.state_column)):
+            order[next_positions[key]] = row
+            next_positions[key] += 1
+
+        # reorder every column according to the sorted order
+        for name in ('question_column', 'state_column', 'category_column',
+                     'stratification_column', 'value_column'):
+            column = getattr(self, name)
+            setattr(self, name, array(column.typecode, map(column.__getitem__, order)))
+
+    def materialize_aggregates(self):
+        """ Compute in one pass the sum/count groups needed by the API, so that the jobs
+            can be answered by lookup instead of iterating the rows."""
+        self.aggregates = AggregateCube(self)
+
+    def use_numpy_engine(self):
+        """ Answer the sum/count queries with grouped reductions over NumPy arrays
+            instead of Python loops. NumPy is only imported when the engine is used."""
+        from app.numpy_engine import NumpyEngine  # pylint: disable=import-outside-toplevel
+        self.engine = NumpyEngine(self)
+
+    def _use_engine(self, rows):
+        """ Check if the query over the rows is answered by the engine. The small slices
+            of rows are faster to iterate in Python."""
+        return self.engine is not None and rows.stop - rows.start >= self.engine.min_rows
+
+    def question_view(self, question):
+        """ Return a QuestionView of the question, so the jobs of the question share
+            a single pass over its rows."""
+        if self.aggregates is not None or self.engine is not None:
+            return self
+        return QuestionView(self, question)
+
+    def question_rows(self, question):
+        """ Return the slice of rows for the question, empty if the question is unknown."""
+        question = self.questions.lookup(question)
+        return self.question_index.get(question, slice(0, 0))
+
+    def state_rows(self, question, state):
+        """ Return the slice of rows for the question and the state,
+            empty if there is no such row."""
+        key = (self.questions.lookup(question), self.states.lookup(state))
+        return self.question_state_index.get(key, slice(0, 0))
+
+    def question_sum(self, question):
+        """ Return the [sum, count] pair of the Data_Value column for the question."""
+        if self.aggregates is not None:
+            return self.aggregates.by_question.get(self.questions.lookup(question), [0.0, 0])
+
+        rows = self.question_rows(question)
+        if self._use_engine(rows):
+            return self.engine.question_sum(rows)
+
+        values = self.value_column[rows]
+        return [sum(values), len(values)]
+
+    def state_sums(self, question):
+        """ Return for each state code the [sum, count] pair of the Data_Value column,
+            for the question."""
+        if self.aggregates is not None:
+            return self.aggregates.by_state.get(self.questions.lookup(question), {})
+
+        rows = self.question_rows(question)
+        if self._use_engine(rows):
+            return self.engine.state_sums(rows)
+        return sum_by(self.state_column[rows], self.value_column[rows])
+
+    def category_sums(self, question):
+        """ Return for each (state, StratificationCategory1, Stratification1) code triple
+            the [sum, count] pair of the Data_Value column, for the question."""
+        if self.aggregates is not None:
+            question = self.questions.lookup(question)
+            category_sums = {}
+            for state in self.aggregates.by_state.get(question, {}):
+                for key, group in self.aggregates.by_state_category[(question, state)].items():
+                    category_sums[(state,) + key] = group
+            return category_sums
+
+        rows = self.question_rows(question)
+        if self._use_engine(rows):
+            return self.engine.category_sums(rows)
+        return sum_by(zip(self.state_column[rows], self.category_column[rows],
+                          self.stratification_column[rows]),
+                      self.value_column[rows])
+
+    def state_category_sums(self, question, state):
+        """ Return for each (StratificationCategory1, Stratification1) code pair the
+            [sum, count] pair of the Data_Value column, for the question and the state."""
+        if self.aggregates is not None:
+            key = (self.questions.lookup(question), self.states.lookup(state))
+            return self.aggregates.by_state_category.get(key, {})
+
+        rows = self.state_rows(question, state)
+        if self._use_engine(rows):
+            return self.engine.state_category_sums(rows)
+        return sum_by(zip(self.category_column[rows], self.stratification_column[rows]),
+                      self.value_column[rows])
+
+    def summary(self, question):
+        """ Return the QuestionSummary of the question. It is computed on first use
+            and then shared by all the jobs for the same question."""
+        summary = self.summaries.get(question)
+        if summary is not None:
+            return summary
+
+        total, count = self.question_sum(question)
+        states_mean = {self.states.decode(state): state_total / state_count \
+                       for state, (state_total, state_count) in self.state_sums(question).items()}
+        summary = QuestionSummary(states_mean, total / count if count else None,
+                                  question in self.questions_best_is_min)
+
+        # only the questions found in the data are kept
+        if count:
+            summary = self.summaries.setdefault(question, summary)
+        return summary
+
+    def row(self, index):
+        """ Decode the row at the given position back into a dictionary."""
+        return {
+            'LocationDesc': self.states.decode(self.state_column[index]),
+            'Question': self.questions.decode(self.question_column[index]),
+            'Data_Value': self.value_column[index],
+            'StratificationCategory1': self.categories.decode(self.category_column[index]),
+            'Stratification1': self.stratifications.decode(self.stratification_column[index])
+        }
+
+
+class QuestionView:  # pylint: disable=too-many-instance-attributes
+    """
+    This class answers the queries of the jobs of a single question from the sums of its
+    rows by (state, StratificationCategory1, Stratification1), computed in a single pass.
+    The sums by state, from which the summary is built, are merged from them instead of
+    iterating the rows again. The other queries are answered by the data ingestor.
+    """
+    def __init__(self, data_ingestor, question):
+        self.data_ingestor = data_ingestor
+        self.question = question
+
+        # shared with the data ingestor
+        self.questions = data_ingestor.questions
+        self.states = data_ingestor.states
+        self.categories = data_ingestor.categories
+        self.stratifications = data_ingestor.stratifications
+        self.questions_best_is_min = data_ingestor.questions_best_is_min
+        self.summaries = data_ingestor.summaries
+        self.aggregates = None
+
+        rows = data_ingestor.question_rows(question)
+        self.category_groups = sum_by(zip(data_ingestor.state_column[rows],
+                                          data_ingestor.category_column[rows],
+                                          data_ingestor.stratification_column[rows]),
+                                      data_ingestor.value_column[rows])
+        self.state_groups = merge_by(self.category_groups, lambda key: key[0])
+
+    def question_rows(self, question):
+        """ Return the slice of rows for the question."""
+        return self.data_ingestor.question_rows(question)
+
+    def state_rows(self, question, state):
+        """ Return the slice of rows for the question and the state."""
+        return self.data_ingestor.state_rows(question, state)
+
+    def question_sum(self, question):
+        """ Return the [sum, count] pair of the Data_Value column for the question."""
+        if question != self.question:
+            return self.data_ingestor.question_sum(question)
+        return [sum(group[0] for group in self.state_groups.values()),
+                sum(group[1] for group in self.state_groups.values())]
+
+    def state_sums(self, question):
+        """ Return for each state code the [sum, count] pair, for the question."""
+        if question != self.question:
+            return self.data_ingestor.state_sums(question)
+        return self.state_groups
+
+    def category_sums(self, question):
+        """ Return for each (state, StratificationCategory1, Stratification1) code triple
+            the [sum, count] pair, for the question."""
+        if question != self.question:
+            return self.data_ingestor.category_sums(question)
+        return self.category_groups
+
+    def state_category_sums(self, question, state):
+        """ Return for each (StratificationCategory1, Stratification1) code pair the
+            [sum, count] pair, for the question and the state. The rows of the state are
+            fewer than the sums of the question, so they are iterated instead."""
+        return self.data_ingestor.state_category_sums(question, state)
+
+    def summary(self, question):
+        """ Return the QuestionSummary of the question, built from the sums of the view."""
+        return DataIngestor.summary(self, question)
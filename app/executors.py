@@ -0,0 +1,92 @@
+""" This module contains the execution backends of the ThreadPool.
+A backend computes the result of a job taken from the queue by a TaskRunner thread:
+    - ThreadBackend computes it in the TaskRunner thread itself
+    - ProcessBackend sends it to a pool of worker processes, so CPU-bound jobs are not
+      limited by the GIL
+"""
+import logging
+import multiprocessing
+from app.job import Job, SUMMARY_COMMANDS
+
+def compute_group(data_ingestor, jobs):
+    """ Compute the jobs that share a question. If they need the sums by category of the
+        question, these are computed in a single pass over its rows and the summary of the
+        question is derived from them, instead of each job iterating the rows again.
+        The other jobs share the summary of the question computed by the first of them.
+        Return the result of each job or the exception it raised."""
+    question = jobs[0].input_data.get('question')
+    by_category = sum(job.command == '/api/mean_by_category' for job in jobs)
+    if by_category > 1 or (by_category and question not in data_ingestor.summaries and
+                           any(job.command in SUMMARY_COMMANDS for job in jobs)):
+        data_ingestor = data_ingestor.question_view(question)
+
+    results = []
+    for job in jobs:
+        try:
+            results.append(job.compute(data_ingestor))
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            results.append(error)
+    return results
+
+
+class ThreadBackend:
+    """ Compute the jobs in the threads of the ThreadPool. """
+    def __init__(self, data_ingestor):
+        self.data_ingestor = data_ingestor
+
+    def compute(self, job):
+        """ Compute and return the result of the job."""
+        return job.compute(self.data_ingestor)
+
+    def compute_group(self, jobs):
+        """ Compute the jobs of the same question, see compute_group."""
+        return compute_group(self.data_ingestor, jobs)
+
+    def shutdown(self):
+        """ Nothing to release for the thread backend."""
+
+
+# The data ingestor of the worker processes. It is set before the processes are forked,
+# so every worker inherits it without copying or pickling the data.
+_WORKER_DATA_INGESTOR = None
+
+def _compute_in_worker(job_id, input_data, command):
+    """ Compute the result of a job inside a worker process."""
+    job = Job(job_id, input_data, command, logging.getLogger(__name__))
+    return job.compute(_WORKER_DATA_INGESTOR)
+
+def _compute_group_in_worker(jobs):
+    """ Compute the jobs of the same question inside a worker process."""
+    logger = logging.getLogger(__name__)
+    return compute_group(_WORKER_DATA_INGESTOR, [Job(job_id, input_data, command, logger)
+                                                 for job_id, input_data, command in jobs])
+
+
+class ProcessBackend:
+    """ Compute the jobs in a pool of forked worker processes that share the ingested data
+        with the server process. The columns of the data ingestor are compact arrays, so
+        their pages are shared copy-on-write and are not touched by the workers. """
+    def __init__(self, data_ingestor, num_workers, logger):
+        global _WORKER_DATA_INGESTOR  # pylint: disable=global-statement
+        _WORKER_DATA_INGESTOR = data_ingestor
+
+        # all the workers are forked now, before the TaskRunner threads are started
+        self.pool = multiprocessing.get_context('fork').Pool(processes=num_workers)
+        self.logger = logger
+
+    def compute(self, job):
+        """ Send the job to a worker process and wait for its result."""
+        self.logger.info(f"Sending job_{job.job_id} {job.command} to the process pool")
+        return self.pool.apply(_compute_in_worker, (job.job_id, job.input_data, job.command))
+
+    def compute_group(self, jobs):
+        """ Send the jobs of the same question to a single worker process, so they share
+            one pass over the rows, and wait for their results."""
+        self.logger.info(f"Sending {len(jobs)} jobs to the process pool")
+        return self.pool.apply(_compute_group_in_worker,
+                               ([(job.job_id, job.input_data, job.command) for job in jobs],))
+
+    def shutdown(self):
+        """ Stop the worker processes."""
+        self.pool.close()
+        self.pool.join()
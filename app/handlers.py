@@ -0,0 +1,223 @@
+""" This module contains the handling of the /api/* requests that is shared by both front-ends,
+the Flask routes of app/routes.py and the ASGI application of app/asgi.py: each handler checks
+a request, submits its jobs or reads their state and returns the Reply to send, so both
+front-ends give the same responses.
+The handlers may block, on the locks of the ThreadPool, on the synchronous computation of a
+cheap job or on the SharedState database of a pre-fork server: the Flask routes call them on
+their WSGI thread and the ASGI application in the default executor of its loop.
+"""
+import os
+import signal
+from app.admission import Overloaded
+from app.job import COMMANDS
+from app.result_stream import parse_job_id, missing_job_reason
+
+
+class Reply:  # pylint: disable=too-few-public-methods
+    """ This class is a JSON response: its payload, its status code and its extra headers. """
+    __slots__ = ('payload', 'status_code', 'headers')
+
+    def __init__(self, payload, status_code=200, headers=None):
+        self.payload = payload
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+def error_reply(reason, status_code=200):
+    """ Answer a request that failed, with the reason."""
+    return Reply({"status": "error", "reason": reason}, status_code)
+
+
+def overloaded_reply(webserver, error):
+    """ Answer a request that was not admitted with its status code (429 or 503) and
+        the number of seconds after which the client should retry."""
+    webserver.logger.info("Rejected request: %s", error.reason)
+    return Reply({"status": "error", "reason": error.reason}, error.status_code,
+                 {'Retry-After': str(error.retry_after)})
+
+
+def get_wait_time(req):
+    """ Get the number of seconds to wait for a job from the ?wait= query parameter,
+        capped by the GET_RESULTS_MAX_WAIT environment variable (default 30 seconds)."""
+    try:
+        wait = float(req.args.get('wait', 0))
+    except ValueError:
+        return 0
+    return max(0, min(wait, float(os.environ.get('GET_RESULTS_MAX_WAIT', 30))))
+
+
+def get_batch_results_max_bytes():
+    """ Get the maximum size of the results streamed by /api/get_results, from the
+        BATCH_RESULTS_MAX_BYTES environment variable (default 16MB)."""
+    return int(os.environ.get('BATCH_RESULTS_MAX_BYTES', 16 * 1024 * 1024))
+
+
+def compute_sync(webserver, data, api_endpoint):
+    """ Compute a cheap job on the calling thread. Return the Reply with its result, or
+        None if the job is too expensive and has to be queued."""
+    try:
+        result = webserver.tasks_runner.compute_inline(data, api_endpoint)
+    except (KeyError, ValueError, ZeroDivisionError):
+        webserver.logger.exception("Synchronous %s failed", api_endpoint)
+        return error_reply("Job failed")
+
+    if result is None:
+        return None
+    return Reply({"status": "done", "data": result})
+
+
+def submit_job(webserver, remote_addr, data, api_endpoint, sync):
+    """ Send the job to the thread pool for processing.
+        With sync, a cheap job is computed right away and its result is returned
+        directly, the same way /api/get_results returns it."""
+    tasks_runner = webserver.tasks_runner
+    # Check if ThreadPool is still accepting jobs
+    if not tasks_runner.accepting_jobs:
+        return error_reply("Server is shutting down")
+
+    # Check that the body is the data of the job, before it is computed or queued
+    if not isinstance(data, dict):
+        return error_reply("Invalid request", 400)
+
+    # Limit the rate of the requests of each client
+    try:
+        tasks_runner.client_limiter.acquire(remote_addr)
+    except Overloaded as error:
+        return overloaded_reply(webserver, error)
+
+    # Fast path: compute on the calling thread if the job is cheap enough
+    if sync:
+        reply = compute_sync(webserver, data, api_endpoint)
+        if reply is not None:
+            return reply
+
+    # Register job, unless there are too many queued jobs. Don't wait for task to finish
+    job_id = tasks_runner.job_ids.allocate()
+    try:
+        tasks_runner.register_job(job_id, data, api_endpoint)
+    except Overloaded as error:
+        return overloaded_reply(webserver, error)
+
+    # Return associated job_id
+    return Reply({"job_id": "job_id_" + str(job_id)})
+
+
+def submit_batch(webserver, remote_addr, body):
+    """ Register a batch of jobs, given as {"jobs": [{"endpoint": ..., "data": {...}}, ...]}.
+        The job_ids are returned in the same order."""
+    tasks_runner = webserver.tasks_runner
+    # Check if ThreadPool is still accepting jobs
+    if not tasks_runner.accepting_jobs:
+        return error_reply("Server is shutting down")
+
+    # Check that the body has a list of jobs
+    batch = body.get('jobs', []) if isinstance(body, dict) else None
+    if not isinstance(batch, list):
+        return error_reply("Invalid request", 400)
+
+    # Check that each job has a known endpoint and its data, before any of them is queued
+    for entry in batch:
+        if not isinstance(entry, dict) or entry.get('endpoint') not in COMMANDS or \
+                not isinstance(entry.get('data'), dict):
+            return error_reply(f"Invalid job: {entry}", 400)
+
+    # Reserve a job_id for each job and register them together, unless the client sends
+    # too many jobs or there are too many queued jobs
+    try:
+        tasks_runner.client_limiter.acquire(remote_addr, len(batch))
+        job_ids = tasks_runner.job_ids.allocate_many(len(batch))
+        tasks_runner.register_jobs([(job_id, entry['data'], entry['endpoint'])
+                                    for job_id, entry in zip(job_ids, batch)])
+    except Overloaded as error:
+        return overloaded_reply(webserver, error)
+
+    # Return the associated job_ids
+    return Reply({"job_ids": ["job_id_" + str(job_id) for job_id in job_ids]})
+
+
+def find_job(webserver, job_id):
+    """ Find the job of a job_id like job_id_N. Return the job and None, or None and
+        the Reply to send if the job_id is not valid or the job is not found."""
+    # Check if job_id is valid: it was given to a registered job
+    jobs = webserver.tasks_runner.jobs
+    job_id_nr = parse_job_id(job_id)
+    max_job_id = jobs.max_job_id
+    if job_id_nr is None or job_id_nr > max_job_id:
+        return None, error_reply(missing_job_reason(job_id_nr, max_job_id))
+
+    # If job is not found (or it expired)
+    job = jobs.get(job_id_nr)
+    if job is None:
+        return None, error_reply(missing_job_reason(job_id_nr, max_job_id))
+    return job, None
+
+
+def batch_job_ids(body):
+    """ Get the job_ids of a request for the results of a list of jobs, given as
+        {"job_ids": ["job_id_1", ...]}, or None if the body is not valid."""
+    job_ids = body.get('job_ids', []) if isinstance(body, dict) else None
+    return job_ids if isinstance(job_ids, list) else None
+
+
+def job_reply(webserver, job):
+    """ Answer with the status of the job and its result, if it is done."""
+    status = job.status
+    # Check if job is still running
+    if status == "running":
+        return Reply({"status": "running"})
+    # If the job failed, there is no result to return
+    if status == "error":
+        return error_reply("Job failed")
+
+    # If job is done, return the result from the result store
+    result = webserver.tasks_runner.result_store.get(job.job_id)
+    if result is None:
+        return error_reply("Result expired")
+    return Reply({"status": "done", "data": result})
+
+
+def shut_down(webserver):
+    """ Stop the ThreadPool after the queued jobs, or all the worker processes of a
+        pre-fork server."""
+    # Signal the tasks_runner to stop accepting new jobs
+    if not webserver.tasks_runner.accepting_jobs:
+        return error_reply("Server is already shutting down")
+
+    if webserver.prefork:
+        # the master process stops all the workers after their queued jobs
+        os.kill(os.getppid(), signal.SIGTERM)
+    else:
+        webserver.tasks_runner.stop()
+    return Reply({"status": "shutting down"})
+
+
+def list_jobs(webserver):
+    """ Answer with the list of all jobs and their status."""
+    return Reply([{"job_id": job.job_id, "status": job.status}
+                  for job in webserver.tasks_runner.jobs.snapshot()])
+
+
+def count_jobs(webserver):
+    """ Answer with the number of jobs in the job_queue that were not taken by a thread
+        yet, in total and for each cost class."""
+    num_jobs = webserver.tasks_runner.num_pending_jobs_by_class()
+    return Reply({"num_jobs": sum(num_jobs.values()), "by_class": num_jobs})
+
+
+def start_reload(webserver, data):
+    """ Load a new data release in the background, given as {"file": name of a csv file of
+        the data directory, "append": bool}."""
+    reason = webserver.reloader.unsupported_reason()
+    if reason is not None:
+        return error_reply(reason)
+
+    data = {} if data is None else data
+    if not isinstance(data, dict):
+        return error_reply("Invalid request", 400)
+    csv_path = webserver.reloader.resolve_path(data.get('file'))
+    if csv_path is None:
+        return error_reply(f"Invalid file: {data.get('file')}")
+
+    if not webserver.reloader.start(csv_path, bool(data.get('append', False))):
+        return error_reply("A reload is already running")
+    return Reply({"status": "reloading"})
@@ -2,10 +2,27 @@
 The Job class is used to store information about a job and can run the job based on the command.
 The command specifies the type of API that created the job.
 """
-import json
+from threading import Event, Lock
+
+# The commands whose results are derived from the summary of the question
+SUMMARY_COMMANDS = ('/api/states_mean', '/api/state_mean', '/api/global_mean',
+                    '/api/diff_from_mean', '/api/state_diff_from_mean',
+                    '/api/best5', '/api/worst5')
+
+# All the commands a job can run
+COMMANDS = SUMMARY_COMMANDS + ('/api/mean_by_category', '/api/state_mean_by_category')
+
+# Guards the done_event and the done_callbacks of all the jobs against their finish. It is
+# held only to check the status and attach a waiter, so one lock is shared by all the jobs
+# instead of a lock (and an Event) per job
+_DONE_LOCK = Lock()
+
+class Job:  # pylint: disable=too-many-instance-attributes
+    """ This class is used to store the job details and run the job.
+        The attributes are declared in __slots__, so each job record stays small."""
+    __slots__ = ('job_id', 'input_data', 'result', 'status', 'command', 'logger',
+                 'finished_at', 'done_event', 'done_callbacks')
 
-class Job:  # pylint: disable=too-few-public-methods
-    """ This class is used to store the job details and run the job."""
     def __init__(self, job_id, input_data, command, logger):
         """ Initialize the Job class with job_id and input_data."""
         self.job_id = job_id
@@ -14,54 +31,53 @@ class Job:  # pylint: disable=too-few-public-methods
         self.status = "running"
         self.command = command
         self.logger = logger
+        self.finished_at = None
+        # set when the job finishes, created only when a client waits for it, see wait
+        self.done_event = None
+        # called when the job finishes, see add_done_callback
+        self.done_callbacks = None
+
+    def estimate_cost(self, data_ingestor):
+        """ Estimate the cost of the job as the number of rows it has to iterate."""
+        question = self.input_data.get('question')
+
+        # Lookups in the materialized aggregates or in a summary that is already computed
+        if data_ingestor.aggregates is not None:
+            return 0
+        if self.command in SUMMARY_COMMANDS and question in data_ingestor.summaries:
+            return 0
+
+        if self.command == '/api/state_mean_by_category':
+            rows = data_ingestor.state_rows(question, self.input_data.get('state'))
+        else:
+            rows = data_ingestor.question_rows(question)
+        return rows.stop - rows.start
+
+    def _summary(self, data_ingestor):
+        """ Get the intermediate results (states mean, global mean and ranking) of the
+            specified question. They are computed once per question and shared by all jobs."""
+        return data_ingestor.summary(self.input_data['question'])
 
     def _states_mean(self, data_ingestor):
         """ Calculate the mean of the Data_Value column for each state,
             for the specified question."""
-        # Extract the entries for the specified question
-        relevant_entries = [entry for entry in data_ingestor.data \
-                            if entry['Question'] == self.input_data['question']]
-
-        # Extract for each state the Data_Value column from the relevant data entries
-        states_mean = {}
-        for entry in relevant_entries:
-            state = entry['LocationDesc']
-            value = float(entry['Data_Value'])
-
-            if state not in states_mean:
-                states_mean[state] = []
-
-            states_mean[state].append(value)
-
-        # Calculate the mean for each state
-        for state, values in states_mean.items():
-            states_mean[state] = sum(values) / len(values)
-
-        # Sort the dictionary ascendingly by the mean and store it in result
-        self.result = dict(sorted(states_mean.items(), key=lambda item: item[1]))
+        # The means of the states, sorted ascendingly, are part of the summary
+        self.result = dict(self._summary(data_ingestor).states_mean)
 
     def _state_mean(self, data_ingestor):
         """ Calculate the mean of the Data_Value column for the specified question and state."""
-        # Extract the entries for the specified question and state
-        relevant_entries = [entry for entry in data_ingestor.data \
-                            if entry['Question'] == self.input_data['question'] and \
-                               entry['LocationDesc'] == self.input_data['state']]
-
-        # Calculate the mean
-        state_mean = sum(float(entry['Data_Value'])
-                        for entry in relevant_entries) / len(relevant_entries)
+        # Get the mean of the state from the summary of the question
+        state_mean = self._summary(data_ingestor).states_mean[self.input_data['state']]
 
         # Store the result
         self.result = {self.input_data['state']: state_mean}
 
     def _global_mean(self, data_ingestor):
         """ Calculate the global mean of the Data_Value column for the specified question."""
-        # Extract the entries for the specified question
-        relevant_entries = [float(entry['Data_Value']) for entry in data_ingestor.data \
-                            if entry['Question'] == self.input_data['question']]
-
-        # Calculate the global mean
-        global_mean = sum(relevant_entries) / len(relevant_entries)
+        # Get the global mean from the summary of the question
+        global_mean = self._summary(data_ingestor).global_mean
+        if global_mean is None:
+            raise ValueError(f"No data for question {self.input_data['question']}")
 
         # Store the result
         self.result = {"global_mean": global_mean}
@@ -104,32 +120,31 @@ class Job:  # pylint: disable=too-few-public-methods
     def _mean_by_category(self, data_ingestor):
         """ Calculate the mean of the Data_Value column for each state, for each
             StratificationCategory1 and for each Stratification1."""
-        # Extract entries for the specified question
-        relevant_entries = [entry for entry in data_ingestor.data \
-                            if entry['Question'] == self.input_data['question']]
-
-        # Extract for each state, for each StratificationCategory1 and for each Stratification1
-        # the Data_Value column from the relevant data entries
-        mean_by_category = {}
-        for entry in relevant_entries:
-            state = entry['LocationDesc']
-            category = entry['StratificationCategory1']
-            category_value = entry['Stratification1']
-            value = float(entry['Data_Value'])
+        # Get for each state, for each StratificationCategory1 and for each Stratification1
+        # the sum and the count of the Data_Value column
+        category_sums = data_ingestor.category_sums(self.input_data['question'])
 
-            # Check if state, category and category_value does not have empty values
-            if state == '' or category == '' or category_value == '':
-                continue
+        # Codes of the empty values, which are skipped
+        empty_state = data_ingestor.states.lookup('')
+        empty_category = data_ingestor.categories.lookup('')
+        empty_category_value = data_ingestor.stratifications.lookup('')
 
-            if (state, category, category_value) not in mean_by_category:
-                mean_by_category[(state, category, category_value)] = []
-
-            mean_by_category[(state, category, category_value)].append(value)
+        # The key of each group is the str of its (state, category, category_value) tuple,
+        # built from the repr of each value
+        states = data_ingestor.states.labels()
+        categories = data_ingestor.categories.labels()
+        category_values = data_ingestor.stratifications.labels()
 
         # Calculate the mean
         self.result = {}
-        for key, values in mean_by_category.items():
-            self.result[str(key)] = sum(values) / len(values)
+        for (state, category, category_value), (total, count) in category_sums.items():
+            # Check if state, category and category_value does not have empty values
+            if state == empty_state or category == empty_category or \
+               category_value == empty_category_value:
+                continue
+
+            key = f"({states[state]}, {categories[category]}, {category_values[category_value]})"
+            self.result[key] = total / count
 
         # Sort the dictionary lexicographically
         self.result = dict(sorted(self.result.items()))
@@ -137,66 +152,47 @@ class Job:  # pylint: disable=too-few-public-methods
     def _state_mean_by_category(self, data_ingestor):
         """ Calculate the mean of the Data_Value column for the specified question and state,
             for each StratificationCategory1 and for each Stratification1."""
-        # Extract entries for the specified question and state
-        relevant_entries = [entry for entry in data_ingestor.data \
-                            if entry['Question'] == self.input_data['question'] and \
-                               entry['LocationDesc'] == self.input_data['state']]
-
-        # Extract for each StratificationCategory1 and for each Stratification1 the Data_Value
-        # column from the relevant data entries
-        mean_by_category = {}
-        for entry in relevant_entries:
-            category = entry['StratificationCategory1']
-            category_value = entry['Stratification1']
-            value = float(entry['Data_Value'])
-
-            # Check if category and category_value does not have empty values
-            if category == '' or category_value == '':
-                continue
+        # Get for each StratificationCategory1 and for each Stratification1 the sum and
+        # the count of the Data_Value column
+        category_sums = data_ingestor.state_category_sums(self.input_data['question'],
+                                                           self.input_data['state'])
 
-            if (category, category_value) not in mean_by_category:
-                mean_by_category[(category, category_value)] = []
+        # Codes of the empty values, which are skipped
+        empty_category = data_ingestor.categories.lookup('')
+        empty_category_value = data_ingestor.stratifications.lookup('')
 
-            mean_by_category[(category, category_value)].append(value)
+        # The key of each group is the str of its (category, category_value) tuple
+        categories = data_ingestor.categories.labels()
+        category_values = data_ingestor.stratifications.labels()
 
         # Calculate the mean
         self.result = {}
-        for key, values in mean_by_category.items():
-            self.result[str(key)] = sum(values) / len(values)
+        for (category, category_value), (total, count) in category_sums.items():
+            # Check if category and category_value does not have empty values
+            if category == empty_category or category_value == empty_category_value:
+                continue
+
+            key = f"({categories[category]}, {category_values[category_value]})"
+            self.result[key] = total / count
 
         # Sort the dictionary lexicographically
         self.result = {self.input_data['state']: self.result}
 
-    def _sort_states(self, data_ingestor):
-        """ Sort the states mean according to the question."""
-        # Get states mean and store it in a variable
-        self._states_mean(data_ingestor)
-        states_mean = self.result
-
-        # Check how the states should be sorted according to the question
-        question = self.input_data['question']
-        if question in data_ingestor.questions_best_is_min:
-            sort_states = sorted(states_mean.items(), key=lambda x: x[1])
-        else:
-            sort_states = sorted(states_mean.items(), key=lambda x: x[1], reverse=True)
-
-        return sort_states
-
     def _best5(self, data_ingestor):
         """ Get the best 5 states according to the question."""
-        # Get the sorted states
-        sort_states = self._sort_states(data_ingestor)
+        # Get the states sorted from the best to the worst
+        ranking = self._summary(data_ingestor).ranking
 
         # Get the best 5 states
-        self.result = dict(sort_states[:5])
+        self.result = dict(ranking[:5])
 
     def _worst5(self, data_ingestor):
         """ Get the worst 5 states according to the question."""
-        # Get the sorted states
-        sort_states = self._sort_states(data_ingestor)
+        # Get the states sorted from the best to the worst
+        ranking = self._summary(data_ingestor).ranking
 
         # Get the worst 5 states
-        self.result = dict(sort_states[-5:])
+        self.result = dict(ranking[-5:])
 
     def _default(self, data_ingestor):
         """ Default case when the command is not recognized."""
@@ -220,23 +216,62 @@ class Job:  # pylint: disable=too-few-public-methods
         func = switch.get(self.command, self._default)
         func(data_ingestor)
 
-    def run(self, data_ingestor):
-        """ Run the job according to the command of the job."""
-        # find result based on the command
+    def compute(self, data_ingestor):
+        """ Compute and return the result of the job according to its command."""
         self._switch_case(data_ingestor)
-
-        # write the result to a file in results folder, with the job_id as the filename
-        with open(f"results/job_id{self.job_id}.json", 'w', encoding='utf-8') as f:
-            f.write(json.dumps(self.result))
-
-        # Update the status of the job and erase the temporary result
-        self.status = "done"
-        self.result = None
-
-    def get_result_from_file(self):
-        """ Get the result from the file."""
-        try:
-            with open(f"results/job_id{self.job_id}.json", 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except FileNotFoundError:
-            return None
+        result, self.result = self.result, None
+        return result
+
+    def complete(self, result_store, result, followers=()):
+        """ Store the result of the job, shared with the jobs that follow it (the identical
+            jobs that were submitted while it was pending or running), and mark them all
+            as done."""
+        result_store.put(self.job_id, result, [job.job_id for job in followers])
+        for job in (self, *followers):
+            job.finish("done")
+
+    def fail(self, followers=()):
+        """ Mark the job and the jobs that follow it as failed."""
+        for job in (self, *followers):
+            job.finish("error")
+
+    def finish(self, status):
+        """ Set the final status of the job, wake up the clients that wait for it
+            and call its done callbacks. The waiters are dropped, they are not needed
+            after the job finished."""
+        with _DONE_LOCK:
+            self.status = status
+            done_event, self.done_event = self.done_event, None
+            done_callbacks, self.done_callbacks = self.done_callbacks, None
+        if done_event is not None:
+            done_event.set()
+        for callback in done_callbacks or ():
+            callback()
+
+    def wait(self, timeout):
+        """ Wait at most timeout seconds for the job to finish.
+            Return True if the job finished."""
+        with _DONE_LOCK:
+            if self.status != "running":
+                return True
+            if self.done_event is None:
+                self.done_event = Event()
+            done_event = self.done_event
+        return done_event.wait(timeout)
+
+    def add_done_callback(self, callback):
+        """ Call the callback, without arguments, when the job finishes, or right away if it
+            already finished."""
+        with _DONE_LOCK:
+            if self.status == "running":
+                if self.done_callbacks is None:
+                    self.done_callbacks = []
+                self.done_callbacks.append(callback)
+                return
+        callback()
+
+    def remove_done_callback(self, callback):
+        """ Remove a callback that was not needed anymore."""
+        with _DONE_LOCK:
+            if self.done_callbacks is not None and callback in self.done_callbacks:
+                self.done_callbacks.remove(callback)
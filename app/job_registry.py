@@ -0,0 +1,285 @@
+""" This module contains the JobRegistry class, which keeps the jobs of the ThreadPool
+by job_id, so a job is found in O(1) no matter how many jobs were registered.
+The finished jobs are expired by count and by age, so the registry does not grow forever.
+It also contains the JobIdAllocator, which gives a unique job_id to every submitted job.
+The SharedJobRegistry and the JobIdBlockAllocator do the same for the worker processes of
+a pre-fork server, through the SharedState database.
+"""
+import itertools
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+
+# The number of job_ids a worker process reserves at once
+JOB_ID_BLOCK_SIZE = 1000
+
+# The number of seconds between two reads of the status of a job of another process
+POLL_INTERVAL = 0.05
+
+class JobIdAllocator:
+    """
+    This class allocates increasing job_ids, starting from 1, without a lock: each job_id
+    is taken with a single next() on an itertools.count, which is atomic in CPython (the
+    counter is incremented in C while the GIL is held), so concurrent requests never get
+    the same job_id.
+    """
+    def __init__(self):
+        self.counter = itertools.count(1)
+
+    def allocate(self):
+        """ Return a new job_id."""
+        return next(self.counter)
+
+    def allocate_many(self, num_ids):
+        """ Return num_ids new job_ids, in increasing order. They are not contiguous
+            if other job_ids are allocated at the same time."""
+        return [next(self.counter) for _ in range(num_ids)]
+
+
+class JobIdBlockAllocator:
+    """
+    This class allocates job_ids that are unique across the worker processes that share
+    the state: each process reserves blocks of block_size consecutive job_ids in the shared
+    state and allocates them in increasing order, so it writes to the database once per
+    block instead of once per job. The job_ids of the processes are interleaved by block.
+    A forked process does not inherit the block of its parent.
+    """
+    def __init__(self, shared_state, block_size=JOB_ID_BLOCK_SIZE):
+        self.shared_state = shared_state
+        self.block_size = block_size
+        self.next_id = 0
+        self.block_end = 0
+        # the process that reserved the block
+        self.pid = os.getpid()
+        self.lock = Lock()
+
+    def allocate(self):
+        """ Return a new job_id."""
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, num_ids):
+        """ Return num_ids new job_ids, in increasing order."""
+        job_ids = []
+        with self.lock:
+            if self.pid != os.getpid():
+                self.next_id = self.block_end = 0
+                self.pid = os.getpid()
+            while len(job_ids) < num_ids:
+                if self.next_id == self.block_end:
+                    # a batch larger than a block reserves all its job_ids at once
+                    size = max(self.block_size, num_ids - len(job_ids))
+                    self.next_id = self.shared_state.reserve_job_ids(size)
+                    self.block_end = self.next_id + size
+                count = min(num_ids - len(job_ids), self.block_end - self.next_id)
+                job_ids.extend(range(self.next_id, self.next_id + count))
+                self.next_id += count
+        return job_ids
+
+
+class JobRegistry:
+    """
+    This class maps each job_id to its Job.
+    At most max_finished finished jobs are kept (0 = no limit) and a finished job is
+    dropped max_age seconds after it finished (0 = no limit). The jobs that are still
+    running are never dropped. on_expire is called with each dropped job.
+    """
+    def __init__(self, max_finished, max_age, on_expire=None):
+        self.max_finished = max_finished
+        self.max_age = max_age
+        self.on_expire = on_expire
+        self.jobs = {}
+        # the largest job_id that was ever registered
+        self.max_job_id = 0
+        # job_id of the finished jobs, in the order they finished
+        self.finished = OrderedDict()
+        self.lock = Lock()
+
+    def __len__(self):
+        return len(self.jobs)
+
+    def add(self, job):
+        """ Register a new job."""
+        self.add_many([job])
+
+    def add_many(self, jobs):
+        """ Register new jobs with a single lock acquisition."""
+        with self.lock:
+            for job in jobs:
+                self.jobs[job.job_id] = job
+                self.max_job_id = max(self.max_job_id, job.job_id)
+
+    def remove_many(self, jobs):
+        """ Unregister jobs that were rejected before they were queued."""
+        with self.lock:
+            for job in jobs:
+                self.jobs.pop(job.job_id, None)
+
+    def get(self, job_id):
+        """ Return the job with the given job_id or None if it does not exist or expired."""
+        with self.lock:
+            expired = self._expire()
+            job = self.jobs.get(job_id)
+        self._notify(expired)
+        return job
+
+    def get_many(self, job_ids):
+        """ Return the jobs with the given job_ids, with None for the jobs that
+            do not exist or expired, in a single pass."""
+        with self.lock:
+            expired = self._expire()
+            jobs = [self.jobs.get(job_id) for job_id in job_ids]
+        self._notify(expired)
+        return jobs
+
+    def mark_finished(self, job):
+        """ Record that the job finished, so it can expire."""
+        with self.lock:
+            job.finished_at = time.monotonic()
+            self.finished[job.job_id] = job.finished_at
+            expired = self._expire()
+        self._notify(expired)
+
+    def snapshot(self):
+        """ Return the list of the registered jobs."""
+        with self.lock:
+            return list(self.jobs.values())
+
+    def _expire(self):
+        """ Remove the finished jobs over the limits and return them.
+            Must be called with the lock held."""
+        expired = []
+        deadline = time.monotonic() - self.max_age
+        while self.finished:
+            job_id, finished_at = next(iter(self.finished.items()))
+            if not (0 < self.max_finished < len(self.finished) or
+                    (self.max_age > 0 and finished_at < deadline)):
+                break
+            del self.finished[job_id]
+            expired.append(self.jobs.pop(job_id))
+        return expired
+
+    def _notify(self, expired):
+        """ Call on_expire for each expired job, outside the lock."""
+        if self.on_expire is not None:
+            for job in expired:
+                self.on_expire(job)
+
+
+class RemoteJob:
+    """
+    This class is a job registered by another worker process, read from the shared state.
+    Only its job_id and its status are known: while it is running, its status is read
+    again from the shared state each time it is requested.
+    """
+    __slots__ = ('job_id', 'last_status', 'shared_state')
+
+    def __init__(self, job_id, status, shared_state):
+        self.job_id = job_id
+        self.last_status = status
+        self.shared_state = shared_state
+
+    @property
+    def status(self):
+        """ The status of the job. A job that expired in the meantime is reported as
+            done, the result store then reports its result as expired."""
+        if self.last_status == "running":
+            rows = self.shared_state.query("SELECT status FROM jobs WHERE job_id = ?",
+                                           (self.job_id,))
+            self.last_status = rows[0][0] if rows else "done"
+        return self.last_status
+
+    def wait(self, timeout):
+        """ Wait at most timeout seconds for the job to finish, polling the shared state.
+            Return True if the job finished."""
+        deadline = time.monotonic() + timeout
+        while self.status == "running":
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(POLL_INTERVAL, remaining))
+        return True
+
+
+class SharedJobRegistry(JobRegistry):
+    """
+    This class keeps the jobs of this process like the JobRegistry and records the status
+    of each of them in the shared state, so the other worker processes find them too, as
+    RemoteJob records. Each process expires its own jobs.
+    """
+    def __init__(self, max_finished, max_age, shared_state, on_expire=None):
+        self.shared_state = shared_state
+        super().__init__(max_finished, max_age, on_expire)
+
+    @property
+    def max_job_id(self):
+        """ The largest job_id that was registered by any of the processes."""
+        return self.shared_state.query("SELECT value FROM counters "
+                                       "WHERE name = 'max_job_id'")[0][0]
+
+    @max_job_id.setter
+    def max_job_id(self, job_id):
+        self.shared_state.execute([("UPDATE counters SET value = max(value, ?) "
+                                    "WHERE name = 'max_job_id'", [(job_id,)])])
+
+    def add_many(self, jobs):
+        """ Register new jobs, as running for the other processes, with a single
+            transaction."""
+        if not jobs:
+            return
+        with self.lock:
+            for job in jobs:
+                self.jobs[job.job_id] = job
+        self.shared_state.execute([
+            ("INSERT OR REPLACE INTO jobs VALUES (?, 'running')",
+             [(job.job_id,) for job in jobs]),
+            ("UPDATE counters SET value = max(value, ?) WHERE name = 'max_job_id'",
+             [(max(job.job_id for job in jobs),)])])
+
+    def remove_many(self, jobs):
+        """ Unregister jobs that were rejected before they were queued, for the other
+            processes too."""
+        super().remove_many(jobs)
+        self.shared_state.execute([("DELETE FROM jobs WHERE job_id = ?",
+                                    [(job.job_id,) for job in jobs])])
+
+    def get(self, job_id):
+        """ Return the job with the given job_id, a RemoteJob if it was registered by
+            another process, or None if it does not exist or expired."""
+        return self.get_many([job_id])[0]
+
+    def get_many(self, job_ids):
+        """ Return the jobs with the given job_ids, looking up the ones that were not
+            registered by this process in the shared state with a single query."""
+        jobs = super().get_many(job_ids)
+        missing = [job_id for job_id, job in zip(job_ids, jobs)
+                   if job is None and job_id is not None]
+        if not missing:
+            return jobs
+
+        remote_jobs = {job_id: RemoteJob(job_id, status, self.shared_state)
+                       for job_id, status in self.shared_state.query_many(
+                           "SELECT job_id, status FROM jobs WHERE job_id IN ({})", missing)}
+        return [remote_jobs.get(job_id) if job is None else job
+                for job_id, job in zip(job_ids, jobs)]
+
+    def mark_finished(self, job):
+        """ Record that the job finished, so it can expire, and its final status."""
+        self.shared_state.execute([("UPDATE jobs SET status = ? WHERE job_id = ?",
+                                    [(job.status, job.job_id)])])
+        super().mark_finished(job)
+
+    def snapshot(self):
+        """ Return the list of the jobs registered by all the processes."""
+        local_jobs = {job.job_id: job for job in super().snapshot()}
+        return [local_jobs.get(job_id) or RemoteJob(job_id, status, self.shared_state)
+                for job_id, status in self.shared_state.query("SELECT job_id, status "
+                                                              "FROM jobs ORDER BY job_id")]
+
+    def _notify(self, expired):
+        """ Remove the expired jobs from the shared state and call on_expire for each
+            of them, outside the lock."""
+        if expired:
+            self.shared_state.execute([("DELETE FROM jobs WHERE job_id = ?",
+                                        [(job.job_id,) for job in expired])])
+        super()._notify(expired)
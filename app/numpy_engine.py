@@ -0,0 +1,96 @@
+""" This module contains the NumpyEngine, an optional engine for the queries of the DataIngestor.
+The columns of the data ingestor are wrapped, without copying them, into NumPy arrays and the
+[sum, count] groups are computed with grouped reductions (np.bincount) over the integer codes,
+instead of Python loops over the rows.
+"""
+import numpy as np
+
+# Below this number of rows, the Python loops are faster than the overhead of NumPy
+MIN_ROWS = 128
+
+# Above this number of possible keys, the keys are made compact with np.unique before bincount
+MAX_BINCOUNT_SIZE = 1 << 20
+
+class NumpyEngine:  # pylint: disable=too-many-instance-attributes
+    """
+    This class answers the [sum, count] queries of the DataIngestor for a slice of rows.
+    The results have the same format as the ones of the pure-Python path: a dictionary from
+    the code (or the tuple of codes) of each group to its [sum, count] pair.
+    """
+    def __init__(self, data_ingestor):
+        self.min_rows = MIN_ROWS
+
+        # views over the arrays of the data ingestor, they share its memory
+        self.state_column = np.frombuffer(data_ingestor.state_column, dtype=np.uintc)
+        self.category_column = np.frombuffer(data_ingestor.category_column, dtype=np.uintc)
+        self.stratification_column = np.frombuffer(data_ingestor.stratification_column,
+                                                   dtype=np.uintc)
+        self.value_column = np.frombuffer(data_ingestor.value_column, dtype=np.float64)
+
+        self.num_states = len(data_ingestor.states)
+        self.num_categories = len(data_ingestor.categories)
+        self.num_stratifications = len(data_ingestor.stratifications)
+
+    @staticmethod
+    def group_arrays(keys, values, size):
+        """ Sum and count the values grouped by their integer key, 0 <= key < size.
+            Return the arrays of the keys that appear, in ascending order, of their sums and
+            of their counts."""
+        if size > MAX_BINCOUNT_SIZE:
+            unique_keys, keys = np.unique(keys, return_inverse=True)
+            size = len(unique_keys)
+        else:
+            unique_keys = None
+
+        totals = np.bincount(keys, weights=values, minlength=size)
+        counts = np.bincount(keys, minlength=size)
+        present = np.flatnonzero(counts)
+        codes = present if unique_keys is None else unique_keys[present]
+        return codes, totals[present], counts[present]
+
+    @staticmethod
+    def to_groups(keys, totals, counts):
+        """ Build the {key: [sum, count]} dictionary of the groups, from the lists of their
+            keys, sums and counts."""
+        return dict(zip(keys, map(list, zip(totals.tolist(), counts.tolist()))))
+
+    @staticmethod
+    def group_sums(keys, values, size):
+        """ Sum and count the values grouped by their integer key, 0 <= key < size.
+            Return {key: [sum, count]} for the keys that appear, in ascending order."""
+        codes, totals, counts = NumpyEngine.group_arrays(keys, values, size)
+        return NumpyEngine.to_groups(codes.tolist(), totals, counts)
+
+    def question_sum(self, rows):
+        """ Return the [sum, count] pair of the values of the rows."""
+        values = self.value_column[rows]
+        return [float(values.sum()), len(values)]
+
+    def state_sums(self, rows):
+        """ Return the [sum, count] pair of each state code, for the rows."""
+        return self.group_sums(self.state_column[rows], self.value_column[rows], self.num_states)
+
+    def category_sums(self, rows):
+        """ Return the [sum, count] pair of each (state, category, stratification) code triple,
+            for the rows. The rows are grouped by a single code that combines the three codes,
+            which are split again for the groups that appear only."""
+        num_keys = self.num_categories * self.num_stratifications
+        keys = self.state_column[rows].astype(np.int64) * num_keys + \
+               self.category_column[rows].astype(np.int64) * self.num_stratifications + \
+               self.stratification_column[rows]
+        codes, totals, counts = self.group_arrays(keys, self.value_column[rows],
+                                                  self.num_states * num_keys)
+        states, codes = np.divmod(codes, num_keys)
+        categories, stratifications = np.divmod(codes, self.num_stratifications)
+        return self.to_groups(zip(states.tolist(), categories.tolist(), stratifications.tolist()),
+                              totals, counts)
+
+    def state_category_sums(self, rows):
+        """ Return the [sum, count] pair of each (category, stratification) code pair,
+            for the rows."""
+        keys = self.category_column[rows].astype(np.int64) * self.num_stratifications + \
+               self.stratification_column[rows]
+        codes, totals, counts = self.group_arrays(keys, self.value_column[rows],
+                                                  self.num_categories * self.num_stratifications)
+        categories, stratifications = np.divmod(codes, self.num_stratifications)
+        return self.to_groups(zip(categories.tolist(), stratifications.tolist()), totals, counts)
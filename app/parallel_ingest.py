@@ -0,0 +1,155 @@
+""" This module parses the csv file with several processes. The rows after the header are split
+into byte ranges that start and end at line boundaries, and each forked worker process parses
+its ranges into a ColumnStore, with its own string dictionaries.
+The columns of the ranges are merged in the order of the file, so the result is the same as when
+the file is read by a single process: the codes of each range are mapped to the codes of the
+data ingestor.
+A quoted value may contain a line break, so a range can start inside a quoted value. The quotes
+are doubled inside a quoted value, so this is the case when the number of quote characters
+before the start of the range is odd: each worker counts the quotes of its ranges and the file
+is left to the serial csv.reader if any range starts inside a quoted value.
+
+The data ingestor is created while the app package is imported, so the workers send back only
+lists and arrays: unpickling a class of the app package would wait for that import to finish.
+"""
+import csv
+import io
+import multiprocessing
+import os
+from multiprocessing.connection import wait
+from app.columns import ColumnStore
+
+# The maximum size of a byte range, so a worker holds a bounded part of the file in memory
+MAX_RANGE_BYTES = 32 * 1024 * 1024
+
+# (dictionary, column) pairs of the text columns
+TEXT_COLUMNS = (('questions', 'question_column'), ('states', 'state_column'),
+                ('categories', 'category_column'), ('stratifications', 'stratification_column'))
+
+
+def split_ranges(csv_path, num_ranges):
+    """ Split the rows of the csv file, after the header, into at most num_ranges byte ranges
+        that start at the beginning of a line."""
+    size = os.path.getsize(csv_path)
+    with open(csv_path, 'rb') as file:
+        file.readline()
+        bounds = [file.tell()]
+        data_size = size - bounds[0]
+        for index in range(1, num_ranges):
+            # move to the beginning of the line after the approximate bound
+            file.seek(max(bounds[0] + data_size * index // num_ranges, bounds[-1]))
+            file.readline()
+            bounds.append(file.tell())
+    bounds.append(size)
+    return [(start, end) for start, end in zip(bounds, bounds[1:]) if start < end]
+
+
+def read_range(csv_path, start, end, positions):
+    """ Parse a byte range of the csv file into a ColumnStore. Return it with the number of
+        quote characters of the range, or None instead of it if the range can't be parsed,
+        as when it starts inside a quoted value."""
+    with open(csv_path, 'rb') as file:
+        file.seek(start)
+        text = file.read(end - start).decode('utf-8')
+
+    columns = ColumnStore()
+    try:
+        columns.read_rows(csv.reader(io.StringIO(text, newline='')), positions)
+    except (csv.Error, IndexError, ValueError):
+        return None, text.count('"')
+    return columns, text.count('"')
+
+
+def _parse_ranges(connection, csv_path, ranges, positions):
+    """ Parse the given (index, start, end) byte ranges inside a worker process and send,
+        for each of them, its number of quote characters and the values of its dictionaries
+        and its columns (None if it can't be parsed)."""
+    for index, start, end in ranges:
+        columns, num_quotes = read_range(csv_path, start, end, positions)
+        connection.send((index, num_quotes, None if columns is None else
+                         ([getattr(columns, dictionary).values
+                           for dictionary, _ in TEXT_COLUMNS],
+                          [getattr(columns, column) for _, column in TEXT_COLUMNS],
+                          columns.value_column)))
+    connection.close()
+
+
+def merge_range(data_ingestor, dictionaries, columns, value_column):
+    """ Append the columns of a range to the data ingestor, mapping the codes of the range
+        to the codes of the dictionaries of the data ingestor."""
+    for (dictionary, column), values, codes in zip(TEXT_COLUMNS, dictionaries, columns):
+        mapping = [getattr(data_ingestor, dictionary).encode(value) for value in values]
+        getattr(data_ingestor, column).extend(map(mapping.__getitem__, codes))
+    data_ingestor.value_column.extend(value_column)
+
+
+def _start_workers(csv_path, ranges, positions, num_workers):
+    """ Fork the workers, each with its share of the ranges, and return them with the
+        connections their results are received from."""
+    context = multiprocessing.get_context('fork')
+    workers = []
+    connections = []
+    for worker_index in range(num_workers):
+        receiver, sender = context.Pipe(duplex=False)
+        worker = context.Process(target=_parse_ranges, daemon=True,
+                                 args=(sender, csv_path, ranges[worker_index::num_workers],
+                                       positions))
+        worker.start()
+        sender.close()
+        workers.append(worker)
+        connections.append(receiver)
+    return workers, connections
+
+
+def _merge_ranges(data_ingestor, connections):
+    """ Receive the ranges in any order and merge them in the order of the file. Return the
+        number of merged ranges, or None as soon as a range starts inside a quoted value
+        or can't be parsed."""
+    received = {}
+    next_index = 0
+    # the number of quote characters before the next range to merge
+    num_quotes = 0
+    while connections:
+        for connection in wait(connections):
+            try:
+                # (index, number of quotes, (dictionaries, columns, value_column)) of a range
+                index, range_quotes, parsed = connection.recv()
+            except EOFError:
+                connections.remove(connection)
+                continue
+
+            received[index] = (range_quotes, parsed)
+            while next_index in received:
+                range_quotes, parsed = received.pop(next_index)
+                if num_quotes % 2 or parsed is None:
+                    return None
+                merge_range(data_ingestor, *parsed)
+                num_quotes += range_quotes
+                next_index += 1
+    return next_index
+
+
+def read_in_parallel(data_ingestor, csv_path, positions, num_workers):
+    """ Parse the rows of the csv file with num_workers forked processes and append them to
+        the columns of the data ingestor. The ranges are dealt to the workers in turn and
+        each range is merged as soon as the ranges before it are merged.
+        Return False, with some of the rows appended, if a range starts inside a quoted
+        value: the file has to be read again by a single csv.reader."""
+    num_ranges = max(num_workers * 4, os.path.getsize(csv_path) // MAX_RANGE_BYTES + 1)
+    ranges = [(index, start, end)
+              for index, (start, end) in enumerate(split_ranges(csv_path, num_ranges))]
+
+    workers, connections = _start_workers(csv_path, ranges, positions, num_workers)
+    num_merged = _merge_ranges(data_ingestor, connections)
+
+    for worker in workers:
+        if num_merged is None:
+            worker.terminate()
+        worker.join()
+    for connection in connections:
+        connection.close()
+    if num_merged is None:
+        return False
+    if num_merged != len(ranges):
+        raise RuntimeError(f"Failed to parse {len(ranges) - num_merged} parts of {csv_path}")
+    return True
@@ -0,0 +1,116 @@
+""" This module contains the PreforkServer, which serves the Flask application from several
+worker processes, so the HTTP requests are handled by more than one core.
+The application, with its data, is loaded once by the master process before it forks the
+workers: the workers share the memory of the data copy-on-write, as long as they only read it
+(and the columns of a DI_SNAPSHOT are mapped from the same file by all of them). The objects
+loaded before the fork are moved out of the garbage collector with gc.freeze(), so a collection
+in a worker does not write to them and copy their pages.
+Each worker starts its own ThreadPool and serves the requests of the listening socket that the
+master opened, the kernel gives each connection to one of them. The workers share the state of
+the jobs through the SharedState database, see TP_SHARED_STATE.
+"""
+import gc
+import os
+import signal
+import socket
+import time
+import traceback
+from threading import Thread
+from werkzeug.serving import make_server
+
+# The number of seconds between two checks of the workers by the master process
+CHECK_INTERVAL = 0.5
+
+
+class PreforkServer:  # pylint: disable=too-many-instance-attributes
+    """
+    This class is the master process of the pre-fork server. It forks num_workers workers,
+    calls start_worker in each of them, then serves the application on the (host, port)
+    address until it is stopped with SIGTERM or SIGINT. A worker that exits on its own is
+    replaced, unless the server is stopping. stop_worker is called by a worker after it
+    stopped serving requests.
+    """
+    def __init__(self, application, address, num_workers, start_worker, stop_worker):
+        self.application = application
+        self.address = address
+        self.num_workers = num_workers
+        self.start_worker = start_worker
+        self.stop_worker = stop_worker
+        self.listener = None
+        # pid of each worker
+        self.workers = set()
+        self.running = False
+
+    def serve_forever(self):
+        """ Open the listening socket, fork the workers and replace the ones that exit,
+            until the server is stopped. Then wait for the workers to stop."""
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind(self.address)
+        self.listener.listen(socket.SOMAXCONN)
+
+        self.running = True
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+
+        # keep the objects loaded so far out of the collections of the workers
+        gc.freeze()
+        for _ in range(self.num_workers):
+            self.spawn_worker()
+
+        while self.running:
+            time.sleep(CHECK_INTERVAL)
+            for _ in self.reap_workers():
+                if self.running:
+                    self.spawn_worker()
+
+        for pid in self.workers:
+            os.kill(pid, signal.SIGTERM)
+        while self.workers:
+            pid, _ = os.wait()
+            self.workers.discard(pid)
+        self.listener.close()
+
+    def handle_stop(self, _signum, _frame):
+        """ Stop the server after the workers finish their jobs."""
+        self.running = False
+
+    def reap_workers(self):
+        """ Return the pids of the workers that exited."""
+        exited = []
+        while self.workers:
+            pid, _ = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                break
+            self.workers.discard(pid)
+            exited.append(pid)
+        return exited
+
+    def spawn_worker(self):
+        """ Fork a worker process."""
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+
+        exit_code = 0
+        try:
+            self.run_worker()
+        except Exception:  # pylint: disable=broad-exception-caught
+            traceback.print_exc()
+            exit_code = 1
+        finally:
+            # never return to the loop of the master process
+            os._exit(exit_code)
+
+    def run_worker(self):
+        """ Serve the requests in a worker process until it receives SIGTERM, then stop
+            its ThreadPool after the jobs that are already queued."""
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.start_worker()
+        server = make_server(*self.address, self.application, threaded=True,
+                             fd=self.listener.fileno())
+        signal.signal(signal.SIGTERM,
+                      lambda _signum, _frame: Thread(target=server.shutdown).start())
+        server.serve_forever()
+        self.stop_worker()
@@ -0,0 +1,101 @@
+""" This module contains the DataReloader, which loads new data releases without restarting
+the server. A new generation of the data ingestor is built in a background thread, from a new
+csv file or by appending the rows of a csv file to the current generation, and it is swapped
+into the thread pool at once. The jobs that are being computed finish with the previous
+generation, the jobs that are still queued are computed with the new one.
+Nothing is forked while the server runs, since a process forked while another thread holds a
+lock (of the logger, a queue or a store) can deadlock: the csv file is parsed by the reloader
+thread itself, and the reloads are refused with the process backend, whose workers are forked
+when it is created.
+"""
+import os
+import time
+from threading import Thread, Lock
+from app.data_ingestor import DataIngestor
+
+class DataReloader:  # pylint: disable=too-many-instance-attributes
+    """
+    This class builds the new generations of the data ingestor of a thread pool.
+    The csv files are looked up in the directory of the csv file read at startup.
+    A full reload reads the csv file again (or its snapshot) and keeps the configuration of
+    the current generation: materialized aggregates and engine. An append copies the current
+    generation and updates its aggregates and summaries with the appended rows only.
+    Only one generation is built at a time.
+    """
+    def __init__(self, thread_pool, csv_path, snapshot_path=None):
+        self.thread_pool = thread_pool
+        self.csv_path = csv_path
+        self.data_dir = os.path.dirname(os.path.abspath(csv_path))
+        self.snapshot_path = snapshot_path
+        self.lock = Lock()
+        self.generation = 1
+        self.status = "idle"
+        self.error = None
+
+    def resolve_path(self, file_name):
+        """ Return the path of a csv file of the data directory, the startup csv file if
+            no file name is given. Return None if there is no such file."""
+        if not file_name:
+            return self.csv_path
+        csv_path = os.path.join(self.data_dir, os.path.basename(file_name))
+        return csv_path if os.path.isfile(csv_path) else None
+
+    def unsupported_reason(self):
+        """ Return why the data can't be reloaded by this server, or None if it can."""
+        if self.thread_pool.get_executor() == 'process':
+            return "Reloading is not supported with the process backend"
+        if self.thread_pool.shared_state is not None:
+            # each worker process would have its own copy of the data once it changes
+            return "Reloading is not supported with several worker processes"
+        return None
+
+    def start(self, csv_path, append):
+        """ Start building the next generation in a background thread.
+            Return False if a generation is already being built."""
+        with self.lock:
+            if self.status == "running":
+                return False
+            self.status = "running"
+            self.error = None
+
+        Thread(target=self.reload, args=(csv_path, append), daemon=True).start()
+        return True
+
+    def reload(self, csv_path, append):
+        """ Build the next generation of the data ingestor and swap it in."""
+        logger = self.thread_pool.logger
+        start_time = time.time()
+        try:
+            current = self.thread_pool.data_ingestor
+            if append:
+                data_ingestor = DataIngestor(csv_path, base=current)
+            else:
+                data_ingestor = DataIngestor(csv_path, self.snapshot_path)
+                if current.aggregates is not None:
+                    data_ingestor.materialize_aggregates()
+                if current.engine is not None:
+                    data_ingestor.use_numpy_engine()
+
+            self.thread_pool.swap_data_ingestor(data_ingestor)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            logger.exception(f"Failed to load {csv_path}")
+            with self.lock:
+                self.status = "error"
+                self.error = repr(error)
+            return
+
+        with self.lock:
+            self.generation += 1
+            self.status = "idle"
+        logger.info(f"Loaded generation {self.generation} from {csv_path} "
+                    f"in {time.time() - start_time:.3f} seconds")
+
+    def stats(self):
+        """ Return the state of the reloader and the size of the current generation."""
+        with self.lock:
+            return {
+                "generation": self.generation,
+                "status": self.status,
+                "error": self.error,
+                "num_rows": len(self.thread_pool.data_ingestor)
+            }
@@ -0,0 +1,80 @@
+""" This module contains the ResultCache class, a bounded LRU cache for the results of the jobs.
+The results are keyed by the command of the job and its canonical input data, so the same
+request sent again is answered without computing it again.
+"""
+import json
+import time
+from collections import OrderedDict
+from threading import Lock
+
+class ResultCache:
+    """
+    This class keeps the most recently used results, at most max_size of them.
+    A result expires ttl seconds after it was stored (ttl = 0 means it never expires).
+    The number of hits and misses is counted for statistics.
+    """
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(command, input_data):
+        """ Build the key of a request: the command and the input data with sorted keys."""
+        return command + json.dumps(input_data, sort_keys=True, separators=(',', ':'))
+
+    def get(self, key):
+        """ Return the cached result for the key or None if there is no valid result."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.monotonic():
+                # the result expired
+                del self.entries[key]
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, result, question=None):
+        """ Store the result for the key, evicting the least recently used result if
+            the cache is full. The question of the request is kept with the result, so it
+            can be discarded when the data of the question changes."""
+        if self.max_size <= 0:
+            return
+
+        expires_at = time.monotonic() + self.ttl if self.ttl > 0 else None
+        with self.lock:
+            self.entries[key] = (expires_at, result, question)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def discard_questions(self, questions):
+        """ Remove the cached results of the requests for the given questions."""
+        with self.lock:
+            for key in [key for key, entry in self.entries.items() if entry[2] in questions]:
+                del self.entries[key]
+
+    def clear(self):
+        """ Remove all the cached results."""
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        """ Return the counters of the cache."""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl
+            }
@@ -0,0 +1,332 @@
+""" This module contains the result stores, which keep the results of the finished jobs
+until they are requested with /api/get_results:
+    - MemoryResultStore keeps the serialized results in memory
+    - FileResultStore writes the results to the results folder from a background thread
+    - SqliteResultStore keeps the results in the SharedState database, so the worker
+      processes of a pre-fork server can read the results of each other
+Both stores are bounded: the oldest results are evicted when there are more than max_items
+results or more than max_bytes bytes, and a result is dropped retention seconds after it
+was stored (retention = 0 keeps it until it is evicted).
+A result can be shared by several jobs: it is stored once, under the job_id of the job that
+computed it, and it is discarded when all the jobs that share it were discarded.
+"""
+import json
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from queue import Queue, Empty
+from threading import Lock, Thread
+
+class ResultStore(ABC):  # pylint: disable=too-many-instance-attributes
+    """
+    This class contains the bookkeeping shared by the stores: for each job_id it remembers
+    when the result was stored and its size, in the order the results were stored.
+    Each store implements _save, _load and _delete for the serialized results.
+    """
+    def __init__(self, max_items, max_bytes, retention):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+        # job_id of a job that shares the result of another job -> job_id of that job
+        self.shared = {}
+        # job_id of a shared result -> number of jobs that share it and were not discarded
+        self.refcounts = {}
+        self.lock = Lock()
+
+    def put(self, job_id, result, shared_with=()):
+        """ Store the result of the job, shared with the jobs of the given job_ids."""
+        data = json.dumps(result)
+        with self.lock:
+            self._evict(job_id)
+            self.entries[job_id] = (time.monotonic(), len(data))
+            self.total_bytes += len(data)
+            if shared_with:
+                self.refcounts[job_id] = len(shared_with) + 1
+                for other_job_id in shared_with:
+                    self.shared[other_job_id] = job_id
+            self._save(job_id, data)
+            self._enforce_limits()
+
+    def get(self, job_id):
+        """ Return the result of the job or None if it is not (or no longer) stored."""
+        data = self.load_many([job_id]).get(job_id)
+        return None if data is None else json.loads(data)
+
+    def load_many(self, job_ids):
+        """ Return the serialized results of the jobs that are stored, by job_id,
+            with a single lock acquisition."""
+        results = {}
+        with self.lock:
+            self._expire()
+            for job_id in job_ids:
+                stored_job_id = self.shared.get(job_id, job_id)
+                if stored_job_id in self.entries:
+                    data = self._load(stored_job_id)
+                    if data is not None:
+                        results[job_id] = data
+        return results
+
+    def discard(self, job_id):
+        """ Remove the result of the job, if it is stored. A shared result is removed
+            with the last job that shares it."""
+        with self.lock:
+            job_id = self.shared.pop(job_id, job_id)
+            if job_id in self.refcounts:
+                self.refcounts[job_id] -= 1
+                if self.refcounts[job_id]:
+                    return
+            self._evict(job_id)
+
+    def stats(self):
+        """ Return the number of results, the bytes they use and the number of evictions."""
+        with self.lock:
+            self._expire()
+            return {
+                "results": len(self.entries),
+                "bytes_held": self.total_bytes,
+                "evicted": self.evicted,
+                "max_items": self.max_items,
+                "max_bytes": self.max_bytes,
+                "retention": self.retention
+            }
+
+    def close(self):
+        """ Release the resources of the store."""
+
+    def _evict(self, job_id):
+        """ Drop the result of the job. Must be called with the lock held."""
+        self.refcounts.pop(job_id, None)
+        entry = self.entries.pop(job_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+            self._delete(job_id)
+
+    def _expire(self):
+        """ Drop the results older than the retention. Must be called with the lock held."""
+        if self.retention <= 0:
+            return
+
+        deadline = time.monotonic() - self.retention
+        while self.entries:
+            job_id, (stored_at, _) = next(iter(self.entries.items()))
+            if stored_at >= deadline:
+                break
+            self._evict(job_id)
+            self.evicted += 1
+
+    def _enforce_limits(self):
+        """ Drop the oldest results while the store is over its limits.
+            Must be called with the lock held."""
+        self._expire()
+        while self.entries and (0 < self.max_items < len(self.entries) or
+                                0 < self.max_bytes < self.total_bytes):
+            self._evict(next(iter(self.entries)))
+            self.evicted += 1
+
+    @abstractmethod
+    def _save(self, job_id, data):
+        """ Save the serialized result of the job."""
+
+    @abstractmethod
+    def _load(self, job_id):
+        """ Load the serialized result of the job."""
+
+    @abstractmethod
+    def _delete(self, job_id):
+        """ Delete the serialized result of the job."""
+
+
+class MemoryResultStore(ResultStore):
+    """ This class keeps the serialized results in memory. """
+    def __init__(self, max_items, max_bytes, retention):
+        super().__init__(max_items, max_bytes, retention)
+        self.data = {}
+
+    def _save(self, job_id, data):
+        self.data[job_id] = data
+
+    def _load(self, job_id):
+        return self.data.get(job_id)
+
+    def _delete(self, job_id):
+        self.data.pop(job_id, None)
+
+
+class FileResultStore(ResultStore):
+    """
+    This class writes the results to results/job_id{N}.json from a background thread,
+    in batches of at most batch_size results. Until a result is written, it is kept in
+    memory, so it can be returned right away.
+    """
+    def __init__(self, max_items, max_bytes, retention, directory='results', batch_size=64):
+        super().__init__(max_items, max_bytes, retention)
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.batch_size = batch_size
+        self.pending = {}
+        self.pending_bytes = 0
+        self.write_queue = Queue()
+        self.writer = Thread(target=self._write_results, daemon=True)
+        self.writer.start()
+
+    def stats(self):
+        stats = super().stats()
+        with self.lock:
+            stats["bytes_held"] = self.pending_bytes
+            stats["bytes_on_disk"] = self.total_bytes - self.pending_bytes
+        return stats
+
+    def close(self):
+        """ Write the pending results and stop the writer thread."""
+        self.write_queue.put(None)
+        self.writer.join()
+
+    def _path(self, job_id):
+        """ Return the path of the file of the job."""
+        return os.path.join(self.directory, f"job_id{job_id}.json")
+
+    def _save(self, job_id, data):
+        self.pending[job_id] = data
+        self.pending_bytes += len(data)
+        self.write_queue.put(job_id)
+
+    def load_many(self, job_ids):
+        """ Return the serialized results of the jobs that are stored, by job_id. The files
+            are read after the lock is released, so the writer thread and the other
+            requests do not wait for them."""
+        results = {}
+        on_disk = {}
+        with self.lock:
+            self._expire()
+            for job_id in job_ids:
+                stored_job_id = self.shared.get(job_id, job_id)
+                if stored_job_id in self.entries:
+                    data = self.pending.get(stored_job_id)
+                    if data is None:
+                        on_disk[job_id] = stored_job_id
+                    else:
+                        results[job_id] = data
+
+        for job_id, stored_job_id in on_disk.items():
+            # a result evicted meanwhile is not found
+            data = self._read_file(stored_job_id)
+            if data is not None:
+                results[job_id] = data
+        return results
+
+    def _load(self, job_id):
+        data = self.pending.get(job_id)
+        return self._read_file(job_id) if data is None else data
+
+    def _read_file(self, job_id):
+        """ Read the file of the result of the job, None if there is no such file."""
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _delete(self, job_id):
+        data = self.pending.pop(job_id, None)
+        if data is not None:
+            self.pending_bytes -= len(data)
+            return
+
+        self._remove_file(job_id)
+
+    def _write_results(self):
+        """ Write the pending results to files until the None sentinel is received."""
+        running = True
+        while running:
+            # wait for a result, then take the others that are already waiting
+            batch = [self.write_queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.write_queue.get_nowait())
+                except Empty:
+                    break
+
+            for job_id in batch:
+                if job_id is None:
+                    running = False
+                    continue
+
+                with self.lock:
+                    data = self.pending.get(job_id)
+                if data is None:
+                    # the result was discarded before it was written
+                    continue
+
+                with open(self._path(job_id), 'w', encoding='utf-8') as f:
+                    f.write(data)
+
+                with self.lock:
+                    # the result is on disk now, unless it was discarded in the meantime
+                    if self.pending.get(job_id) is data:
+                        del self.pending[job_id]
+                        self.pending_bytes -= len(data)
+                    elif job_id not in self.entries:
+                        self._remove_file(job_id)
+
+    def _remove_file(self, job_id):
+        """ Remove the file of a result that was discarded while it was being written."""
+        try:
+            os.remove(self._path(job_id))
+        except FileNotFoundError:
+            pass
+
+
+class SqliteResultStore(ResultStore):
+    """
+    This class keeps the serialized results in the results table of the shared state and
+    the job_ids that share a result in its shared_results table. The limits apply to the
+    results stored by this process, which evicts them, while the results of all the
+    processes are read from the database.
+    """
+    def __init__(self, max_items, max_bytes, retention, shared_state):
+        super().__init__(max_items, max_bytes, retention)
+        self.shared_state = shared_state
+
+    def put(self, job_id, result, shared_with=()):
+        super().put(job_id, result, shared_with)
+        if shared_with:
+            self.shared_state.execute([("INSERT OR REPLACE INTO shared_results VALUES (?, ?)",
+                                        [(other_job_id, job_id)
+                                         for other_job_id in shared_with])])
+
+    def load_many(self, job_ids):
+        """ Return the serialized results of the jobs that are stored by any process,
+            by job_id."""
+        with self.lock:
+            self._expire()
+        stored_job_ids = dict(self.shared_state.query_many(
+            "SELECT job_id, stored_job_id FROM shared_results WHERE job_id IN ({})", job_ids))
+        data = dict(self.shared_state.query_many(
+            "SELECT job_id, data FROM results WHERE job_id IN ({})",
+            list({stored_job_ids.get(job_id, job_id) for job_id in job_ids})))
+        results = {}
+        for job_id in job_ids:
+            stored_data = data.get(stored_job_ids.get(job_id, job_id))
+            if stored_data is not None:
+                results[job_id] = stored_data
+        return results
+
+    def discard(self, job_id):
+        super().discard(job_id)
+        self.shared_state.execute([("DELETE FROM shared_results WHERE job_id = ?",
+                                    [(job_id,)])])
+
+    def _save(self, job_id, data):
+        self.shared_state.execute([("INSERT OR REPLACE INTO results VALUES (?, ?)",
+                                    [(job_id, data)])])
+
+    def _load(self, job_id):
+        rows = self.shared_state.query("SELECT data FROM results WHERE job_id = ?", (job_id,))
+        return rows[0][0] if rows else None
+
+    def _delete(self, job_id):
+        self.shared_state.execute([("DELETE FROM results WHERE job_id = ?", [(job_id,)])])
@@ -0,0 +1,108 @@
+""" This module contains the ResultStream, which builds the JSON lines (NDJSON) of the results
+of a list of jobs for /api/get_results, in the order the jobs finish: a job that finishes early
+is sent right away, even if a job before it in the list is still running.
+The stream does not wait itself, so both front-ends use it: the Flask routes wait on a
+threading.Event and the ASGI application on an asyncio.Event, set by the on_finish callback.
+"""
+import json
+from app.job import Job
+from app.job_registry import RemoteJob, POLL_INTERVAL
+
+
+def parse_job_id(job_id):
+    """ Get the number of a job_id like job_id_N or None if it is not valid."""
+    try:
+        return int(job_id.split("_")[-1])
+    except (AttributeError, ValueError):
+        return None
+
+
+def missing_job_reason(job_id_nr, max_job_id):
+    """ Get the reason a job_id has no job: it was never given to a job, or its job expired."""
+    if job_id_nr is None or job_id_nr > max_job_id:
+        return "Invalid job_id"
+    return "Job not found"
+
+
+def result_line(job_id, status, reason=None):
+    """ Build the JSON line of a job without a result."""
+    line = {"job_id": job_id, "status": status}
+    if reason is not None:
+        line["reason"] = reason
+    return json.dumps(line) + "\n"
+
+
+class ResultStream:
+    """
+    This class follows the jobs of a list of job_ids until they finish. on_finish is called,
+    without arguments, by the thread that finishes any of the jobs of this process, so the
+    front-end wakes up and takes the lines of the finished jobs. The jobs of other worker
+    processes can't call it, so they are polled, see wait_time.
+    Once the lines reach max_bytes, the remaining results are reported as too large.
+    """
+    def __init__(self, tasks_runner, job_ids, max_bytes, on_finish):
+        self.result_store = tasks_runner.result_store
+        self.max_bytes = max_bytes
+        self.response_bytes = 0
+        self.on_finish = on_finish
+        # Find all the jobs with a single pass over the registry
+        self.pending = list(zip(job_ids, tasks_runner.jobs.get_many([parse_job_id(job_id)
+                                                                      for job_id in job_ids])))
+        self.jobs = tasks_runner.jobs
+        self.followed = [job for _, job in self.pending if isinstance(job, Job)]
+        for job in self.followed:
+            job.add_done_callback(on_finish)
+
+    def take_lines(self):
+        """ Return the lines of the jobs that finished since the last call, in the order
+            they are in the list, and keep following the running ones."""
+        # the status of each job is read once, so a job that finishes meanwhile is in
+        # exactly one of the lists
+        finished = []
+        running = []
+        for job_id, job in self.pending:
+            if job is not None and job.status == "running":
+                running.append((job_id, job))
+            else:
+                finished.append((job_id, job))
+        self.pending = running
+
+        # Read the results of the finished jobs from the store at once
+        results = self.result_store.load_many([job.job_id for _, job in finished
+                                               if job is not None])
+        lines = []
+        for job_id, job in finished:
+            data = None if job is None else results.get(job.job_id)
+            if data is not None and self.response_bytes + len(data) > self.max_bytes:
+                # stop sending results once the response is too large
+                self.response_bytes = self.max_bytes + 1
+                lines.append(result_line(job_id, "error", reason="Response too large"))
+            elif data is not None:
+                self.response_bytes += len(data)
+                lines.append(f'{{"job_id": {json.dumps(job_id)}, "status": "done", '
+                             f'"data": {data}}}\n')
+            elif job is None:
+                # the same reason as /api/get_results/<job_id>
+                lines.append(result_line(job_id, "error", reason=missing_job_reason(
+                    parse_job_id(job_id), self.jobs.max_job_id)))
+            elif job.status == "error":
+                lines.append(result_line(job_id, "error", reason="Job failed"))
+            else:
+                lines.append(result_line(job_id, "error", reason="Result expired"))
+        return lines
+
+    def running_lines(self):
+        """ Return the lines of the jobs that are still running."""
+        return [result_line(job_id, "running") for job_id, _ in self.pending]
+
+    def wait_time(self, remaining):
+        """ Return how long to wait for on_finish, given the remaining time: at most
+            POLL_INTERVAL if a job of another worker process is still running."""
+        if any(isinstance(job, RemoteJob) for _, job in self.pending):
+            return min(remaining, POLL_INTERVAL)
+        return remaining
+
+    def close(self):
+        """ Stop following the jobs."""
+        for job in self.followed:
+            job.remove_done_callback(self.on_finish)
@@ -1,28 +1,33 @@
-""" This file contains the definition of the endpoints for the webserver """
-from flask import request, jsonify
+""" This file contains the definition of the endpoints for the webserver.
+The requests are handled by app/handlers.py, which the ASGI front-end uses as well. """
+import time
+from threading import Event
+from flask import request, jsonify, Response
 from app import webserver
+from app import handlers
+from app.result_stream import ResultStream
 
-def send_job_to_thread_pool(req, api_endpoint):
-    """ Send the job to the thread pool for processing """
-    # Check if ThreadPool is still accepting jobs
-    if not webserver.tasks_runner.accepting_jobs:
-        return jsonify({
-            "status": "error",
-            "reason": "Server is shutting down"
-        })
-
-    # Get request data
-    data = req.json
-
-    # Register job. Don't wait for task to finish
-    job_id = webserver.job_counter
-    webserver.tasks_runner.register_job(job_id, data, api_endpoint)
-
-    # Increment job_id counter
-    webserver.job_counter += 1
+def respond(reply):
+    """ Build the Flask response of a handlers.Reply """
+    response = jsonify(reply.payload)
+    response.status_code = reply.status_code
+    response.headers.update(reply.headers)
+    return response
 
-    # Return associated job_id
-    return jsonify({"job_id": "job_id_" + str(job_id)})
+def send_job_to_thread_pool(req, api_endpoint):
+    """ Send the job to the thread pool for processing.
+        With ?sync=1, cheap jobs are computed right away and their result is returned
+        directly, the same way /api/get_results returns it. """
+    return respond(handlers.submit_job(webserver, req.remote_addr, req.json, api_endpoint,
+                                       req.args.get('sync') in ('1', 'true')))
+
+@webserver.route('/api/batch', methods=['POST'])
+def batch_request():
+    """ Register a batch of jobs with a single request. The request contains
+        {"jobs": [{"endpoint": "/api/states_mean", "data": {"question": ...}}, ...]}
+        and the job_ids are returned in the same order. """
+    webserver.logger.info("Received request for batch")
+    return respond(handlers.submit_batch(webserver, request.remote_addr, request.json))
 
 # Example endpoint definition
 @webserver.route('/api/post_endpoint', methods=['POST'])
@@ -45,43 +50,56 @@ def post_endpoint():
 
 @webserver.route('/api/get_results/<job_id>', methods=['GET'])
 def get_response(job_id):
-    """ Get the result of a job by job_id if exists """
+    """ Get the result of a job by job_id if exists.
+        With ?wait=<seconds>, a running job is waited for until it finishes or
+        the time runs out, instead of returning "running" right away. """
     webserver.logger.info("Received request for job_id: %s", job_id)
-    # Check if job_id is valid
-    job_id_nr = int(job_id.split("_")[-1])
-    if job_id_nr > webserver.job_counter:
-        return jsonify({
-            "status": "error",
-            "reason": "Invalid job_id"
-        })
-
-    # Check if job is still running
-    for job in webserver.tasks_runner.job_list:
-        if job.job_id == job_id_nr:
-            if job.status == "running":
-                return jsonify({
-                    "status": "running"
-                })
-            # If job is done, return the result from the temporary result field if it exists
-            if job.result is not None:
-                return jsonify({
-                    "status": "done",
-                    "data": job.result
-                })
-
-            # If the result was erased, return the result from the file,
-            # store it in a temporary variable and return it
-            job.result = job.get_result_from_file()
-            return jsonify({
-                "status": "done",
-                "data": job.result
-            })
-
-    # If job is not found
-    return jsonify({
-        "status": "error",
-        "reason": "Job not found"
-    })
+    job, reply = handlers.find_job(webserver, job_id)
+    if job is None:
+        return respond(reply)
+
+    # Long poll: block until the job finishes or the wait time runs out
+    wait = handlers.get_wait_time(request)
+    if job.status == "running" and wait > 0:
+        job.wait(wait)
+    return respond(handlers.job_reply(webserver, job))
+
+@webserver.route('/api/get_results', methods=['POST'])
+def get_batch_response():
+    """ Get the results of a list of jobs, sent as {"job_ids": ["job_id_1", ...]}.
+        A JSON line (NDJSON) is streamed for each job as soon as it is not running anymore.
+        With ?wait=<seconds>, the running jobs are waited for at most that long, otherwise
+        they are reported as running. Once the response reaches BATCH_RESULTS_MAX_BYTES
+        (default 16MB), the remaining results are reported as too large. """
+    job_ids = handlers.batch_job_ids(request.json)
+    if job_ids is None:
+        return respond(handlers.error_reply("Invalid request", 400))
+    webserver.logger.info("Received request for the results of %d jobs", len(job_ids))
+    return Response(stream_results(job_ids, handlers.get_wait_time(request),
+                                   handlers.get_batch_results_max_bytes()),
+                    mimetype='application/x-ndjson')
+
+def stream_results(job_ids, wait, max_bytes):
+    """ Generate the JSON lines with the results of the jobs, as they finish """
+    finished = Event()
+    stream = ResultStream(webserver.tasks_runner, job_ids, max_bytes, finished.set)
+    deadline = time.monotonic() + wait
+    try:
+        while True:
+            # a job that finishes from now on sets the event again
+            finished.clear()
+            yield from stream.take_lines()
+            if not stream.pending:
+                return
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                yield from stream.running_lines()
+                return
+            # Wait for any running job, then send all the jobs that finished meanwhile
+            finished.wait(stream.wait_time(remaining))
+    finally:
+        stream.close()
 
 @webserver.route('/api/states_mean', methods=['POST'])
 def states_mean_request():
@@ -144,38 +162,46 @@ def state_mean_by_category_request():
 def graceful_shutdown_request():
     """ Gracefully shutdown the server """
     webserver.logger.info("Received request for graceful_shutdown")
-    # Signal the tasks_runner to stop accepting new jobs
-    if not webserver.tasks_runner.accepting_jobs:
-        return jsonify({
-            "status": "error",
-            "reason": "Server is already shutting down"
-        })
-
-    webserver.tasks_runner.stop()
-
-    # Return a response
-    return jsonify({"status": "shutting down"})
+    return respond(handlers.shut_down(webserver))
 
 @webserver.route('/api/jobs', methods=['GET'])
 def jobs_request():
     """ Get the list of all jobs and their status """
     webserver.logger.info("Received request for jobs")
-    jobs = []
-    for job in webserver.tasks_runner.job_list:
-        jobs.append({
-            "job_id": job.job_id,
-            "status": job.status
-        })
-
-    return jsonify(jobs)
+    return respond(handlers.list_jobs(webserver))
 
 @webserver.route('/api/num_jobs', methods=['GET'])
 def num_jobs_request():
     """ Get the number of jobs that are currently running - in the job_queue """
     webserver.logger.info("Received request for num_jobs")
-    # Get the number of jobs in the job_queue
-    num_jobs = webserver.tasks_runner.job_queue.qsize()
-    return jsonify({"num_jobs": num_jobs})
+    return respond(handlers.count_jobs(webserver))
+
+@webserver.route('/api/cache_stats', methods=['GET'])
+def cache_stats_request():
+    """ Get the hit/miss counters and the size of the result cache """
+    webserver.logger.info("Received request for cache_stats")
+    return jsonify(webserver.tasks_runner.result_cache.stats())
+
+@webserver.route('/api/result_store_stats', methods=['GET'])
+def result_store_stats_request():
+    """ Get the number of stored results and the bytes they use """
+    webserver.logger.info("Received request for result_store_stats")
+    return jsonify(webserver.tasks_runner.result_store.stats())
+
+@webserver.route('/api/admin/reload', methods=['POST'])
+def reload_request():
+    """ Load a new data release in the background, without restarting the server.
+        The request contains {"file": name of a csv file of the data directory, "append": bool}.
+        Without a file, the startup csv file is read again. With append, the rows of the file
+        are appended to the current data instead of replacing it. """
+    webserver.logger.info("Received request for reload with data: %s", request.json)
+    return respond(handlers.start_reload(webserver, request.json))
+
+@webserver.route('/api/admin/reload', methods=['GET'])
+def reload_status_request():
+    """ Get the generation of the data and the state of the last reload """
+    webserver.logger.info("Received request for reload status")
+    return jsonify(webserver.reloader.stats())
 
 # You can check localhost in your browser to see what this displays
 @webserver.route('/')
@@ -0,0 +1,121 @@
+""" This module contains the JobScheduler, the queue of the jobs of the ThreadPool.
+Every command has a cost class and every class has its own queues, so a flood of expensive jobs
+does not starve the cheap ones: the classes are served by weighted fair dequeuing (smooth
+weighted round-robin), each class getting a share of the turns proportional to its weight.
+Inside a class, the jobs with a higher priority are taken first and the jobs with the same
+priority in the order they were queued.
+"""
+from collections import deque
+from threading import Condition
+
+# The cost class of each command, the jobs of a class have a cost of the same order:
+#   - light: a single value of a question or the rows of a single state
+#   - medium: a value for each state of a question
+#   - heavy: the groups of all the rows of a question
+COST_CLASSES = {
+    '/api/state_mean': 'light',
+    '/api/global_mean': 'light',
+    '/api/state_diff_from_mean': 'light',
+    '/api/state_mean_by_category': 'light',
+    '/api/states_mean': 'medium',
+    '/api/diff_from_mean': 'medium',
+    '/api/best5': 'medium',
+    '/api/worst5': 'medium',
+    '/api/mean_by_category': 'heavy',
+}
+DEFAULT_CLASS = 'medium'
+
+# The classes, from the cheapest to the most expensive
+CLASS_ORDER = ('light', 'medium', 'heavy')
+
+# The default weights of the classes
+DEFAULT_WEIGHTS = {'light': 4, 'medium': 2, 'heavy': 1}
+
+# The priorities a client can give to a request, from the highest to the lowest
+PRIORITIES = ('high', 'normal', 'low')
+DEFAULT_PRIORITY = 'normal'
+
+
+def cost_class(command):
+    """ Return the cost class of the command."""
+    return COST_CLASSES.get(command, DEFAULT_CLASS)
+
+
+def split_priority(data):
+    """ Remove the optional priority field from the input data of a request, so it does not
+        change the result or its cache key. Return the data and the priority, the default
+        one if the field is missing or unknown."""
+    if not isinstance(data, dict) or 'priority' not in data:
+        return data, DEFAULT_PRIORITY
+    data = dict(data)
+    priority = data.pop('priority')
+    return data, priority if priority in PRIORITIES else DEFAULT_PRIORITY
+
+
+class JobScheduler:
+    """
+    This class is a blocking queue of jobs with a queue for each (cost class, priority) pair.
+    The given weights replace the default weights of their classes.
+    get() takes a job from the class chosen by smooth weighted round-robin among the classes
+    that have queued jobs. A None put in the scheduler is a shutdown sentinel: it is returned
+    by get() only after all the queued jobs were taken.
+    """
+    def __init__(self, weights=None):
+        self.weights = dict(DEFAULT_WEIGHTS)
+        self.weights.update(weights or {})
+        self.queues = {name: {priority: deque() for priority in PRIORITIES}
+                       for name in self.weights}
+        # the current weight of each class, see _next_class
+        self.current_weights = dict.fromkeys(self.weights, 0)
+        self.size = 0
+        self.sentinels = 0
+        self.condition = Condition()
+
+    def put(self, job, priority=DEFAULT_PRIORITY):
+        """ Queue the job with the given priority, or a shutdown sentinel if job is None."""
+        with self.condition:
+            if job is None:
+                self.sentinels += 1
+            else:
+                self.queues[cost_class(job.command)][priority].append(job)
+                self.size += 1
+            self.condition.notify()
+
+    def get(self):
+        """ Take the next job, waiting until there is one. Return None for a sentinel."""
+        with self.condition:
+            while not self.size and not self.sentinels:
+                self.condition.wait()
+
+            if not self.size:
+                self.sentinels -= 1
+                return None
+
+            queues = self.queues[self._next_class()]
+            self.size -= 1
+            for priority in PRIORITIES:
+                if queues[priority]:
+                    return queues[priority].popleft()
+            return None
+
+    def _next_class(self):
+        """ Choose the class of the next job among the classes with queued jobs: each of them
+            gains its weight, the one with the largest current weight is chosen and loses the
+            sum of the weights. Must be called with the lock held."""
+        ready = [name for name, queues in self.queues.items()
+                 if any(queues[priority] for priority in PRIORITIES)]
+        for name in ready:
+            self.current_weights[name] += self.weights[name]
+        chosen = max(ready, key=self.current_weights.__getitem__)
+        self.current_weights[chosen] -= sum(self.weights[name] for name in ready)
+        return chosen
+
+    def qsize(self):
+        """ Return the number of queued jobs, including the stale entries of the jobs that
+            were claimed with an earlier job of their question."""
+        with self.condition:
+            return self.size
+
+    def empty(self):
+        """ Check if there is no queued job."""
+        return self.qsize() == 0
@@ -0,0 +1,121 @@
+""" This module contains the SharedState, the SQLite database through which the worker
+processes of a pre-fork server share the state of the jobs:
+    - the status of every registered job, see SharedJobRegistry
+    - the results of the finished jobs, see SqliteResultStore
+    - the counters: the next block of job_ids to reserve and the largest registered job_id,
+      see JobIdBlockAllocator
+Any worker can then answer /api/get_results for a job registered by another worker.
+The database is opened in WAL mode, so the readers do not wait for the writers.
+"""
+import os
+import sqlite3
+from threading import Lock
+
+# The tables of the shared state
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY, status TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS results (job_id INTEGER PRIMARY KEY, data TEXT NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS shared_results (job_id INTEGER PRIMARY KEY, "
+    "stored_job_id INTEGER NOT NULL)",
+    "CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO counters VALUES ('next_job_id', 1), ('max_job_id', 0)",
+)
+
+# The maximum number of parameters of a query, SQLite allows at least 999
+MAX_PARAMETERS = 500
+
+
+class SharedState:
+    """
+    This class holds a connection to the SQLite database of the shared state, guarded by
+    a lock so the threads of a process can share it. A connection must not be used by
+    a forked process, so each process opens its own connection the first time it uses
+    the database.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.connection = None
+        # the process that opened the connection
+        self.pid = None
+        self.lock = Lock()
+
+    def _connect(self):
+        """ Return the connection of the current process, opening it (and creating the
+            tables) if needed. Must be called with the lock held."""
+        if self.pid != os.getpid():
+            # the connection of the parent process is left alone, the parent still uses it
+            self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None,
+                                              check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                self.connection.execute(statement)
+            self.pid = os.getpid()
+        return self.connection
+
+    def query(self, sql, parameters=()):
+        """ Run a query and return all its rows."""
+        with self.lock:
+            return self._connect().execute(sql, parameters).fetchall()
+
+    def query_many(self, sql, values):
+        """ Run a query with an IN ({}) clause for the values, in chunks of at most
+            MAX_PARAMETERS values, and return all the rows."""
+        rows = []
+        with self.lock:
+            connection = self._connect()
+            for start in range(0, len(values), MAX_PARAMETERS):
+                chunk = values[start:start + MAX_PARAMETERS]
+                rows.extend(connection.execute(sql.format(','.join('?' * len(chunk))),
+                                               chunk).fetchall())
+        return rows
+
+    def execute(self, statements):
+        """ Run the (sql, list of parameters) statements in a single transaction. Each
+            statement is run once for each parameters of its list."""
+        with self.lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, parameters in statements:
+                    connection.executemany(sql, parameters)
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+
+    def reserve_job_ids(self, num_ids):
+        """ Reserve num_ids consecutive job_ids that no other process will allocate.
+            Return the first of them."""
+        with self.lock:
+            connection = self._connect()
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                first, = connection.execute("SELECT value FROM counters "
+                                            "WHERE name = 'next_job_id'").fetchone()
+                connection.execute("UPDATE counters SET value = ? WHERE name = 'next_job_id'",
+                                   (first + num_ids,))
+            except sqlite3.Error:
+                connection.execute("ROLLBACK")
+                raise
+            connection.execute("COMMIT")
+        return first
+
+    def reset(self):
+        """ Remove the jobs and results of a previous run of the server."""
+        self.execute([("DELETE FROM jobs", [()]),
+                      ("DELETE FROM results", [()]),
+                      ("DELETE FROM shared_results", [()]),
+                      ("UPDATE counters SET value = ?", [(0,)]),
+                      ("UPDATE counters SET value = 1 WHERE name = 'next_job_id'", [()])])
+
+    def close(self):
+        """ Close the connection of the current process, before it forks the workers."""
+        with self.lock:
+            if self.pid == os.getpid():
+                self.connection.close()
+            self.connection = None
+            self.pid = None
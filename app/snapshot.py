@@ -0,0 +1,140 @@
+""" This module writes and loads the binary snapshot of a DataIngestor, so the csv file does not
+have to be parsed again at every start. The snapshot is memory-mapped when it is loaded: the
+columns are views over the mapped file, so they are read from disk only when they are used and
+their pages are shared by all the processes that load the same snapshot.
+
+The layout of the snapshot file is:
+    - the magic string LSSNAP01
+    - the length of the header, as a little-endian 8 bytes unsigned integer
+    - the header, in JSON: the size, the modification time and the SHA-256 hash of the csv file,
+      the string dictionaries, the indexes and the position of each column
+    - the columns, each one starting at an offset aligned to 64 bytes
+A snapshot is valid if the size and the modification time of the csv file did not change or,
+when only the modification time changed, if the hash of the csv file is the same.
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+MAGIC = b'LSSNAP01'
+HEADER_LENGTH = struct.Struct('<Q')
+ALIGNMENT = 64
+
+COLUMNS = ('question_column', 'state_column', 'category_column', 'stratification_column',
+           'value_column')
+DICTIONARIES = ('questions', 'states', 'categories', 'stratifications')
+
+
+def _align(offset):
+    """ Round the offset up to a multiple of ALIGNMENT."""
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def file_hash(path):
+    """ Return the SHA-256 hash of the file, read in chunks of 1MB."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def write_snapshot(data_ingestor, csv_path, snapshot_path):
+    """ Write the snapshot of the data ingestor read from csv_path. The file is written next to
+        its final path and then renamed, so a snapshot is never read while it is written."""
+    stat = os.stat(csv_path)
+    header = {
+        'csv': {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                'sha256': file_hash(csv_path)},
+        'byteorder': sys.byteorder,
+        'dictionaries': {name: getattr(data_ingestor, name).values for name in DICTIONARIES},
+        'question_index': [[question, rows.start, rows.stop]
+                           for question, rows in data_ingestor.question_index.items()],
+        'question_state_index': [[question, state, rows.start, rows.stop] for
+                                 (question, state), rows in
+                                 data_ingestor.question_state_index.items()],
+        'columns': {}
+    }
+
+    # the offsets of the columns are relative to the start of the data, after the header
+    offset = 0
+    for name in COLUMNS:
+        column = getattr(data_ingestor, name)
+        header['columns'][name] = [offset, len(column), column.typecode, column.itemsize]
+        offset = _align(offset + len(column) * column.itemsize)
+
+    header = json.dumps(header).encode('utf-8')
+
+    temporary_path = snapshot_path + '.tmp'
+    with open(temporary_path, 'wb') as file:
+        file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+        for name in COLUMNS:
+            file.write(b'\0' * (_align(file.tell()) - file.tell()))
+            file.write(getattr(data_ingestor, name))
+    os.replace(temporary_path, snapshot_path)
+
+
+def _is_valid(header, csv_path):
+    """ Check if the snapshot with the given header can be used for the csv file."""
+    if header['byteorder'] != sys.byteorder:
+        return False
+    for _, _, typecode, itemsize in header['columns'].values():
+        if array(typecode).itemsize != itemsize:
+            return False
+
+    stat = os.stat(csv_path)
+    if stat.st_size != header['csv']['size']:
+        return False
+    return stat.st_mtime_ns == header['csv']['mtime_ns'] or \
+           file_hash(csv_path) == header['csv']['sha256']
+
+
+def _map_columns(mapped, data_start, positions):
+    """ Return the columns as views over the mapped file, or None if the file is too short."""
+    data = memoryview(mapped)[data_start:]
+    columns = {}
+    for name, (offset, length, typecode, itemsize) in positions.items():
+        if offset + length * itemsize > len(data):
+            return None
+        columns[name] = data[offset:offset + length * itemsize].cast(typecode)
+    return columns
+
+
+def load_snapshot(data_ingestor, csv_path, snapshot_path):
+    """ Load the snapshot into the data ingestor, if it exists and it is still valid for
+        the csv file. Return True if it was loaded."""
+    try:
+        with open(snapshot_path, 'rb') as file:
+            if file.read(len(MAGIC)) != MAGIC:
+                return False
+            (header_length,) = HEADER_LENGTH.unpack(file.read(HEADER_LENGTH.size))
+            header = json.loads(file.read(header_length))
+            if not _is_valid(header, csv_path):
+                return False
+            # the mapping stays valid after the file is closed
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, KeyError, struct.error):
+        return False
+
+    columns = _map_columns(mapped, _align(len(MAGIC) + HEADER_LENGTH.size + header_length),
+                           header['columns'])
+    if columns is None:
+        return False
+    for name, column in columns.items():
+        setattr(data_ingestor, name, column)
+
+    for name, values in header['dictionaries'].items():
+        dictionary = getattr(data_ingestor, name)
+        for value in values:
+            dictionary.encode(value)
+
+    data_ingestor.question_index = {question: slice(start, stop)
+                                    for question, start, stop in header['question_index']}
+    data_ingestor.question_state_index = {(question, state): slice(start, stop) for
+                                          question, state, start, stop in
+                                          header['question_state_index']}
+    return True
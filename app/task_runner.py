@@ -1,20 +1,54 @@
 """ This module contains the ThreadPool and TaskRunner classes for multi-threading. """
-from queue import Queue
-from threading import Thread, Event, Lock
+from threading import Thread, Lock
 import os
+import time
 from app.job import Job
+from app.scheduler import JobScheduler, CLASS_ORDER, PRIORITIES, cost_class, split_priority
+from app.executors import ThreadBackend, ProcessBackend
+from app.result_cache import ResultCache
+from app.result_store import MemoryResultStore, FileResultStore, SqliteResultStore
+from app.job_registry import JobRegistry, JobIdAllocator, SharedJobRegistry, JobIdBlockAllocator
+from app.shared_state import SharedState
+from app.admission import Overloaded, ServiceTimes, TokenBucketLimiter
 
-class ThreadPool:
+class ThreadPool:  # pylint: disable=too-many-instance-attributes,too-many-public-methods
     """ ThreadPool class is a pool of threads that execute tasks from the job_queue. """
     def __init__(self):
         """ Initialize the ThreadPool. """
-        self.job_queue = Queue()
-        self.job_list = []
+        self.job_queue = JobScheduler(self.get_class_weights())
         self.tasks = []
+        # protects the state of the submitted jobs: pending, in flight and their counters
         self.lock = Lock()
         self.data_ingestor = None
         self.accepting_jobs = True
         self.logger = None
+        self.backend = None
+        # backend -> number of jobs being computed with it, see acquire_backend
+        self.backend_users = {}
+        # protects the data ingestor, the backend and their users, so the TaskRunner threads
+        # take it to start and finish a computation without contending with the submissions
+        self.backend_lock = Lock()
+        # the state shared with the other worker processes, None for a single process
+        self.shared_state = self.create_shared_state()
+        self.job_ids = JobIdAllocator() if self.shared_state is None else \
+                       JobIdBlockAllocator(self.shared_state)
+        self.result_cache = ResultCache(self.get_cache_size(), self.get_cache_ttl())
+        self.result_store = self.create_result_store()
+        self.jobs = self.create_job_registry()
+        # (question, priority) -> {job_id -> job} of the queued jobs that no thread has
+        # claimed yet, see claim_jobs
+        self.pending_jobs = {}
+        # command -> number of the pending jobs, to estimate the time to compute them
+        self.pending_commands = {}
+        self.num_pending = 0
+        # key of a request -> the job of the request that is pending or running, and
+        # job_id of that job -> the identical jobs that share its computation, see _submit
+        self.in_flight = {}
+        self.followers = {}
+        # admission control of the submissions, see register_job
+        self.max_queued = self.get_max_queued()
+        self.service_times = ServiceTimes()
+        self.client_limiter = self.create_client_limiter()
 
     def start(self, data_ingestor, logger):
         """ Start the thread pool: create and run the threads."""
@@ -22,23 +56,84 @@ class ThreadPool:
         self.logger = logger
         self.logger.info(f"Starting ThreadPool with {num_threads} threads")
         self.data_ingestor = data_ingestor
+        self.logger.info(f"Using the {self.get_executor()} execution backend")
+        self.backend = self.create_backend(data_ingestor)
+
         for _ in range(num_threads):
-            task_runner = TaskRunner(self.job_queue, self.lock, self.data_ingestor)
+            task_runner = TaskRunner(self)
             task_runner.start()
             self.tasks.append(task_runner)
 
     def stop(self):
         """ Don't accept new tasks and wait for the current tasks to finish."""
-        self.accepting_jobs = False
-
-        for task in self.tasks:
-            task.shutdown.set()
+        # Stop accepting jobs and wake up each task with a sentinel placed after the
+        # jobs that are already in the queue, so they are still run before stopping
+        with self.lock:
+            self.accepting_jobs = False
+            for _ in self.tasks:
+                self.job_queue.put(None)
         self.logger.info("Sent shutdown signal to all tasks")
 
         for task in self.tasks:
             task.join()
+        self.backend.shutdown()
+        self.result_store.close()
         self.logger.info("All tasks have stopped")
 
+    def create_backend(self, data_ingestor):
+        """ Create the execution backend of the jobs for the data ingestor."""
+        if self.get_executor() == 'process':
+            return ProcessBackend(data_ingestor, self.get_num_threads(), self.logger)
+        return ThreadBackend(data_ingestor)
+
+    def swap_data_ingestor(self, data_ingestor):
+        """ Swap in a new generation of the data ingestor. The jobs that are being computed
+            finish with the previous generation and its backend is shut down after them.
+            The cached results that the new generation may change are removed: only the ones
+            of the appended questions if it was appended to the previous generation.
+            Raise ValueError with the process backend, whose worker processes can only be
+            forked before the TaskRunner threads are started."""
+        if self.get_executor() == 'process':
+            raise ValueError("The data ingestor can't be swapped with the process backend")
+        backend = self.create_backend(data_ingestor)
+        with self.backend_lock:
+            previous_backend = self.backend
+            self.data_ingestor = data_ingestor
+            self.backend = backend
+            if data_ingestor.appended_questions is None:
+                self.result_cache.clear()
+            else:
+                self.result_cache.discard_questions(data_ingestor.appended_questions)
+            unused = previous_backend not in self.backend_users
+        with self.lock:
+            # the next requests do not follow the jobs that may run with the previous generation
+            self.in_flight.clear()
+
+        if unused:
+            previous_backend.shutdown()
+        self.logger.info(f"Swapped in a data ingestor with {len(data_ingestor)} rows")
+
+    def acquire_backend(self):
+        """ Return the current backend and count the job computed with it, so it is not
+            shut down before the job is done, even if a new generation is swapped in."""
+        with self.backend_lock:
+            backend = self.backend
+            self.backend_users[backend] = self.backend_users.get(backend, 0) + 1
+        return backend
+
+    def release_backend(self, backend):
+        """ Count the end of a job computed with the backend and shut the backend down
+            if it was replaced and this was its last job."""
+        with self.backend_lock:
+            self.backend_users[backend] -= 1
+            unused = not self.backend_users[backend]
+            if unused:
+                del self.backend_users[backend]
+            retired = unused and backend is not self.backend
+
+        if retired:
+            backend.shutdown()
+
     def get_num_threads_from_env_var(self):
         """
         Check if an environment variable TP_NUM_OF_THREADS is defined.
@@ -56,39 +151,377 @@ class ThreadPool:
         num_threads = self.get_num_threads_from_env_var()
         return os.cpu_count() if num_threads is None else int(num_threads)
 
+    def get_executor(self):
+        """
+        Check if an environment variable TP_EXECUTOR is defined.
+        If the env var is 'process', the jobs are computed in a pool of worker processes
+        (one process for each thread). Otherwise, they are computed in the threads.
+        """
+        executor = os.environ.get('TP_EXECUTOR', 'thread')
+        return 'process' if executor == 'process' else 'thread'
+
+    def get_class_weights(self):
+        """
+        Check if an environment variable TP_CLASS_WEIGHTS is defined, as a list of
+        class=weight pairs separated by commas (for example "light=4,medium=2,heavy=1").
+        If the env var is defined, these are the weights of the cost classes of the jobs
+        in the scheduler. Otherwise, the default weights are used.
+        """
+        weights = {}
+        for pair in os.environ.get('TP_CLASS_WEIGHTS', '').split(','):
+            if '=' in pair:
+                name, weight = pair.split('=', 1)
+                weights[name.strip()] = max(int(weight), 0)
+        return weights
+
+    def get_max_queued(self):
+        """
+        Check if an environment variable TP_MAX_QUEUED is defined.
+        If the env var is defined, that is the maximum number of queued jobs: the jobs
+        submitted above it are rejected (0 = no limit). Otherwise, it is 10000.
+        """
+        return int(os.environ.get('TP_MAX_QUEUED', 10000))
+
+    def create_client_limiter(self):
+        """
+        Create the limiter of the submissions of each client, configured by environment
+        variables:
+            - AC_CLIENT_RATE: jobs per second a client can submit (default 0 = no limit)
+            - AC_CLIENT_BURST: jobs a client can submit at once (default 20)
+        """
+        return TokenBucketLimiter(float(os.environ.get('AC_CLIENT_RATE', 0)),
+                                  int(os.environ.get('AC_CLIENT_BURST', 20)))
+
+    def get_cache_size(self):
+        """
+        Check if an environment variable RC_MAX_SIZE is defined.
+        If the env var is defined, that is the maximum number of cached results
+        (0 disables the cache). Otherwise, at most 1024 results are cached.
+        """
+        return int(os.environ.get('RC_MAX_SIZE', 1024))
+
+    def get_cache_ttl(self):
+        """
+        Check if an environment variable RC_TTL is defined.
+        If the env var is defined, that is the number of seconds a cached result is valid
+        (0 means forever). Otherwise, the results are valid for 600 seconds.
+        """
+        return float(os.environ.get('RC_TTL', 600))
+
+    def create_shared_state(self):
+        """
+        Check if an environment variable TP_SHARED_STATE is defined.
+        If the env var is defined, it is the path of the SQLite database in which the
+        worker processes of a pre-fork server share the jobs, their results and the job_ids.
+        Otherwise, the state of the jobs is kept by this process only and None is returned.
+        """
+        path = os.environ.get('TP_SHARED_STATE')
+        return SharedState(path) if path else None
+
+    def create_result_store(self):
+        """
+        Create the store for the results of the jobs, configured by environment variables:
+            - RS_BACKEND: 'memory' keeps the results in memory, otherwise they are written
+              to the results folder by a background thread. With a shared state (see
+              create_shared_state), the results are kept in its database instead
+            - RS_MAX_ITEMS: maximum number of results kept (default 100000, 0 = no limit)
+            - RS_MAX_BYTES: maximum size of the results kept (default 512MB, 0 = no limit)
+            - RS_RETENTION: seconds a result is kept (default 0 = until it is evicted)
+        """
+        max_items = int(os.environ.get('RS_MAX_ITEMS', 100000))
+        max_bytes = int(os.environ.get('RS_MAX_BYTES', 512 * 1024 * 1024))
+        retention = float(os.environ.get('RS_RETENTION', 0))
+
+        if self.shared_state is not None:
+            return SqliteResultStore(max_items, max_bytes, retention, self.shared_state)
+        if os.environ.get('RS_BACKEND', 'file') == 'memory':
+            return MemoryResultStore(max_items, max_bytes, retention)
+        return FileResultStore(max_items, max_bytes, retention)
+
+    def create_job_registry(self):
+        """
+        Create the registry of the jobs, configured by environment variables:
+            - JR_MAX_FINISHED: maximum number of finished jobs kept (default 100000, 0 = no limit)
+            - JR_MAX_AGE: seconds a finished job is kept (default 0 = no limit)
+        The result of an expired job is removed from the result store. With a shared state
+        (see create_shared_state), the jobs of all the worker processes can be found.
+        """
+        max_finished = int(os.environ.get('JR_MAX_FINISHED', 100000))
+        max_age = float(os.environ.get('JR_MAX_AGE', 0))
+        if self.shared_state is not None:
+            return SharedJobRegistry(max_finished, max_age, self.shared_state,
+                                     on_expire=lambda job: self.result_store.discard(job.job_id))
+        return JobRegistry(max_finished, max_age,
+                           on_expire=lambda job: self.result_store.discard(job.job_id))
+
     def register_job(self, job_id, data, type_command):
         """ Register a job and add it to the job_queue as long as
-            the ThreadPool is accepting jobs."""
-        if not self.accepting_jobs:
+            the ThreadPool is accepting jobs. If the result of the same request
+            is cached, the job is completed right away instead, and if an identical
+            job is pending or running, the job shares its computation (see _submit).
+            The data may contain the priority of the job, see split_priority.
+            Raise Overloaded if the job would exceed the maximum number of queued jobs."""
+        data, priority = split_priority(data)
+        job = Job(job_id, data, type_command, self.logger)
+        key = ResultCache.make_key(type_command, data)
+        cached_result = self.result_cache.get(key)
+
+        self.jobs.add(job)
+        if not self._queue([job], [key], [priority], [cached_result]):
             self.logger.info("Not accepting jobs - ThreadPool is shutting down.")
             return
 
-        job = Job(job_id, data, type_command, self.logger)
+        if cached_result is not None:
+            job.complete(self.result_store, cached_result)
+            self.jobs.mark_finished(job)
+            self.logger.info(f"Completed job with job_id: {job_id} from the cache")
+            return
+
         self.logger.info(f"Registered job with job_id: {job_id}")
 
+    def register_jobs(self, requests):
+        """ Register a batch of jobs, given as (job_id, data, type_command) tuples, with a
+            single lock acquisition. The jobs that share a question and a priority are
+            claimed together, see claim_jobs.
+            The jobs with a cached result are completed right away and the identical
+            jobs share a single computation (see _submit). The batch is rejected, raising
+            Overloaded, if its jobs would exceed the maximum number of queued jobs."""
+        jobs = []
+        priorities = []
+        for job_id, data, type_command in requests:
+            data, priority = split_priority(data)
+            jobs.append(Job(job_id, data, type_command, self.logger))
+            priorities.append(priority)
+        keys = [ResultCache.make_key(job.command, job.input_data) for job in jobs]
+        cached_results = [self.result_cache.get(key) for key in keys]
+
+        self.jobs.add_many(jobs)
+        if not self._queue(jobs, keys, priorities, cached_results):
+            self.logger.info("Not accepting jobs - ThreadPool is shutting down.")
+            return
+
+        for job, cached_result in zip(jobs, cached_results):
+            if cached_result is not None:
+                job.complete(self.result_store, cached_result)
+                self.jobs.mark_finished(job)
+
+        self.logger.info(f"Registered {len(jobs)} jobs")
+
+    def _queue(self, jobs, keys, priorities, cached_results):
+        """ Submit the registered jobs that do not have a cached result, with a single lock
+            acquisition. The jobs are registered before, outside the lock, so the submissions
+            hold it only for the admission and the job_queue, and a TaskRunner always finds
+            the jobs it takes in the registry. If the jobs are rejected, they are removed from
+            the registry: return False if the ThreadPool is not accepting jobs, or raise
+            Overloaded if they would exceed the maximum number of queued jobs."""
+        try:
+            with self.lock:
+                if not self.accepting_jobs:
+                    accepted = False
+                else:
+                    # only the first job of each request that is not in flight is queued
+                    self._admit(len({key for key, cached_result in zip(keys, cached_results)
+                                     if cached_result is None} - self.in_flight.keys()))
+                    for job, key, priority, cached_result in zip(jobs, keys, priorities,
+                                                                 cached_results):
+                        if cached_result is None:
+                            self._submit(job, key, priority)
+                    accepted = True
+        except Overloaded:
+            self.jobs.remove_many(jobs)
+            raise
+
+        if not accepted:
+            self.jobs.remove_many(jobs)
+        return accepted
+
+    def _admit(self, num_jobs):
+        """ Check that num_jobs more jobs can be queued. Otherwise raise Overloaded, with
+            the expected time for the threads to compute the pending jobs.
+            Must be called with the lock held."""
+        if self.max_queued and self.num_pending + num_jobs > self.max_queued:
+            raise Overloaded(503, "Too many queued jobs",
+                             self.service_times.drain_time(self.pending_commands,
+                                                           len(self.tasks)))
+
+    def _submit(self, job, key, priority):
+        """ Queue the job, unless an identical job (same command and input data) is pending
+            or running: then the job follows that job instead, so it gets the same result
+            without computing it again. Must be called with the lock held."""
+        leader = self.in_flight.get(key)
+        if leader is not None:
+            self.followers[leader.job_id].append(job)
+            return
+
+        self.in_flight[key] = job
+        self.followers[job.job_id] = []
+        self._enqueue(job, priority)
+
+    def _take_followers(self, job):
+        """ Remove the job from the jobs in flight and return the jobs that follow it."""
+        key = ResultCache.make_key(job.command, job.input_data)
+        with self.lock:
+            if self.in_flight.get(key) is job:
+                del self.in_flight[key]
+            return self.followers.pop(job.job_id, [])
+
+    def _enqueue(self, job, priority):
+        """ Add the job to the job_queue, with its priority, and to the pending jobs of
+            its question and priority. Must be called with the lock held."""
+        group = (job.input_data.get('question'), priority)
+        self.pending_jobs.setdefault(group, {})[job.job_id] = job
+        self.pending_commands[job.command] = self.pending_commands.get(job.command, 0) + 1
+        self.num_pending += 1
+        self.job_queue.put(job, priority)
+
+    def claim_jobs(self, job):
+        """ Claim the job taken from the job_queue together with the other pending jobs of
+            its question that have the same priority, so they are computed at once, sharing
+            a single pass over the rows of the question (see compute_group).
+            A group is claimed by one of its most expensive jobs, so it is scheduled by the
+            weight of their cost class and a cheap job does not make an expensive group jump
+            the queue of its class. Return an empty list if the job was already claimed with
+            its group, or if its group has a more expensive job: its entry in the job_queue
+            is skipped and the group is claimed with the entry of that job."""
+        question = job.input_data.get('question')
+        job_rank = CLASS_ORDER.index(cost_class(job.command))
+        with self.lock:
+            for priority in PRIORITIES:
+                group = (question, priority)
+                pending = self.pending_jobs.get(group)
+                if pending is not None and job.job_id in pending:
+                    break
+            else:
+                return []
+            if any(CLASS_ORDER.index(cost_class(other.command)) > job_rank
+                   for other in pending.values()):
+                return []
+            del self.pending_jobs[group]
+            for claimed_job in pending.values():
+                self.pending_commands[claimed_job.command] -= 1
+            self.num_pending -= len(pending)
+        return list(pending.values())
+
+    def num_pending_jobs(self):
+        """ Return the number of queued jobs that no thread has claimed yet."""
+        return self.num_pending
+
+    def num_pending_jobs_by_class(self):
+        """ Return the number of queued jobs that no thread has claimed yet,
+            for each cost class."""
+        num_jobs = dict.fromkeys(self.job_queue.weights, 0)
         with self.lock:
-            self.job_queue.put(job)
-            self.job_list.append(job)
+            for command, count in self.pending_commands.items():
+                num_jobs[cost_class(command)] += count
+        return num_jobs
+
+    def get_fast_path_max_rows(self):
+        """
+        Check if an environment variable FAST_PATH_MAX_ROWS is defined.
+        If the env var is defined, that is the maximum estimated number of rows of a job
+        that is computed synchronously on the request thread. Otherwise, it is 5000.
+        """
+        return int(os.environ.get('FAST_PATH_MAX_ROWS', 5000))
+
+    def compute_inline(self, data, type_command):
+        """ Compute the result of a request on the calling thread, without registering
+            a job, if it is cached or if its estimated cost is below the threshold.
+            Return None if the request has to go through register_job."""
+        data, _ = split_priority(data)
+        key = ResultCache.make_key(type_command, data)
+        cached_result = self.result_cache.get(key)
+        if cached_result is not None:
+            return cached_result
+
+        data_ingestor = self.data_ingestor
+        job = Job(0, data, type_command, self.logger)
+        if job.estimate_cost(data_ingestor) > self.get_fast_path_max_rows():
+            return None
+
+        result = job.compute(data_ingestor)
+        with self.backend_lock:
+            # a result of a previous generation of the data ingestor is not cached
+            if data_ingestor is self.data_ingestor:
+                self.result_cache.put(key, result, data.get('question'))
+        return result
+
+    def complete_job(self, job, result, backend=None):
+        """ Store the result of a job computed by a TaskRunner and cache it, unless it was
+            computed with the backend of a previous generation of the data ingestor.
+            The jobs that follow it share its stored result."""
+        followers = self._take_followers(job)
+        job.complete(self.result_store, result, followers)
+        for finished_job in (job, *followers):
+            self.jobs.mark_finished(finished_job)
+        if result is not None:
+            with self.backend_lock:
+                if backend is None or backend is self.backend:
+                    self.result_cache.put(ResultCache.make_key(job.command, job.input_data),
+                                          result, job.input_data.get('question'))
+
+    def fail_job(self, job):
+        """ Mark a job whose computation raised an exception, and the jobs that follow it,
+            as failed."""
+        followers = self._take_followers(job)
+        job.fail(followers)
+        for finished_job in (job, *followers):
+            self.jobs.mark_finished(finished_job)
 
 
 class TaskRunner(Thread):
     """ TaskRunner class is a thread that runs tasks from the job_queue. """
-    def __init__(self, job_queue, lock, data_ingestor):
-        super().__init__()
-        self.job_queue = job_queue
-        self.shutdown = Event()
-        self.lock = lock
-        self.data_ingestor = data_ingestor
+    def __init__(self, thread_pool):
+        super().__init__(daemon=True)
+        self.thread_pool = thread_pool
 
     def run(self):
-        """ Run task as long as the shutdown event is not set. """
-        while not self.shutdown.is_set() or not self.job_queue.empty():
-            # get the task from the queue, if available and execute it
-            self.lock.acquire()
-
-            if not self.job_queue.empty():
-                job = self.job_queue.get()
-                self.lock.release()
-                job.run(self.data_ingestor)
+        """ Run tasks until the shutdown sentinel (None) is taken from the queue.
+            The thread sleeps in job_queue.get() while there is nothing to do."""
+        while True:
+            job = self.thread_pool.job_queue.get()
+            if job is None:
+                break
+
+            # Take the other pending jobs of the same question and priority as well
+            jobs = self.thread_pool.claim_jobs(job)
+            if len(jobs) == 1:
+                self.run_job(jobs[0])
+            elif jobs:
+                self.run_group(jobs)
+
+    def run_group(self, jobs):
+        """ Compute the jobs of the same question together and store their results."""
+        backend = self.thread_pool.acquire_backend()
+        start_time = time.perf_counter()
+        try:
+            results = backend.compute_group(jobs)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            self.thread_pool.logger.exception(f"Group of {len(jobs)} jobs failed")
+            results = [error] * len(jobs)
+        finally:
+            self.thread_pool.release_backend(backend)
+
+        # the jobs of the group share its service time
+        service_time = (time.perf_counter() - start_time) / len(jobs)
+        for job, result in zip(jobs, results):
+            self.thread_pool.service_times.record(job.command, service_time)
+            if isinstance(result, Exception):
+                self.thread_pool.logger.error(f"Job {job.job_id} failed: {result!r}")
+                self.thread_pool.fail_job(job)
             else:
-                self.lock.release()
+                self.thread_pool.complete_job(job, result, backend)
+
+    def run_job(self, job):
+        """ Compute the job and store its result, or mark it as failed."""
+        backend = self.thread_pool.acquire_backend()
+        start_time = time.perf_counter()
+        try:
+            result = backend.compute(job)
+            self.thread_pool.service_times.record(job.command, time.perf_counter() - start_time)
+            self.thread_pool.complete_job(job, result, backend)
+        except Exception:  # pylint: disable=broad-exception-caught
+            # Keep the thread alive for the next jobs and report the failed one
+            self.thread_pool.logger.exception(f"Job {job.job_id} failed")
+            self.thread_pool.fail_job(job)
+        finally:
+            self.thread_pool.release_backend(backend)
@@ -0,0 +1,7 @@
+""" Run the server with the ASGI front-end, see app/asgi.py. """
+from app import webserver
+from app.asgi import create_application
+
+# The ASGI front-end of the same server, run it with an ASGI server:
+#   uvicorn asgi_server:application
+application = create_application(webserver)
@@ -0,0 +1,71 @@
+"""
+Benchmark for the engines of the DataIngestor: compares the pure-Python path with the
+NumPy engine (DI_ENGINE=numpy) for every endpoint.
+
+For each endpoint it runs the job for every question (and for every state, for the endpoints
+that take a state) and measures the time of a round. The summaries of the questions are
+cleared before each job, so every job computes its groups from the rows.
+
+Run it from the root of the repository (importing the app package loads the csv file):
+    python benchmarks/engine_benchmark.py [path to the csv file]
+"""
+import os
+import sys
+import time
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.data_ingestor import DataIngestor  # pylint: disable=wrong-import-position
+from app.job import Job, COMMANDS  # pylint: disable=wrong-import-position
+
+ROUNDS = 5
+CSV_PATH = './nutrition_activity_obesity_usa_subset.csv'
+STATE_COMMANDS = ('/api/state_mean', '/api/state_diff_from_mean', '/api/state_mean_by_category')
+
+
+def make_jobs(data_ingestor, command):
+    """ Create the jobs of the command for every question (and every state). """
+    questions = list(data_ingestor.questions.values)
+    states = [state for state in data_ingestor.states.values if state]
+    if command not in STATE_COMMANDS:
+        return [Job(0, {'question': question}, command, Mock()) for question in questions]
+    return [Job(0, {'question': question, 'state': state}, command, Mock())
+            for question in questions for state in states
+            if data_ingestor.state_rows(question, state).stop]
+
+
+def measure(data_ingestor, jobs):
+    """ Return the best time of a round of the jobs, in seconds. """
+    best = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        for job in jobs:
+            data_ingestor.summaries.clear()
+            job.compute(data_ingestor)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    """ Run the benchmark for every endpoint with both engines. """
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else CSV_PATH
+    data_ingestor = DataIngestor(csv_path)
+    print(f"{len(data_ingestor)} rows, best of {ROUNDS} rounds")
+
+    for command in COMMANDS:
+        jobs = make_jobs(data_ingestor, command)
+
+        data_ingestor.engine = None
+        python_time = measure(data_ingestor, jobs)
+        data_ingestor.use_numpy_engine()
+        numpy_time = measure(data_ingestor, jobs)
+        data_ingestor.engine = None
+
+        print(f"{command:>28}: {len(jobs):5d} jobs, python {python_time * 1e3:8.2f} ms, "
+              f"numpy {numpy_time * 1e3:8.2f} ms, speedup {python_time / numpy_time:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+"""
+Benchmark for the ingestion of the csv file with several worker processes (DI_INGEST_WORKERS).
+
+For each number of workers it measures the time to load the csv file into a DataIngestor and,
+separately, the time of the index (the counting sort of the rows by question and state). The
+index is built by the main process after the rows are merged, whatever the number of workers,
+so only the parsing is split across the workers: the last column is the best speedup that the
+parsing alone allows with that many workers, given the serial index (Amdahl's law).
+The workers only run in parallel on as many cores as the machine has: the number of cores is
+printed first, the timings of more workers than cores show the overhead of the split only.
+
+Run it from the root of the repository:
+    python benchmarks/ingest_benchmark.py [path to the csv file] [numbers of workers...]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.data_ingestor import DataIngestor  # pylint: disable=wrong-import-position
+
+ROUNDS = 3
+CSV_PATH = './nutrition_activity_obesity_usa_subset.csv'
+
+
+def measure(csv_path, num_workers):
+    """ Return the best time to load the csv file and the best time of its index,
+        in seconds. """
+    best_load = best_index = None
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        data_ingestor = DataIngestor(csv_path, num_workers=num_workers)
+        load_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        data_ingestor._build_index()  # pylint: disable=protected-access
+        index_time = time.perf_counter() - start
+
+        best_load = load_time if best_load is None else min(best_load, load_time)
+        best_index = index_time if best_index is None else min(best_index, index_time)
+    return best_load, best_index
+
+
+def main():
+    """ Run the benchmark for every number of workers. """
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else CSV_PATH
+    counts = [int(count) for count in sys.argv[2:]] or [1, 2, 4, 8]
+    print(f"{os.cpu_count()} cores, best of {ROUNDS} rounds")
+
+    serial_load, serial_index = measure(csv_path, 1)
+    serial_parse = serial_load - serial_index
+    for num_workers in counts:
+        load_time, index_time = (serial_load, serial_index) if num_workers == 1 else \
+                                measure(csv_path, num_workers)
+        bound = serial_load / (serial_index + serial_parse / num_workers)
+        print(f"{num_workers:3d} workers: load {load_time * 1e3:8.1f} ms "
+              f"(index {index_time * 1e3:6.1f} ms), speedup {serial_load / load_time:5.2f}x, "
+              f"bound {bound:5.2f}x")
+
+
+if __name__ == '__main__':
+    main()
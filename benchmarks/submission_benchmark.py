@@ -0,0 +1,120 @@
+"""
+Stress benchmark for the submission of jobs from many request threads at once.
+
+Several threads submit jobs to a running ThreadPool concurrently, the way the request threads
+of a multi-threaded server do, while the TaskRunner threads compute them. The benchmark checks
+that every job got a unique job_id and was registered, and measures the submission throughput.
+
+For comparison, it also runs the old allocation (read webserver.job_counter, register the job,
+then increment the counter, without a lock) from the same number of threads and counts the
+job_ids given twice.
+
+Run it from the root of the repository:
+    python benchmarks/submission_benchmark.py [number of threads] [jobs per thread]
+"""
+import os
+import sys
+import time
+from threading import Thread, Barrier
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.data_ingestor import DataIngestor  # pylint: disable=wrong-import-position
+from app.task_runner import ThreadPool  # pylint: disable=wrong-import-position
+from app.job import COMMANDS  # pylint: disable=wrong-import-position
+
+CSV_PATH = './nutrition_activity_obesity_usa_subset.csv'
+NUM_THREADS = 16
+JOBS_PER_THREAD = 2000
+
+
+def run_threads(num_threads, target):
+    """ Run target(index) in num_threads threads started together and return the elapsed time,
+        in seconds."""
+    barrier = Barrier(num_threads + 1)
+
+    def run(index):
+        barrier.wait()
+        target(index)
+
+    threads = [Thread(target=run, args=(index,)) for index in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def submit_jobs(thread_pool, requests, num_threads, jobs_per_thread):
+    """ Submit the jobs from num_threads threads. Return the job_ids given to each thread and
+        the elapsed time."""
+    job_ids = [[] for _ in range(num_threads)]
+
+    def submit(index):
+        for number in range(jobs_per_thread):
+            data, command = requests[(index * jobs_per_thread + number) % len(requests)]
+            job_id = thread_pool.job_ids.allocate()
+            thread_pool.register_job(job_id, data, command)
+            job_ids[index].append(job_id)
+
+    return job_ids, run_threads(num_threads, submit)
+
+
+def count_racy_duplicates(num_threads, jobs_per_thread):
+    """ Allocate the job_ids the old way, from num_threads threads, and return the number
+        of job_ids given more than once. The registration of the job, between the read and
+        the increment of the counter, is replaced by time.sleep(0), which lets the other
+        threads run like the registration did when it waited for the lock."""
+    webserver = Mock()
+    webserver.job_counter = 1
+    job_ids = [[] for _ in range(num_threads)]
+
+    def allocate(index):
+        for _ in range(jobs_per_thread):
+            job_id = webserver.job_counter
+            time.sleep(0)
+            job_ids[index].append(job_id)
+            webserver.job_counter += 1
+
+    run_threads(num_threads, allocate)
+    all_ids = [job_id for ids in job_ids for job_id in ids]
+    return len(all_ids) - len(set(all_ids))
+
+
+def main():
+    """ Run the stress benchmark and check the job_ids. """
+    num_threads = int(sys.argv[1]) if len(sys.argv) > 1 else NUM_THREADS
+    jobs_per_thread = int(sys.argv[2]) if len(sys.argv) > 2 else JOBS_PER_THREAD
+    total = num_threads * jobs_per_thread
+
+    # no limit on the queue and no cached results, so every job is registered and queued
+    os.environ.setdefault('TP_MAX_QUEUED', '0')
+    os.environ.setdefault('RC_MAX_SIZE', '0')
+    os.environ.setdefault('RS_BACKEND', 'memory')
+
+    data_ingestor = DataIngestor(CSV_PATH)
+    requests = [({'question': question}, command)
+                for question in data_ingestor.questions.values
+                for command in COMMANDS if 'state' not in command]
+
+    thread_pool = ThreadPool()
+    thread_pool.start(data_ingestor, Mock())
+    job_ids, elapsed = submit_jobs(thread_pool, requests, num_threads, jobs_per_thread)
+    thread_pool.stop()
+
+    all_ids = [job_id for ids in job_ids for job_id in ids]
+    unique = len(set(all_ids)) == total and all(ids == sorted(ids) for ids in job_ids)
+    registered = len(thread_pool.jobs) == total
+    print(f"{num_threads} threads x {jobs_per_thread} jobs: {total / elapsed:10.0f} jobs/s, "
+          f"unique job_ids: {unique}, all registered: {registered}")
+    print(f"old job_counter: {count_racy_duplicates(num_threads, jobs_per_thread)} "
+          f"duplicate job_ids")
+    if not (unique and registered):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
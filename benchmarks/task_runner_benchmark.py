@@ -0,0 +1,161 @@
+"""
+Benchmark for the TaskRunner loop: compares the old busy-spinning loop with the current one,
+which blocks on the job queue.
+
+For each loop it measures:
+    - the CPU time used by the process while the threads are idle
+    - the latency of a job, from the moment it is put in the queue until it has run
+
+Run it from the root of the repository (importing the app package loads the csv file):
+    python benchmarks/task_runner_benchmark.py
+"""
+import os
+import sys
+import time
+from queue import Queue
+from threading import Thread, Event, Lock
+from unittest.mock import Mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.task_runner import TaskRunner  # pylint: disable=wrong-import-position
+from app.admission import ServiceTimes  # pylint: disable=wrong-import-position
+
+IDLE_SECONDS = 2
+NUM_JOBS = 200
+# The number of seconds to wait for a job before the benchmark fails
+JOB_TIMEOUT = 10
+
+
+class SpinningTaskRunner(Thread):
+    """ The TaskRunner loop before the change: it polls the queue under a lock. """
+    def __init__(self, job_queue, lock):
+        super().__init__(daemon=True)
+        self.job_queue = job_queue
+        self.shutdown = Event()
+        self.lock = lock
+
+    def run(self):
+        while not self.shutdown.is_set() or not self.job_queue.empty():
+            self.lock.acquire()
+            if not self.job_queue.empty():
+                job = self.job_queue.get()
+                self.lock.release()
+                job.run(None)
+            else:
+                self.lock.release()
+
+
+class TimedJob:  # pylint: disable=too-few-public-methods
+    """ A job that does nothing but record when it was run. """
+    def __init__(self):
+        self.job_id = 0
+        self.command = '/api/global_mean'
+        self.submitted = time.perf_counter()
+        self.done = Event()
+        self.latency = None
+
+    def run(self, _data_ingestor):
+        """ Run the job the way the old loop did. """
+        self.complete(None, None)
+
+    def complete(self, _result_store, _result):
+        """ Record the latency of the job. """
+        self.latency = time.perf_counter() - self.submitted
+        self.done.set()
+
+
+class NoopBackend:  # pylint: disable=too-few-public-methods
+    """ A backend with nothing to compute. """
+    def compute(self, _job):
+        """ Return an empty result. """
+
+
+class BenchmarkPool:  # pylint: disable=too-few-public-methods
+    """ The parts of the ThreadPool used by the TaskRunner threads. """
+    def __init__(self, job_queue):
+        self.job_queue = job_queue
+        self.backend = NoopBackend()
+        self.service_times = ServiceTimes()
+        self.logger = Mock()
+
+    def claim_jobs(self, job):
+        """ Each job is claimed on its own. """
+        return [job]
+
+    def acquire_backend(self):
+        """ There is a single backend. """
+        return self.backend
+
+    def release_backend(self, _backend):
+        """ The backend is never replaced. """
+
+    def complete_job(self, job, result, _backend=None):
+        """ Complete the job without storing or caching its result. """
+        job.complete(None, result)
+
+    def fail_job(self, job):
+        """ Finish a failed job without a latency, so the benchmark stops. """
+        job.done.set()
+
+
+def measure(name, job_queue, runners, stop):
+    """ Measure the idle CPU use and the job latency of the given runners. """
+    for runner in runners:
+        runner.start()
+
+    cpu_start = time.process_time()
+    time.sleep(IDLE_SECONDS)
+    idle_cpu = (time.process_time() - cpu_start) / IDLE_SECONDS
+
+    latencies = []
+    for _ in range(NUM_JOBS):
+        job = TimedJob()
+        job_queue.put(job)
+        if not job.done.wait(JOB_TIMEOUT):
+            raise RuntimeError(f"{name}: a job did not finish in {JOB_TIMEOUT} seconds")
+        if job.latency is None:
+            raise RuntimeError(f"{name}: a job failed, see the log of the TaskRunner")
+        latencies.append(job.latency)
+
+    stop()
+    latencies.sort()
+    print(f"{name:>9}: idle CPU {idle_cpu * 100:6.1f}% of a core, "
+          f"job latency median {latencies[len(latencies) // 2] * 1e6:8.1f} us, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1e6:8.1f} us")
+
+
+def main():
+    """ Run the benchmark for both loops with the same number of threads. """
+    num_threads = int(os.environ.get('TP_NUM_OF_THREADS', os.cpu_count()))
+    print(f"{num_threads} threads, {IDLE_SECONDS}s idle, {NUM_JOBS} jobs")
+
+    # before: busy-spinning loop
+    job_queue = Queue()
+    lock = Lock()
+    runners = [SpinningTaskRunner(job_queue, lock) for _ in range(num_threads)]
+
+    def stop_spinning():
+        for runner in runners:
+            runner.shutdown.set()
+        for runner in runners:
+            runner.join()
+
+    measure("spinning", job_queue, runners, stop_spinning)
+
+    # after: blocking loop
+    job_queue = Queue()
+    pool = BenchmarkPool(job_queue)
+    runners = [TaskRunner(pool) for _ in range(num_threads)]
+
+    def stop_blocking():
+        for _ in runners:
+            job_queue.put(None)
+        for runner in runners:
+            runner.join()
+
+    measure("blocking", job_queue, runners, stop_blocking)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,24 @@
+""" Run the server in several worker processes, forked after the data is loaded.
+The number of workers is given by SERVER_WORKERS (default: the number of cores) and the
+address by SERVER_HOST and SERVER_PORT (default 127.0.0.1:5000). The workers share the state
+of the jobs through the SQLite database TP_SHARED_STATE (default results/shared_state.db).
+"""
+import os
+
+os.environ.setdefault('TP_SHARED_STATE', 'results/shared_state.db')
+os.environ['TP_START_AFTER_FORK'] = '1'
+
+# pylint: disable=wrong-import-position
+from app import webserver, start_worker, stop_worker
+from app.prefork import PreforkServer
+
+if __name__ == '__main__':
+    # forget the jobs of a previous run and let each worker open its own connection
+    webserver.tasks_runner.shared_state.reset()
+    webserver.tasks_runner.shared_state.close()
+
+    PreforkServer(webserver,
+                  (os.environ.get('SERVER_HOST', '127.0.0.1'),
+                   int(os.environ.get('SERVER_PORT', 5000))),
+                  int(os.environ.get('SERVER_WORKERS', os.cpu_count())),
+                  start_worker, stop_worker).serve_forever()
@@ -0,0 +1,59 @@
+""" This module is responsible for testing the admission control classes."""
+import unittest
+from unittest.mock import patch
+from app.admission import Overloaded, ServiceTimes, TokenBucketLimiter, DEFAULT_SERVICE_TIME
+
+class TestAdmission(unittest.TestCase):
+    """ This class is responsible for testing the ServiceTimes and TokenBucketLimiter classes."""
+    def test_service_times(self):
+        """
+        This method tests the moving average of the service times and the drain time.
+        """
+        service_times = ServiceTimes(0.5)
+        self.assertEqual(service_times.estimate('/api/best5'), DEFAULT_SERVICE_TIME)
+
+        service_times.record('/api/best5', 1.0)
+        service_times.record('/api/best5', 3.0)
+        self.assertEqual(service_times.estimate('/api/best5'), 2.0)
+
+        service_times.record('/api/global_mean', 0.5)
+        self.assertEqual(service_times.drain_time({'/api/best5': 3, '/api/global_mean': 4}, 2),
+                         4.0)
+
+    @patch('app.admission.time.monotonic')
+    def test_token_bucket(self, monotonic):
+        """
+        This method tests that a client is limited to its burst and then to its rate,
+        independently of the other clients.
+        """
+        monotonic.return_value = 100.0
+        limiter = TokenBucketLimiter(2, 3)
+        limiter.acquire('a', 2)
+        limiter.acquire('a')
+        with self.assertRaises(Overloaded) as context:
+            limiter.acquire('a')
+        self.assertEqual((context.exception.status_code, context.exception.retry_after), (429, 1))
+        limiter.acquire('b', 3)
+
+        # after 1 second, 2 tokens are back
+        monotonic.return_value = 101.0
+        limiter.acquire('a', 2)
+        with self.assertRaises(Overloaded):
+            limiter.acquire('a')
+
+        # a batch larger than the burst needs a full bucket
+        monotonic.return_value = 110.0
+        limiter.acquire('a', 10)
+        with self.assertRaises(Overloaded) as context:
+            limiter.acquire('a', 10)
+        self.assertEqual(context.exception.retry_after, 2)
+
+    def test_no_limit(self):
+        """
+        This method tests that a rate of 0 disables the limit.
+        """
+        limiter = TokenBucketLimiter(0, 1)
+        for _ in range(100):
+            limiter.acquire('a')
+        self.assertEqual(limiter.buckets, {})
+
@@ -0,0 +1,242 @@
+""" This module is responsible for testing the ASGI front-end."""
+import unittest
+import os
+import shutil
+import json
+import asyncio
+from unittest.mock import Mock
+from app.task_runner import ThreadPool
+from app.data_ingestor import DataIngestor
+from app.reloader import DataReloader
+from app.asgi import create_application
+
+class TestAsgiApplication(unittest.TestCase):
+    """ This class is responsible for testing the AsgiApplication class."""
+    def aux_data_ingestor(self):
+        """ This method is used to create a sample csv file for data ingestor."""
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Test,30,Gender,Male\n')
+            file.write('1,Alaska,Test,25,Gender,Female\n')
+
+        di = DataIngestor(csv_path)
+
+        # remove the sample csv file
+        os.remove(csv_path)
+
+        return di
+
+    def aux_webserver(self):
+        """ This method is used to create a webserver with a ThreadPool that is not started."""
+        webserver = Mock()
+        webserver.prefork = False
+        webserver.tasks_runner = ThreadPool()
+        webserver.tasks_runner.logger = Mock()
+        return webserver
+
+    async def aux_request(self, application, method, path, body=None, query_string=b''):
+        """ This method sends a request to the application and returns the status code,
+            the headers and the body of the response."""
+        scope = {'type': 'http', 'method': method, 'path': path,
+                 'query_string': query_string, 'client': ('127.0.0.1', 1234)}
+        messages = [{'type': 'http.request', 'more_body': False,
+                     'body': b'' if body is None else json.dumps(body).encode('utf-8')}]
+        response = {'body': b''}
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+                response['headers'] = dict(message['headers'])
+            else:
+                response['body'] += message.get('body', b'')
+
+        await application(scope, receive, send)
+        return response['status'], response['headers'], response['body']
+
+    def test_job_request(self):
+        """
+        This method tests that a job is registered and that a client waiting for its result
+        is answered when the job finishes.
+        """
+        webserver = self.aux_webserver()
+        application = create_application(webserver)
+
+        async def scenario():
+            _, _, body = await self.aux_request(application, 'POST', '/api/global_mean',
+                                                {'question': 'Test'})
+            self.assertEqual(json.loads(body), {'job_id': 'job_id_1'})
+
+            # no thread is running yet, so the job can't finish
+            _, _, body = await self.aux_request(application, 'GET', '/api/get_results/job_id_1',
+                                                query_string=b'wait=0.1')
+            self.assertEqual(json.loads(body), {'status': 'running'})
+
+            # the waiting client is answered once the threads start
+            waiting = asyncio.ensure_future(
+                self.aux_request(application, 'GET', '/api/get_results/job_id_1',
+                                 query_string=b'wait=5'))
+            await asyncio.sleep(0.1)
+            webserver.tasks_runner.start(self.aux_data_ingestor(), Mock())
+            _, _, body = await waiting
+            self.assertEqual(json.loads(body), {'status': 'done',
+                                                'data': {'global_mean': 27.5}})
+
+            _, _, body = await self.aux_request(application, 'GET', '/api/get_results/job_id_2')
+            self.assertEqual(json.loads(body), {'status': 'error', 'reason': 'Invalid job_id'})
+
+        asyncio.run(scenario())
+        webserver.tasks_runner.stop()
+
+    def test_remote_job(self):
+        """
+        This method tests that a client waits for the job of another worker process,
+        read from the shared state, until it finishes.
+        """
+        os.environ['TP_SHARED_STATE'] = 'shared_test/state.db'
+        webserver = self.aux_webserver()
+        other_webserver = self.aux_webserver()
+        os.environ.pop('TP_SHARED_STATE')
+        application = create_application(webserver)
+        other_tasks_runner = other_webserver.tasks_runner
+        other_tasks_runner.register_job(other_tasks_runner.job_ids.allocate(),
+                                        {'question': 'Test'}, '/api/global_mean')
+
+        async def scenario():
+            waiting = asyncio.ensure_future(
+                self.aux_request(application, 'GET', '/api/get_results/job_id_1',
+                                 query_string=b'wait=5'))
+            await asyncio.sleep(0.1)
+            self.assertFalse(waiting.done())
+            other_tasks_runner.complete_job(other_tasks_runner.jobs.get(1),
+                                            {'global_mean': 27.5})
+            _, _, body = await waiting
+            self.assertEqual(json.loads(body), {'status': 'done',
+                                                'data': {'global_mean': 27.5}})
+
+            _, _, body = await self.aux_request(application, 'GET', '/api/jobs')
+            self.assertEqual(json.loads(body), [{'job_id': 1, 'status': 'done'}])
+
+        asyncio.run(scenario())
+        shutil.rmtree('shared_test')
+
+    def test_get_batch_response(self):
+        """
+        This method tests that the results of a batch of jobs are streamed as JSON lines.
+        """
+        webserver = self.aux_webserver()
+        webserver.tasks_runner.start(self.aux_data_ingestor(), Mock())
+        application = create_application(webserver)
+
+        async def scenario():
+            _, _, body = await self.aux_request(application, 'POST', '/api/batch', {'jobs': [
+                {'endpoint': '/api/global_mean', 'data': {'question': 'Test'}},
+                {'endpoint': '/api/state_mean', 'data': {'question': 'Test'}}]})
+            job_ids = json.loads(body)['job_ids']
+
+            status, headers, body = await self.aux_request(
+                application, 'POST', '/api/get_results',
+                {'job_ids': job_ids + ['job_id_9']}, b'wait=5')
+            self.assertEqual(status, 200)
+            self.assertEqual(headers[b'content-type'], b'application/x-ndjson')
+            lines = sorted((json.loads(line) for line in body.decode().splitlines()),
+                           key=lambda line: line['job_id'])
+            self.assertEqual(lines, [
+                {'job_id': 'job_id_1', 'status': 'done', 'data': {'global_mean': 27.5}},
+                {'job_id': 'job_id_2', 'status': 'error', 'reason': 'Job failed'},
+                {'job_id': 'job_id_9', 'status': 'error', 'reason': 'Invalid job_id'}])
+
+        asyncio.run(scenario())
+        webserver.tasks_runner.stop()
+
+    def test_invalid_requests(self):
+        """
+        This method tests the answers to unknown routes, invalid JSON and rejected jobs.
+        """
+        webserver = self.aux_webserver()
+        webserver.tasks_runner.max_queued = 1
+        application = create_application(webserver)
+
+        async def scenario():
+            status, _, _ = await self.aux_request(application, 'GET', '/api/unknown')
+            self.assertEqual(status, 404)
+
+            scope = {'type': 'http', 'method': 'POST', 'path': '/api/global_mean',
+                     'query_string': b'', 'client': ('127.0.0.1', 1234)}
+            sent = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b'{not json', 'more_body': False}
+
+            async def send(message):
+                sent.append(message)
+
+            await application(scope, receive, send)
+            self.assertEqual(sent[0]['status'], 400)
+
+            # a body that is not an object is rejected as well
+            for path, body in (('/api/global_mean', ['Test']), ('/api/batch', None),
+                               ('/api/get_results', ['job_id_1']),
+                               ('/api/get_results', {'job_ids': 'job_id_1'})):
+                status, _, body = await self.aux_request(application, 'POST', path, body)
+                self.assertEqual((status, json.loads(body)),
+                                 (400, {'status': 'error', 'reason': 'Invalid request'}))
+
+            # the queue holds a single job, the next one is rejected
+            await self.aux_request(application, 'POST', '/api/global_mean', {'question': 'Test'})
+            status, headers, _ = await self.aux_request(application, 'POST', '/api/best5',
+                                                        {'question': 'Test'})
+            self.assertEqual(status, 503)
+            self.assertIn(b'retry-after', headers)
+
+        asyncio.run(scenario())
+
+    def test_reload_request(self):
+        """
+        This method tests that /api/admin/reload loads a csv file of the data directory in
+        the background and reports the new generation, and that the invalid reloads are
+        refused.
+        """
+        os.makedirs('reload_test', exist_ok=True)
+        csv_path = os.path.join('reload_test', 'appended.csv')
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('2,Alabama,Test,40,Gender,Male\n')
+        webserver = self.aux_webserver()
+        webserver.tasks_runner.start(self.aux_data_ingestor(), Mock())
+        webserver.reloader = DataReloader(webserver.tasks_runner, csv_path)
+        application = create_application(webserver)
+
+        async def scenario():
+            _, _, body = await self.aux_request(application, 'POST', '/api/admin/reload',
+                                                {'file': 'appended.csv', 'append': True})
+            self.assertEqual(json.loads(body), {'status': 'reloading'})
+            for _ in range(500):
+                _, _, body = await self.aux_request(application, 'GET', '/api/admin/reload')
+                if json.loads(body)['status'] != 'running':
+                    break
+                await asyncio.sleep(0.01)
+            self.assertEqual(json.loads(body), {'generation': 2, 'status': 'idle',
+                                                'error': None, 'num_rows': 3})
+
+            _, _, body = await self.aux_request(application, 'POST', '/api/admin/reload',
+                                                {'file': 'missing.csv'})
+            self.assertEqual(json.loads(body), {'status': 'error',
+                                                'reason': 'Invalid file: missing.csv'})
+            status, _, _ = await self.aux_request(application, 'POST', '/api/admin/reload',
+                                                  ['appended.csv'])
+            self.assertEqual(status, 400)
+
+            os.environ['TP_EXECUTOR'] = 'process'
+            _, _, body = await self.aux_request(application, 'POST', '/api/admin/reload')
+            os.environ.pop('TP_EXECUTOR')
+            self.assertEqual(json.loads(body)['reason'],
+                             "Reloading is not supported with the process backend")
+
+        asyncio.run(scenario())
+        webserver.tasks_runner.stop()
+        shutil.rmtree('reload_test')
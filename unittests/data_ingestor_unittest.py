@@ -3,7 +3,10 @@ This module is responsible for testing the data_ingestor module.
 """
 import unittest
 import os
+import tracemalloc
+from unittest.mock import patch, Mock
 from app.data_ingestor import DataIngestor
+from app.job import Job
 
 class TestDataIngestor(unittest.TestCase):
     """
@@ -17,16 +20,24 @@ class TestDataIngestor(unittest.TestCase):
         csv_path = 'sample.csv'
 
         with open(csv_path, 'w', encoding='utf-8') as file:
-            file.write('name,age\n')
-            file.write('Alice,30\n')
-            file.write('Bob,25\n')
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,30,Gender,Male\n')
+            file.write('1,Alaska,Question1,25.5,Gender,Female\n')
 
         # run data ingestor
         di_list = DataIngestor(csv_path)
 
         # verify that the data is read correctly
-        self.assertEqual(di_list.data, [{'name': 'Alice', 'age': '30'},
-                                              {'name': 'Bob', 'age': '25'}])
+        self.assertEqual(len(di_list), 2)
+        self.assertEqual(list(di_list.value_column), [30.0, 25.5])
+        self.assertEqual(di_list.questions.values, ['Question1'])
+        self.assertEqual(list(di_list.question_column), [0, 0])
+        self.assertEqual(list(di_list.state_column), [0, 1])
+        self.assertEqual(di_list.row(1), {'LocationDesc': 'Alaska',
+                                          'Question': 'Question1',
+                                          'Data_Value': 25.5,
+                                          'StratificationCategory1': 'Gender',
+                                          'Stratification1': 'Female'})
 
         # remove the sample csv file
         os.remove(csv_path)
@@ -34,12 +45,390 @@ class TestDataIngestor(unittest.TestCase):
         # check for the main file if the data is read correctly
         di_list = DataIngestor('nutrition_activity_obesity_usa_subset.csv')
 
-        self.assertEqual(len(di_list.data), 18650)
-        data_entry = {'': '10730',
-                        'LocationDesc': 'Guam',
+        self.assertEqual(len(di_list), 18650)
+        data_entry = {'LocationDesc': 'Guam',
                         'Question': 'Percent of adults aged 18 years and older who have obesity',
-                        'Data_Value': '24.9',
+                        'Data_Value': 24.9,
                         'StratificationCategory1': 'Income',
                         'Stratification1': 'Data not reported',
                     }
-        self.assertEqual(di_list.data[10730], data_entry)
+        # rows are grouped by question and state, so look for the entry in its group
+        rows = di_list.state_rows(data_entry['Question'], data_entry['LocationDesc'])
+        self.assertIn(data_entry, [di_list.row(i) for i in range(rows.start, rows.stop)])
+
+    def test_invalid_values(self):
+        """
+        This method tests that the rows with an empty or non-numeric Data_Value are skipped
+        instead of failing the ingest.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,30,Gender,Male\n')
+            file.write('1,Alaska,Question1,,Gender,Female\n')
+            file.write('2,Alaska,Question1,~,Gender,Male\n')
+            file.write('3,Alaska,Question1,NaN,Gender,Male\n')
+            file.write('4,Alaska,Question1,25,Gender,Female\n')
+
+        di = DataIngestor(csv_path)
+        parallel = DataIngestor(csv_path, num_workers=2)
+        os.remove(csv_path)
+
+        self.assertEqual(len(di), 2)
+        self.assertEqual(sorted(di.value_column), [25.0, 30.0])
+        self.assertEqual(di.question_sum('Question1'), [55.0, 2])
+        self.assertEqual([parallel.row(i) for i in range(2)], [di.row(i) for i in range(2)])
+
+    def test_index(self):
+        """
+        This method tests the question and (question, state) index of the DataIngestor class.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question2,20,Gender,Male\n')
+            file.write('2,Alabama,Question1,30,Gender,Female\n')
+            file.write('3,Alaska,Question1,40,Gender,Female\n')
+
+        di = DataIngestor(csv_path)
+        os.remove(csv_path)
+
+        # the rows of a question are contiguous and keep the order from the file
+        rows = di.question_rows('Question1')
+        self.assertEqual(list(di.value_column[rows]), [10.0, 30.0, 40.0])
+        rows = di.state_rows('Question1', 'Alabama')
+        self.assertEqual(list(di.value_column[rows]), [10.0, 30.0])
+        rows = di.state_rows('Question2', 'Alaska')
+        self.assertEqual(list(di.value_column[rows]), [20.0])
+
+        # unknown keys map to an empty slice
+        self.assertEqual(list(di.value_column[di.question_rows('Question3')]), [])
+        self.assertEqual(list(di.value_column[di.state_rows('Question2', 'Alabama')]), [])
+
+    def test_index_peak_memory(self):
+        """
+        This method tests that indexing the rows allocates a bounded number of bytes per row
+        besides the columns, instead of a Python object per row.
+        """
+        csv_path = 'sample.csv'
+        num_rows = 20000
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            for index in range(num_rows):
+                file.write(f'{index},State{index * 7 % 50},Question{index % 9},{index},'
+                           f'Gender,Group{index % 5}\n')
+
+        di = DataIngestor(csv_path)
+        os.remove(csv_path)
+        rows = di.state_rows('Question0', 'State0')
+        self.assertEqual(list(di.value_column[rows]), [float(index) for index in
+                                                       range(0, num_rows, 450)])
+
+        # index the rows again, they are already sorted but the work is the same
+        tracemalloc.start()
+        di._build_index()  # pylint: disable=protected-access
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        # the new columns (24 bytes per row) replace the old ones, a tuple and an int per row
+        # would take more than 100 bytes per row
+        self.assertLess(peak, 48 * num_rows)
+        self.assertEqual(di.state_rows('Question0', 'State0'), rows)
+
+    def test_materialize_aggregates(self):
+        """
+        This method tests the materialize_aggregates method of the DataIngestor class.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question2,20,Gender,Male\n')
+            file.write('2,Alabama,Question1,30,Gender,Female\n')
+            file.write('3,Alaska,Question1,40,Gender,Female\n')
+
+        di = DataIngestor(csv_path)
+        os.remove(csv_path)
+        self.assertIsNone(di.aggregates)
+
+        di.materialize_aggregates()
+        question = di.questions.lookup('Question1')
+        alabama = di.states.lookup('Alabama')
+        female = (di.categories.lookup('Gender'), di.stratifications.lookup('Female'))
+
+        self.assertEqual(di.aggregates.by_question[question], [80.0, 3])
+        self.assertEqual(di.aggregates.by_state[question][alabama], [40.0, 2])
+        self.assertEqual(di.aggregates.by_state_category[(question, alabama)][female],
+                         [30.0, 1])
+
+    def test_summary(self):
+        """
+        This method tests the summary method of the DataIngestor class.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question1,25,Gender,Male\n')
+            file.write('2,Alabama,Question1,30,Gender,Female\n')
+            file.write('3,Arizona,Question1,5,Gender,Female\n')
+
+        di = DataIngestor(csv_path)
+        os.remove(csv_path)
+
+        summary = di.summary('Question1')
+        self.assertEqual(summary.states_mean, {'Arizona': 5.0, 'Alabama': 20.0, 'Alaska': 25.0})
+        self.assertEqual(summary.global_mean, 17.5)
+        # Question1 is not in questions_best_is_min, so the greatest mean is the best
+        self.assertEqual(summary.ranking[0], ('Alaska', 25.0))
+        self.assertEqual(summary.ranking[-1], ('Arizona', 5.0))
+
+        # the summary is computed only once per question
+        self.assertIs(di.summary('Question1'), summary)
+
+        # unknown questions are not kept
+        self.assertIsNone(di.summary('Question2').global_mean)
+        self.assertNotIn('Question2', di.summaries)
+
+    def test_question_view(self):
+        """
+        This method tests that a QuestionView answers like the DataIngestor.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question1,25,Gender,Male\n')
+            file.write('2,Alabama,Question1,30,Gender,Female\n')
+            file.write('3,Alabama,Question2,5,Gender,Female\n')
+
+        di = DataIngestor(csv_path)
+        os.remove(csv_path)
+
+        view = di.question_view('Question1')
+        self.assertEqual(view.question_sum('Question1'), di.question_sum('Question1'))
+        self.assertEqual(view.state_sums('Question1'), di.state_sums('Question1'))
+        self.assertEqual(view.category_sums('Question1'), di.category_sums('Question1'))
+        self.assertEqual(view.category_sums('Question2'), di.category_sums('Question2'))
+
+        # the summary built by the view is shared with the data ingestor
+        self.assertIs(view.summary('Question1'), di.summary('Question1'))
+        self.assertEqual(di.summary('Question1').global_mean, 65 / 3)
+
+    def test_numpy_engine(self):
+        """
+        This method tests that the numpy engine answers like the pure-Python path.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question1,25,Gender,Male\n')
+            file.write('2,Alabama,Question1,30,Gender,Female\n')
+            file.write('3,Alabama,Question2,5,Income,Female\n')
+
+        di = DataIngestor(csv_path)
+        os.remove(csv_path)
+
+        expected = (di.question_sum('Question1'), di.state_sums('Question1'),
+                    di.category_sums('Question1'), di.state_category_sums('Question1', 'Alabama'))
+
+        di.use_numpy_engine()
+        # answer even the small slices with numpy
+        di.engine.min_rows = 0
+        self.assertEqual((di.question_sum('Question1'), di.state_sums('Question1'),
+                          di.category_sums('Question1'),
+                          di.state_category_sums('Question1', 'Alabama')), expected)
+        self.assertEqual(di.category_sums('Question3'), {})
+
+    def test_category_keys(self):
+        """
+        This method tests that the keys of the category results are the str of the tuples
+        of the values, also for a value that is quoted differently, and that the labels of
+        a dictionary follow the values that are added to it.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alabama,Question1,30,Gender,"Women\'s ""health"""\n')
+
+        di = DataIngestor(csv_path)
+        os.remove(csv_path)
+
+        result = Job(0, {'question': 'Question1', 'state': 'Alabama'},
+                     '/api/state_mean_by_category', Mock()).compute(di)
+        self.assertEqual(result, {'Alabama': {str(('Gender', 'Male')): 10.0,
+                                              str(('Gender', 'Women\'s "health"')): 30.0}})
+
+        self.assertEqual(di.states.labels(), ["'Alabama'"])
+        di.states.encode('Alaska')
+        self.assertEqual(di.states.labels(), ["'Alabama'", "'Alaska'"])
+
+    def test_snapshot(self):
+        """
+        This method tests that the binary snapshot is written, loaded and invalidated.
+        """
+        csv_path = 'sample.csv'
+        snapshot_path = 'sample.snapshot'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question1,25,Gender,Male\n')
+            file.write('2,Alabama,Question2,30,Gender,Female\n')
+
+        # the first time the csv file is read and the snapshot is written
+        di = DataIngestor(csv_path, snapshot_path)
+        self.assertTrue(os.path.exists(snapshot_path))
+
+        # then the columns are mapped from the snapshot
+        loaded = DataIngestor(csv_path, snapshot_path)
+        self.assertIsInstance(loaded.value_column, memoryview)
+        self.assertEqual([loaded.row(i) for i in range(len(loaded))],
+                         [di.row(i) for i in range(len(di))])
+        self.assertEqual(loaded.state_rows('Question1', 'Alaska'),
+                         di.state_rows('Question1', 'Alaska'))
+        self.assertEqual(loaded.summary('Question1').global_mean, 17.5)
+
+        # the snapshot is still valid if only the modification time changed
+        os.utime(csv_path, (0, 0))
+        self.assertIsInstance(DataIngestor(csv_path, snapshot_path).value_column, memoryview)
+
+        # it is written again when the csv file changes
+        with open(csv_path, 'a', encoding='utf-8') as file:
+            file.write('3,Arizona,Question1,40,Gender,Male\n')
+        changed = DataIngestor(csv_path, snapshot_path)
+        self.assertNotIsInstance(changed.value_column, memoryview)
+        self.assertEqual(len(DataIngestor(csv_path, snapshot_path)), 4)
+
+        os.remove(csv_path)
+        os.remove(snapshot_path)
+
+    def test_read_in_chunks(self):
+        """
+        This method tests that the rows are read the same way in chunks, whatever the order
+        and the number of the columns of the csv file.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write('Stratification1,Data_Value,Unused,LocationDesc,'
+                       'StratificationCategory1,Question\n')
+            file.write('Male,10,"a, b",Alabama,Gender,Question1\n')
+            file.write('Male,25,,Alaska,Gender,Question1\n')
+            file.write('Female,30,c,Alabama,Gender,Question2\n')
+
+        di = DataIngestor(csv_path)
+        with patch('app.columns.CHUNK_ROWS', 2):
+            chunked = DataIngestor(csv_path)
+        os.remove(csv_path)
+
+        self.assertEqual(len(chunked), 3)
+        self.assertEqual([chunked.row(i) for i in range(3)], [di.row(i) for i in range(3)])
+        self.assertEqual(di.row(0), {'LocationDesc': 'Alabama', 'Question': 'Question1',
+                                     'Data_Value': 10.0, 'StratificationCategory1': 'Gender',
+                                     'Stratification1': 'Male'})
+
+    def test_parallel_read(self):
+        """
+        This method tests that the csv file parsed by several processes gives the same
+        columns as when it is read by a single process.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            for index in range(50):
+                file.write(f'{index},State{index % 7},Question{index % 3},{index},'
+                           f'"Gender, Sex",Group{index % 5}\n')
+
+        di = DataIngestor(csv_path)
+        parallel = DataIngestor(csv_path, num_workers=3)
+        os.remove(csv_path)
+
+        self.assertEqual(len(parallel), 50)
+        self.assertEqual([parallel.row(i) for i in range(50)], [di.row(i) for i in range(50)])
+        self.assertEqual(parallel.question_state_index, di.question_state_index)
+
+    def test_parallel_read_quoted_newlines(self):
+        """
+        This method tests that a csv file with line breaks inside quoted values, which the
+        byte ranges of the parallel read may split, gives the same columns as when it is
+        read by a single process.
+        """
+        csv_path = 'sample.csv'
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            for index in range(50):
+                file.write(f'{index},State{index % 7},"Question{index % 3}\n""line""\n\nend",'
+                           f'{index},"Gender, Sex",Group{index % 5}\n')
+
+        di = DataIngestor(csv_path)
+        parallel = DataIngestor(csv_path, num_workers=3)
+        base = DataIngestor(csv_path)
+        appended = DataIngestor(csv_path, num_workers=3, base=base)
+        os.remove(csv_path)
+
+        self.assertEqual(len(parallel), 50)
+        self.assertEqual(di.row(0)['Question'], 'Question0\n"line"\n\nend')
+        self.assertEqual([parallel.row(i) for i in range(50)], [di.row(i) for i in range(50)])
+        self.assertEqual(parallel.questions.values, di.questions.values)
+        self.assertEqual(len(appended), 100)
+        self.assertEqual(appended.questions.values, di.questions.values)
+
+    def test_append_generation(self):
+        """
+        This method tests that appending a csv file to a data ingestor gives the same data
+        as reading both files, while the aggregates and the summaries of the questions
+        without appended rows are kept.
+        """
+        header = ',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n'
+        with open('sample.csv', 'w', encoding='utf-8') as file:
+            file.write(header)
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question2,20,Gender,Male\n')
+        with open('appended.csv', 'w', encoding='utf-8') as file:
+            file.write(header)
+            file.write('2,Alaska,Question1,40,Age,18-24\n')
+            file.write('3,Arizona,Question3,50,Gender,Female\n')
+        with open('full.csv', 'w', encoding='utf-8') as file:
+            file.write(header)
+            file.write('0,Alabama,Question1,10,Gender,Male\n')
+            file.write('1,Alaska,Question2,20,Gender,Male\n')
+            file.write('2,Alaska,Question1,40,Age,18-24\n')
+            file.write('3,Arizona,Question3,50,Gender,Female\n')
+
+        base = DataIngestor('sample.csv')
+        base.materialize_aggregates()
+        base.summary('Question1')
+        base.summary('Question2')
+        generation = DataIngestor('appended.csv', base=base)
+        full = DataIngestor('full.csv')
+        full.materialize_aggregates()
+        for csv_path in ('sample.csv', 'appended.csv', 'full.csv'):
+            os.remove(csv_path)
+
+        self.assertEqual([generation.row(i) for i in range(4)], [full.row(i) for i in range(4)])
+        self.assertEqual(generation.appended_questions, {'Question1', 'Question3'})
+        self.assertEqual(generation.aggregates.by_state_category,
+                         full.aggregates.by_state_category)
+
+        # the base is not modified and the groups of Question2 are shared with it
+        self.assertEqual(len(base), 2)
+        self.assertEqual(base.aggregates.by_question[0], [10.0, 1])
+        self.assertIs(generation.aggregates.by_state[1], base.aggregates.by_state[1])
+
+        # only the summary of the question without appended rows is kept
+        self.assertEqual(list(generation.summaries), ['Question2'])
+        self.assertEqual(generation.summary('Question1').states_mean,
+                         {'Alabama': 10.0, 'Alaska': 40.0})
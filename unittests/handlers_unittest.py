@@ -0,0 +1,82 @@
+""" This module is responsible for testing the request handlers shared by the front-ends."""
+import unittest
+import os
+from unittest.mock import Mock
+from app.task_runner import ThreadPool
+from app import handlers
+
+class TestHandlers(unittest.TestCase):
+    """ This class is responsible for testing the handlers module."""
+    def aux_webserver(self):
+        """ This method is used to create a webserver with a ThreadPool that is not started."""
+        webserver = Mock()
+        webserver.prefork = False
+        webserver.tasks_runner = ThreadPool()
+        webserver.tasks_runner.logger = Mock()
+        return webserver
+
+    def test_submit_and_find_job(self):
+        """
+        This method tests that a submitted job is found by its job_id and that the
+        invalid job_ids are rejected.
+        """
+        webserver = self.aux_webserver()
+        reply = handlers.submit_job(webserver, '127.0.0.1', {'question': 'Test'},
+                                    '/api/global_mean', False)
+        self.assertEqual(reply.payload, {'job_id': 'job_id_1'})
+
+        job, reply = handlers.find_job(webserver, 'job_id_1')
+        self.assertIsNone(reply)
+        self.assertEqual(handlers.job_reply(webserver, job).payload, {'status': 'running'})
+        for job_id, reason in (('job_id_2', 'Invalid job_id'), ('bogus', 'Invalid job_id')):
+            job, reply = handlers.find_job(webserver, job_id)
+            self.assertIsNone(job)
+            self.assertEqual(reply.payload, {'status': 'error', 'reason': reason})
+
+    def test_submit_invalid_job(self):
+        """
+        This method tests that a job whose body is not an object is rejected with 400,
+        both on the synchronous path and on the queued one.
+        """
+        webserver = self.aux_webserver()
+        for body in ([], 'Test', None, 1):
+            for sync in (False, True):
+                reply = handlers.submit_job(webserver, '127.0.0.1', body, '/api/global_mean',
+                                            sync)
+                self.assertEqual((reply.status_code, reply.payload),
+                                 (400, {'status': 'error', 'reason': 'Invalid request'}))
+        self.assertEqual(len(webserver.tasks_runner.jobs), 0)
+
+    def test_submit_batch(self):
+        """
+        This method tests that a malformed batch or a batch with an invalid job is rejected
+        with 400 and that a batch over the maximum number of queued jobs is answered with
+        503 and Retry-After.
+        """
+        os.environ['TP_MAX_QUEUED'] = '1'
+        webserver = self.aux_webserver()
+        os.environ.pop('TP_MAX_QUEUED')
+
+        for body in ([], 'jobs', None, {'jobs': {}}, {'jobs': None}):
+            reply = handlers.submit_batch(webserver, '127.0.0.1', body)
+            self.assertEqual((reply.status_code, reply.payload['reason']),
+                             (400, "Invalid request"))
+
+        reply = handlers.submit_batch(webserver, '127.0.0.1', {'jobs': [
+            {'endpoint': '/api/unknown', 'data': {}}]})
+        self.assertEqual(reply.status_code, 400)
+        self.assertEqual(reply.payload['reason'], "Invalid job: {'endpoint': '/api/unknown', "
+                                                  "'data': {}}")
+        for entry in ('/api/best5', None, {'endpoint': '/api/best5', 'data': ['Test']}):
+            reply = handlers.submit_batch(webserver, '127.0.0.1', {'jobs': [
+                {'endpoint': '/api/global_mean', 'data': {'question': 'Test'}}, entry]})
+            self.assertEqual((reply.status_code, reply.payload['reason']),
+                             (400, f"Invalid job: {entry}"))
+        self.assertEqual(len(webserver.tasks_runner.jobs), 0)
+
+        reply = handlers.submit_batch(webserver, '127.0.0.1', {'jobs': [
+            {'endpoint': '/api/global_mean', 'data': {'question': 'Test'}},
+            {'endpoint': '/api/best5', 'data': {'question': 'Test'}}]})
+        self.assertEqual(reply.status_code, 503)
+        self.assertIn('Retry-After', reply.headers)
+        self.assertEqual(len(webserver.tasks_runner.jobs), 0)
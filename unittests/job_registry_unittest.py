@@ -0,0 +1,158 @@
+""" This module is responsible for testing the JobRegistry class."""
+import unittest
+import shutil
+import time
+import multiprocessing
+from threading import Thread
+from unittest.mock import Mock
+from app.job import Job
+from app.job_registry import JobRegistry, JobIdAllocator, SharedJobRegistry, JobIdBlockAllocator
+from app.shared_state import SharedState
+
+class TestJobRegistry(unittest.TestCase):
+    """ This class is responsible for testing the JobRegistry class."""
+    def aux_job(self, job_id):
+        """ This method is used to create a sample job."""
+        return Job(job_id, {'question': 'Test'}, '/api/global_mean', Mock())
+
+    def test_add_get(self):
+        """
+        This method tests the add, get, snapshot and remove_many methods of the JobRegistry
+        class.
+        """
+        registry = JobRegistry(0, 0)
+        jobs = [self.aux_job(job_id) for job_id in range(1, 4)]
+        registry.add(jobs[0])
+        registry.add_many(jobs[1:])
+
+        self.assertIs(registry.get(2), jobs[1])
+        self.assertIsNone(registry.get(4))
+        self.assertEqual(registry.snapshot(), jobs)
+        self.assertEqual(registry.get_many([3, 4, 1]), [jobs[2], None, jobs[0]])
+
+        registry.remove_many(jobs[1:])
+        self.assertEqual(registry.snapshot(), jobs[:1])
+
+    def test_max_finished(self):
+        """
+        This method tests that only the last max_finished finished jobs are kept.
+        """
+        expired = []
+        registry = JobRegistry(2, 0, on_expire=expired.append)
+        jobs = [self.aux_job(job_id) for job_id in range(1, 5)]
+        for job in jobs:
+            registry.add(job)
+
+        # the running jobs are never dropped
+        for job in jobs[:3]:
+            registry.mark_finished(job)
+        self.assertEqual(expired, [jobs[0]])
+        self.assertIsNone(registry.get(1))
+        self.assertIs(registry.get(4), jobs[3])
+        self.assertEqual(len(registry), 3)
+
+    def test_max_age(self):
+        """
+        This method tests that the finished jobs are dropped after max_age seconds.
+        """
+        registry = JobRegistry(0, 0.1)
+        job = self.aux_job(1)
+        registry.add(job)
+        registry.mark_finished(job)
+        self.assertIs(registry.get(1), job)
+        time.sleep(0.2)
+        self.assertIsNone(registry.get(1))
+
+    def test_slots(self):
+        """
+        This method tests that the job records do not have a __dict__.
+        """
+        self.assertFalse(hasattr(self.aux_job(1), '__dict__'))
+
+    def test_job_id_allocator(self):
+        """
+        This method tests that the job_ids allocated by concurrent threads are unique
+        and that the registry remembers the largest registered job_id.
+        """
+        allocator = JobIdAllocator()
+        self.assertEqual(allocator.allocate(), 1)
+        self.assertEqual(allocator.allocate_many(3), [2, 3, 4])
+
+        job_ids = []
+        threads = [Thread(target=lambda: job_ids.extend(allocator.allocate_many(1000)))
+                   for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(job_ids), list(range(5, 8005)))
+
+        registry = JobRegistry(0, 0)
+        registry.add(self.aux_job(7))
+        registry.add(self.aux_job(3))
+        self.assertEqual(registry.max_job_id, 7)
+
+    def test_shared_job_registry(self):
+        """
+        This method tests that a job registered by another process is found in the shared
+        state, with its status, and that it is removed from it when it expires or when
+        it is rejected.
+        """
+        directory = 'shared_test'
+        process_registry = SharedJobRegistry(1, 0, SharedState(f'{directory}/state.db'))
+        registry = SharedJobRegistry(1, 0, SharedState(f'{directory}/state.db'))
+        process_registry.add_many([self.aux_job(1), self.aux_job(2), self.aux_job(3)])
+        process_registry.remove_many([process_registry.get(3)])
+
+        remote_job = registry.get(1)
+        self.assertEqual((remote_job.job_id, remote_job.status), (1, "running"))
+        self.assertEqual(registry.max_job_id, 3)
+        self.assertEqual(registry.get_many([3, 2])[0], None)
+        self.assertFalse(remote_job.wait(0.1))
+
+        job = process_registry.get(1)
+        job.status = "done"
+        process_registry.mark_finished(job)
+        self.assertTrue(remote_job.wait(1))
+        self.assertEqual([(job.job_id, job.status) for job in registry.snapshot()],
+                         [(1, "done"), (2, "running")])
+
+        # a second finished job expires the first one
+        job = process_registry.get(2)
+        job.status = "error"
+        process_registry.mark_finished(job)
+        self.assertIsNone(registry.get(1))
+        self.assertEqual(registry.get(2).status, "error")
+        shutil.rmtree(directory)
+
+    def test_job_id_block_allocator(self):
+        """
+        This method tests that the job_ids allocated by several processes are unique.
+        """
+        directory = 'shared_test'
+        shared_state = SharedState(f'{directory}/state.db')
+        allocator = JobIdBlockAllocator(shared_state, block_size=10)
+        self.assertEqual(allocator.allocate(), 1)
+        self.assertEqual(allocator.allocate_many(3), [2, 3, 4])
+        # a batch larger than a block
+        self.assertEqual(allocator.allocate_many(30), list(range(5, 11)) + list(range(11, 35)))
+
+        # the forked processes open their own connection to the shared state and do not
+        # allocate the job_ids left in the block of their parent
+        allocator.allocate()
+        context = multiprocessing.get_context('fork')
+        queue = context.Queue()
+        processes = [context.Process(target=lambda: queue.put(allocator.allocate_many(100)))
+                     for _ in range(4)]
+        for process in processes:
+            process.start()
+        job_ids = [job_id for _ in processes for job_id in queue.get(timeout=10)]
+        for process in processes:
+            process.join()
+        job_ids += allocator.allocate_many(20)
+        self.assertEqual(len(set(job_ids)), len(job_ids))
+        self.assertTrue(all(job_id > 35 for job_id in job_ids))
+
+        shared_state.reset()
+        self.assertEqual(JobIdBlockAllocator(shared_state).allocate(), 1)
+        shutil.rmtree(directory)
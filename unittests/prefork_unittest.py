@@ -0,0 +1,115 @@
+""" This module is responsible for testing the pre-fork server."""
+import unittest
+import os
+import shutil
+import signal
+import socket
+import json
+import time
+from urllib.request import urlopen
+from unittest.mock import Mock
+from app.task_runner import ThreadPool
+from app.data_ingestor import DataIngestor
+from app.prefork import PreforkServer
+from app import handlers
+
+class TestPreforkServer(unittest.TestCase):
+    """ This class is responsible for testing the PreforkServer class."""
+    directory = 'prefork_test'
+
+    def aux_data_ingestor(self):
+        """ This method is used to create a sample csv file for data ingestor."""
+        csv_path = os.path.join(self.directory, 'sample.csv')
+
+        with open(csv_path, 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Test,30,Gender,Male\n')
+            file.write('1,Alaska,Test,25,Gender,Female\n')
+
+        return DataIngestor(csv_path)
+
+    def aux_application(self, webserver):
+        """ This method is used to create a WSGI application that submits a job with a POST
+            request and reads the result of a job with a GET request, through the handlers.
+            Each response tells the pid of the worker process that answered it."""
+        def application(environ, start_response):
+            if environ['REQUEST_METHOD'] == 'POST':
+                reply = handlers.submit_job(webserver, '127.0.0.1', {'question': 'Test'},
+                                            '/api/global_mean', False)
+            else:
+                job, reply = handlers.find_job(webserver, environ['PATH_INFO'].rsplit('/', 1)[-1])
+                if job is not None:
+                    job.wait(5)
+                    reply = handlers.job_reply(webserver, job)
+            start_response(f'{reply.status_code} OK', [('Content-Type', 'application/json')])
+            return [json.dumps({'pid': os.getpid(), **reply.payload}).encode('utf-8')]
+        return application
+
+    def aux_request(self, port, path, data=None):
+        """ This method sends a request to the server, retrying while it is not listening."""
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                with urlopen(f'http://127.0.0.1:{port}{path}', data, timeout=10) as response:
+                    return json.loads(response.read())
+            except ConnectionError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_two_workers(self):
+        """
+        This method tests that a job submitted to one worker is read through the other one,
+        from the shared state, and that the master process stops and reaps the workers
+        when it receives SIGTERM.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        data_ingestor = self.aux_data_ingestor()
+        os.environ['TP_SHARED_STATE'] = os.path.join(self.directory, 'state.db')
+        webserver = Mock()
+        webserver.prefork = True
+        webserver.tasks_runner = ThreadPool()
+        os.environ.pop('TP_SHARED_STATE')
+        # let each worker open its own connection, like prefork_server.py
+        webserver.tasks_runner.shared_state.reset()
+        webserver.tasks_runner.shared_state.close()
+
+        with socket.socket() as probe:
+            probe.bind(('127.0.0.1', 0))
+            port = probe.getsockname()[1]
+
+        server = PreforkServer(self.aux_application(webserver), ('127.0.0.1', port), 2,
+                               lambda: webserver.tasks_runner.start(data_ingestor, Mock()),
+                               webserver.tasks_runner.stop)
+        master = os.fork()
+        if master == 0:
+            try:
+                server.serve_forever()
+            finally:
+                os._exit(0)
+
+        try:
+            submitted = self.aux_request(port, '/api/global_mean', b'{}')
+            self.assertEqual(submitted['job_id'], 'job_id_1')
+
+            # the kernel gives each connection to one of the workers, until the other one
+            # answers the job is read again
+            workers = {submitted['pid']}
+            for _ in range(200):
+                reply = self.aux_request(port, '/api/get_results/job_id_1')
+                self.assertEqual((reply['status'], reply['data']),
+                                 ('done', {'global_mean': 27.5}))
+                workers.add(reply['pid'])
+                if len(workers) == 2:
+                    break
+            self.assertEqual(len(workers), 2)
+        finally:
+            os.kill(master, signal.SIGTERM)
+            _, status = os.waitpid(master, 0)
+
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        # the master exits only after it reaped its workers
+        for pid in workers:
+            with self.assertRaises(ProcessLookupError):
+                os.kill(pid, 0)
+        shutil.rmtree(self.directory)
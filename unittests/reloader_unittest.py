@@ -0,0 +1,101 @@
+""" This module is responsible for testing the DataReloader class."""
+import unittest
+import os
+import shutil
+import time
+from unittest.mock import Mock
+from app.task_runner import ThreadPool
+from app.data_ingestor import DataIngestor
+from app.reloader import DataReloader
+
+class TestDataReloader(unittest.TestCase):
+    """ This class is responsible for testing the DataReloader class."""
+    directory = 'reload_test'
+
+    def setUp(self):
+        """ Write the csv files of the data directory and start a ThreadPool with the first
+            one."""
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, 'sample.csv'), 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Test,30,Gender,Male\n')
+            file.write('1,Alaska,Test,25,Gender,Female\n')
+        with open(os.path.join(self.directory, 'appended.csv'), 'w', encoding='utf-8') as file:
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('2,Alabama,Test,40,Gender,Male\n')
+
+        self.tp = ThreadPool()
+        self.tp.start(DataIngestor(os.path.join(self.directory, 'sample.csv')), Mock())
+        self.reloader = DataReloader(self.tp, os.path.join(self.directory, 'sample.csv'))
+
+    def tearDown(self):
+        """ Stop the ThreadPool and remove the data directory."""
+        self.tp.stop()
+        shutil.rmtree(self.directory)
+
+    def aux_wait(self):
+        """ This method waits for the reload to finish and returns the stats."""
+        deadline = time.monotonic() + 5
+        while self.reloader.stats()['status'] == "running" and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return self.reloader.stats()
+
+    def test_resolve_path(self):
+        """
+        This method tests that only the csv files of the data directory are found.
+        """
+        self.assertEqual(self.reloader.resolve_path(None), self.reloader.csv_path)
+        self.assertEqual(self.reloader.resolve_path('appended.csv'),
+                         os.path.join(os.path.abspath(self.directory), 'appended.csv'))
+        # a path outside the data directory is looked up in it by its base name
+        self.assertEqual(self.reloader.resolve_path('../appended.csv'),
+                         os.path.join(os.path.abspath(self.directory), 'appended.csv'))
+        self.assertIsNone(self.reloader.resolve_path('missing.csv'))
+
+    def test_reload(self):
+        """
+        This method tests that an append and a full reload swap in a new generation and
+        that a failed reload keeps the current one.
+        """
+        self.assertTrue(self.reloader.start(self.reloader.resolve_path('appended.csv'), True))
+        self.assertEqual(self.aux_wait(), {'generation': 2, 'status': 'idle', 'error': None,
+                                           'num_rows': 3})
+        self.assertEqual(self.tp.data_ingestor.summary('Test').global_mean, 95 / 3)
+
+        self.assertTrue(self.reloader.start(self.reloader.csv_path, False))
+        self.assertEqual(self.aux_wait(), {'generation': 3, 'status': 'idle', 'error': None,
+                                           'num_rows': 2})
+
+        data_ingestor = self.tp.data_ingestor
+        self.assertTrue(self.reloader.start(os.path.join(self.directory, 'missing.csv'), False))
+        stats = self.aux_wait()
+        self.assertEqual((stats['generation'], stats['status']), (3, 'error'))
+        self.assertIn('FileNotFoundError', stats['error'])
+        self.assertIs(self.tp.data_ingestor, data_ingestor)
+
+    def test_single_reload(self):
+        """
+        This method tests that a reload is refused while another one is running.
+        """
+        self.reloader.status = "running"
+        self.assertFalse(self.reloader.start(self.reloader.csv_path, False))
+        self.assertEqual(self.reloader.stats()['generation'], 1)
+
+    def test_unsupported_reason(self):
+        """
+        This method tests that the reloads are refused with the process backend and with
+        several worker processes.
+        """
+        self.assertIsNone(self.reloader.unsupported_reason())
+
+        os.environ['TP_EXECUTOR'] = 'process'
+        reason = self.reloader.unsupported_reason()
+        os.environ.pop('TP_EXECUTOR')
+        self.assertEqual(reason, "Reloading is not supported with the process backend")
+
+        os.environ['TP_SHARED_STATE'] = os.path.join(self.directory, 'state.db')
+        tp = ThreadPool()
+        os.environ.pop('TP_SHARED_STATE')
+        self.assertEqual(DataReloader(tp, self.reloader.csv_path).unsupported_reason(),
+                         "Reloading is not supported with several worker processes")
+        tp.shared_state.close()
@@ -0,0 +1,68 @@
+""" This module is responsible for testing the ResultCache class."""
+import unittest
+import time
+from app.result_cache import ResultCache
+
+class TestResultCache(unittest.TestCase):
+    """ This class is responsible for testing the ResultCache class."""
+    def test_make_key(self):
+        """
+        This method tests that the key does not depend on the order of the input data.
+        """
+        key1 = ResultCache.make_key('/api/state_mean', {'question': 'Q', 'state': 'S'})
+        key2 = ResultCache.make_key('/api/state_mean', {'state': 'S', 'question': 'Q'})
+        key3 = ResultCache.make_key('/api/state_diff_from_mean', {'question': 'Q', 'state': 'S'})
+        self.assertEqual(key1, key2)
+        self.assertNotEqual(key1, key3)
+
+    def test_get_put(self):
+        """
+        This method tests the hits, the misses and the LRU eviction of the cache.
+        """
+        cache = ResultCache(2, 0)
+        self.assertIsNone(cache.get('a'))
+        cache.put('a', {'a': 1})
+        cache.put('b', {'b': 2})
+        self.assertEqual(cache.get('a'), {'a': 1})
+
+        # 'b' is the least recently used result, so it is evicted
+        cache.put('c', {'c': 3})
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), {'c': 3})
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 2, 2))
+
+    def test_ttl(self):
+        """
+        This method tests that the results expire after ttl seconds.
+        """
+        cache = ResultCache(10, 0.1)
+        cache.put('a', {'a': 1})
+        self.assertEqual(cache.get('a'), {'a': 1})
+        time.sleep(0.2)
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['size'], 0)
+
+    def test_disabled(self):
+        """
+        This method tests that a cache with max_size 0 stores nothing.
+        """
+        cache = ResultCache(0, 0)
+        cache.put('a', {'a': 1})
+        self.assertIsNone(cache.get('a'))
+
+    def test_discard_questions(self):
+        """
+        This method tests that only the results of the given questions are discarded,
+        whatever the keys of the requests look like.
+        """
+        cache = ResultCache(10, 0)
+        cache.put(ResultCache.make_key('/api/global_mean', {'question': 'Q1'}), 1, 'Q1')
+        cache.put(ResultCache.make_key('/api/{odd}', {'question': 'Q2'}), 2, 'Q2')
+        cache.put(ResultCache.make_key('/api/global_mean', ['not', 'an', 'object']), 3)
+        cache.discard_questions({'Q2'})
+
+        self.assertEqual(cache.get(ResultCache.make_key('/api/global_mean', {'question': 'Q1'})), 1)
+        self.assertIsNone(cache.get(ResultCache.make_key('/api/{odd}', {'question': 'Q2'})))
+        self.assertEqual(cache.stats()['size'], 2)
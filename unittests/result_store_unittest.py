@@ -0,0 +1,129 @@
+""" This module is responsible for testing the result stores."""
+import unittest
+import os
+import shutil
+import time
+from app.result_store import ResultStore, MemoryResultStore, FileResultStore, SqliteResultStore
+from app.shared_state import SharedState
+
+class TestResultStore(unittest.TestCase):
+    """ This class is responsible for testing the MemoryResultStore and FileResultStore."""
+    def test_memory_store(self):
+        """
+        This method tests the put, get and discard methods of the MemoryResultStore.
+        """
+        store = MemoryResultStore(0, 0, 0)
+        store.put(1, {'a': 1.5})
+        self.assertEqual(store.get(1), {'a': 1.5})
+        self.assertEqual(store.stats()['bytes_held'], len('{"a": 1.5}'))
+        self.assertEqual(store.load_many([1, 2]), {1: '{"a": 1.5}'})
+
+        store.discard(1)
+        self.assertIsNone(store.get(1))
+        self.assertEqual(store.stats()['bytes_held'], 0)
+
+    def test_abstract_store(self):
+        """
+        This method tests that a store must implement the storage of the serialized results.
+        """
+        class PartialStore(ResultStore):  # pylint: disable=abstract-method
+            """ A store without _delete."""
+            def _save(self, job_id, data):
+                pass
+
+            def _load(self, job_id):
+                return None
+
+        with self.assertRaises(TypeError):
+            ResultStore(0, 0, 0)
+        with self.assertRaises(TypeError):
+            PartialStore(0, 0, 0)
+
+    def test_shared_result(self):
+        """
+        This method tests that a shared result is stored once and removed with the last
+        job that shares it.
+        """
+        store = MemoryResultStore(0, 0, 0)
+        store.put(1, {'a': 1}, [2, 3])
+        self.assertEqual(store.get(3), {'a': 1})
+        self.assertEqual(store.load_many([1, 2]), {1: '{"a": 1}', 2: '{"a": 1}'})
+        self.assertEqual(store.stats()['results'], 1)
+
+        # the job that computed the result is discarded first
+        store.discard(1)
+        store.discard(3)
+        self.assertEqual(store.get(2), {'a': 1})
+        store.discard(2)
+        self.assertIsNone(store.get(2))
+        self.assertEqual(store.stats()['bytes_held'], 0)
+
+    def test_eviction(self):
+        """
+        This method tests that the oldest results are evicted when the store is full.
+        """
+        store = MemoryResultStore(2, 0, 0)
+        for job_id in range(1, 4):
+            store.put(job_id, {'job': job_id})
+        self.assertIsNone(store.get(1))
+        self.assertEqual(store.get(3), {'job': 3})
+        self.assertEqual(store.stats()['evicted'], 1)
+
+        # max_bytes: each result uses 10 bytes
+        store = MemoryResultStore(0, 25, 0)
+        for job_id in range(1, 4):
+            store.put(job_id, {'job': job_id})
+        self.assertEqual(store.stats()['results'], 2)
+
+    def test_retention(self):
+        """
+        This method tests that the results are dropped after the retention time.
+        """
+        store = MemoryResultStore(0, 0, 0.1)
+        store.put(1, {'a': 1})
+        self.assertEqual(store.get(1), {'a': 1})
+        time.sleep(0.2)
+        self.assertIsNone(store.get(1))
+
+    def test_file_store(self):
+        """
+        This method tests that the FileResultStore writes the results in the background.
+        """
+        directory = 'results_test'
+        store = FileResultStore(1, 0, 0, directory=directory)
+        store.put(1, {'a': 1})
+        # the result can be read before and after it is written
+        self.assertEqual(store.get(1), {'a': 1})
+        store.put(2, {'b': 2})
+        store.close()
+
+        self.assertEqual(store.get(2), {'b': 2})
+        self.assertEqual(store.load_many([1, 2]), {2: '{"b": 2}'})
+        self.assertEqual(store.stats()['bytes_held'], 0)
+        # the first result was evicted, so its file is removed
+        self.assertEqual(os.listdir(directory), ['job_id2.json'])
+        shutil.rmtree(directory)
+
+    def test_sqlite_store(self):
+        """
+        This method tests that the SqliteResultStore of a process reads the results
+        stored by another process, including the shared ones.
+        """
+        directory = 'shared_test'
+        process_store = SqliteResultStore(2, 0, 0, SharedState(f'{directory}/state.db'))
+        store = SqliteResultStore(0, 0, 0, SharedState(f'{directory}/state.db'))
+        process_store.put(1, {'a': 1}, [2])
+        self.assertEqual(store.get(2), {'a': 1})
+        self.assertEqual(store.load_many([1, 2, 3]), {1: '{"a": 1}', 2: '{"a": 1}'})
+
+        process_store.discard(1)
+        self.assertEqual(store.get(2), {'a': 1})
+        process_store.discard(2)
+        self.assertIsNone(store.get(2))
+
+        # the limits apply to the results of the process that stored them
+        for job_id in range(3, 6):
+            process_store.put(job_id, {'b': job_id})
+        self.assertEqual(store.load_many([3, 4, 5]), {4: '{"b": 4}', 5: '{"b": 5}'})
+        self.assertEqual(process_store.stats()['evicted'], 1)
+        shutil.rmtree(directory)
@@ -0,0 +1,84 @@
+""" This module is responsible for testing the ResultStream class."""
+import unittest
+import json
+from unittest.mock import Mock
+from app.task_runner import ThreadPool
+from app.result_stream import ResultStream
+
+class TestResultStream(unittest.TestCase):
+    """ This class is responsible for testing the ResultStream class."""
+    def test_completion_order(self):
+        """
+        This method tests that a job is streamed as soon as it finishes, even if a job
+        before it in the list is still running, and that the waiting client is woken up.
+        """
+        tp = ThreadPool()
+        tp.logger = Mock()
+        tp.register_job(1, {'question': 'Test'}, '/api/global_mean')
+        tp.register_job(2, {'question': 'Test'}, '/api/best5')
+        on_finish = Mock()
+        stream = ResultStream(tp, ['job_id_1', 'job_id_2', 'job_id_3', 'bogus'], 1000, on_finish)
+        self.assertEqual([json.loads(line) for line in stream.take_lines()],
+                         [{'job_id': 'job_id_3', 'status': 'error', 'reason': 'Invalid job_id'},
+                          {'job_id': 'bogus', 'status': 'error', 'reason': 'Invalid job_id'}])
+
+        # the second job finishes first
+        tp.complete_job(tp.jobs.get(2), {'Alabama': 30.0})
+        on_finish.assert_called_once()
+        self.assertEqual([json.loads(line) for line in stream.take_lines()],
+                         [{'job_id': 'job_id_2', 'status': 'done', 'data': {'Alabama': 30.0}}])
+        self.assertEqual([json.loads(line) for line in stream.running_lines()],
+                         [{'job_id': 'job_id_1', 'status': 'running'}])
+        self.assertEqual(stream.wait_time(5), 5)
+
+        # the jobs are not followed anymore once the stream is closed
+        stream.close()
+        tp.complete_job(tp.jobs.get(1), {'global_mean': 30.0})
+        on_finish.assert_called_once()
+        tp.result_store.close()
+
+    def test_expired_job(self):
+        """
+        This method tests that a job that was registered but is not found anymore is
+        reported with the same reason as /api/get_results/<job_id>.
+        """
+        tp = ThreadPool()
+        tp.logger = Mock()
+        tp.register_job(1, {'question': 'Test'}, '/api/global_mean')
+        tp.jobs.remove_many([tp.jobs.get(1)])
+        stream = ResultStream(tp, ['job_id_1'], 1000, Mock())
+        self.assertEqual([json.loads(line) for line in stream.take_lines()],
+                         [{'job_id': 'job_id_1', 'status': 'error', 'reason': 'Job not found'}])
+        tp.result_store.close()
+
+    def test_job_finishing_during_split(self):
+        """
+        This method tests that a job that finishes while the lines are taken is streamed,
+        either with the finished jobs or on the next call.
+        """
+        class FinishingJob:  # pylint: disable=too-few-public-methods
+            """ A job that finishes right after its status is read for the first time."""
+            def __init__(self, job_id):
+                self.job_id = job_id
+                self.reads = 0
+
+            @property
+            def status(self):
+                """ The status of the job."""
+                self.reads += 1
+                return "running" if self.reads == 1 else "done"
+
+        tp = ThreadPool()
+        tp.logger = Mock()
+        tp.result_store.put(1, {'global_mean': 30.0})
+        stream = ResultStream(tp, [], 1000, Mock())
+        stream.pending = [('job_id_1', FinishingJob(1))]
+
+        lines = stream.take_lines()
+        self.assertEqual(stream.running_lines() + lines, ['{"job_id": "job_id_1", '
+                                                          '"status": "running"}\n'])
+        self.assertEqual([json.loads(line) for line in stream.take_lines()],
+                         [{'job_id': 'job_id_1', 'status': 'done',
+                           'data': {'global_mean': 30.0}}])
+        self.assertEqual(stream.pending, [])
+        tp.result_store.close()
@@ -73,7 +73,6 @@ class TestRoutes(unittest.TestCase):
         }
         webserver.tasks_runner = ThreadPool()
         webserver.logger = Mock()
-        webserver.job_counter = 1
         webserver.tasks_runner.start(webserver.data_ingestor, webserver.logger)
 
     @patch('flask.jsonify')
@@ -82,7 +81,38 @@ class TestRoutes(unittest.TestCase):
         jsonify_mock = lambda data, status_code=200: Response(json.dumps(data), status=status_code, mimetype='application/json')
         job = Job(1, {"question": "Question1", "state": "Alabama"}, "/api/state_mean", webserver.logger)
         job.result = 10
-        webserver.tasks_runner.job_list.append(job)
+        webserver.tasks_runner.jobs.add(job)
         resp = routes.get_response("job_1")
         print(f"RESP: {resp}")
-        # self.assertEqual(resp, jsonify({"status": "done", "data": 10}))
\ No newline at end of file
+        # self.assertEqual(resp, jsonify({"status": "done", "data": 10}))
+    def test_reload_request(self):
+        """ Test that /api/admin/reload starts a reload and that the invalid reloads are refused """
+        reloader = Mock()
+        reloader.unsupported_reason.return_value = None
+        reloader.resolve_path.side_effect = lambda name: None if name == 'missing.csv' else name
+        reloader.start.side_effect = [True, False]
+        reloader.stats.return_value = {'generation': 1, 'status': 'running', 'error': None,
+                                       'num_rows': 25}
+        with patch.object(webserver, 'reloader', reloader):
+            client = webserver.test_client()
+            resp = client.post('/api/admin/reload', json={'file': 'new.csv', 'append': True})
+            self.assertEqual(resp.get_json(), {'status': 'reloading'})
+            reloader.start.assert_called_once_with('new.csv', True)
+
+            # a single reload runs at a time
+            resp = client.post('/api/admin/reload', json={'file': 'new.csv'})
+            self.assertEqual(resp.get_json()['reason'], 'A reload is already running')
+            self.assertEqual(client.get('/api/admin/reload').get_json(),
+                             reloader.stats.return_value)
+
+            resp = client.post('/api/admin/reload', json={'file': 'missing.csv'})
+            self.assertEqual(resp.get_json()['reason'], 'Invalid file: missing.csv')
+            resp = client.post('/api/admin/reload', json=['new.csv'])
+            self.assertEqual(resp.status_code, 400)
+
+            reloader.unsupported_reason.return_value = \
+                "Reloading is not supported with the process backend"
+            resp = client.post('/api/admin/reload', json={})
+            self.assertEqual(resp.get_json()['reason'],
+                             "Reloading is not supported with the process backend")
+        webserver.tasks_runner.stop()
@@ -1,9 +1,14 @@
 """ This module is responsible for testing the ThreadPool class."""
 import unittest
 import os
+import shutil
+import time
+from unittest.mock import Mock
 from app.task_runner import ThreadPool
 from app.data_ingestor import DataIngestor
 from app.job import Job
+from app.result_cache import ResultCache
+from app.admission import Overloaded
 
 class TestThreadPoolMethods(unittest.TestCase):
     """ This class is responsible for testing the ThreadPool class."""
@@ -12,9 +17,9 @@ class TestThreadPoolMethods(unittest.TestCase):
         csv_path = 'sample.csv'
 
         with open(csv_path, 'w', encoding='utf-8') as file:
-            file.write('name,age\n')
-            file.write('Alice,30\n')
-            file.write('Bob,25\n')
+            file.write(',LocationDesc,Question,Data_Value,StratificationCategory1,Stratification1\n')
+            file.write('0,Alabama,Test,30,Gender,Male\n')
+            file.write('1,Alaska,Test,25,Gender,Female\n')
 
         di = DataIngestor(csv_path)
 
@@ -25,7 +30,7 @@ class TestThreadPoolMethods(unittest.TestCase):
 
     def aux_job(self):
         """ This method is used to create a sample job."""
-        return Job(1, {'question' : 'Test'}, 'test')
+        return Job(1, {'question' : 'Test'}, 'test', Mock())
 
     def test_get_num_threads(self):
         """
@@ -50,8 +55,8 @@ class TestThreadPoolMethods(unittest.TestCase):
 
         # start the threads and check if they are alive
         tp = ThreadPool()
-        tp.start(di_list)
-        self.assertEqual(len(tp.tasks), tp.num_threads)
+        tp.start(di_list, Mock())
+        self.assertEqual(len(tp.tasks), tp.get_num_threads())
         self.assertEqual(tp.tasks[0].is_alive(), True)
 
         # close the threads
@@ -63,7 +68,7 @@ class TestThreadPoolMethods(unittest.TestCase):
         """
         di = self.aux_data_ingestor()
         tp = ThreadPool()
-        tp.start(di)
+        tp.start(di, Mock())
 
         # add a job to the job queue
         job = self.aux_job()
@@ -88,11 +93,343 @@ class TestThreadPoolMethods(unittest.TestCase):
         di = self.aux_data_ingestor()
         job = self.aux_job()
         tp = ThreadPool()
-        tp.start(di)
+        tp.logger = Mock()
         tp.register_job(job.job_id, job.input_data, job.command)
         self.assertEqual(tp.job_queue.qsize(), 1)
         self.assertEqual(tp.job_queue.get().job_id, job.job_id)
-        self.assertEqual(tp.job_list[0].input_data, job.input_data)
+        self.assertEqual(tp.jobs.get(job.job_id).input_data, job.input_data)
 
-        # close the threads
+        # start the threads and close them
+        tp.start(di, Mock())
+        tp.stop()
+
+    def test_idle_and_failed_jobs(self):
+        """
+        This method tests that idle threads wait on the queue without using the CPU
+        and that a failing job does not stop its thread.
+        """
+        di = self.aux_data_ingestor()
+        tp = ThreadPool()
+        tp.start(di, Mock())
+
+        # idle threads are blocked in the queue, so the process barely uses the CPU
+        cpu_start = time.process_time()
+        time.sleep(0.5)
+        self.assertLess(time.process_time() - cpu_start, 0.1)
+
+        # a job that raises (there is no state in the input data) is marked as failed
+        # and the threads keep running
+        tp.register_job(1, {'question': 'Test'}, '/api/state_mean')
+        tp.stop()
+        self.assertEqual(tp.jobs.get(1).status, "error")
+
+    def test_process_backend(self):
+        """
+        This method tests that the process backend computes the same results as the threads.
+        """
+        di = self.aux_data_ingestor()
+        job = Job(1, {'question': 'Test'}, '/api/states_mean', Mock())
+        expected = job.compute(di)
+
+        os.environ['TP_EXECUTOR'] = 'process'
+        tp = ThreadPool()
+        tp.start(di, Mock())
+        os.environ.pop('TP_EXECUTOR')
+        self.assertEqual(tp.get_executor(), 'thread')
+
+        self.assertEqual(tp.backend.compute(job), expected)
         tp.stop()
+
+    def test_cached_result(self):
+        """
+        This method tests that a request with a cached result is not queued.
+        """
+        di = self.aux_data_ingestor()
+        tp = ThreadPool()
+        tp.start(di, Mock())
+
+        data = {'question': 'Test'}
+        tp.result_cache.put(ResultCache.make_key('/api/global_mean', data), {'global_mean': 1})
+        tp.register_job(1, data, '/api/global_mean')
+        self.assertEqual(tp.jobs.get(1).status, "done")
+        self.assertEqual(tp.result_store.get(1), {'global_mean': 1})
+        self.assertEqual(tp.result_cache.stats()['hits'], 1)
+
+        tp.stop()
+
+    def test_compute_inline(self):
+        """
+        This method tests that cheap requests are computed on the calling thread.
+        """
+        di = self.aux_data_ingestor()
+        tp = ThreadPool()
+        tp.start(di, Mock())
+
+        data = {'question': 'Test', 'state': 'Alabama'}
+        os.environ['FAST_PATH_MAX_ROWS'] = '0'
+        # the job has to iterate 1 row, over the threshold
+        self.assertIsNone(tp.compute_inline(data, '/api/state_mean_by_category'))
+
+        os.environ['FAST_PATH_MAX_ROWS'] = '2'
+        self.assertEqual(tp.compute_inline(data, '/api/state_mean'), {'Alabama': 30.0})
+        os.environ.pop('FAST_PATH_MAX_ROWS')
+
+        # no job was registered and the result was cached
+        self.assertEqual(len(tp.jobs), 0)
+        self.assertEqual(tp.result_cache.stats()['size'], 1)
+        tp.stop()
+
+    def test_swap_data_ingestor(self):
+        """
+        This method tests that a new generation of the data ingestor is swapped in and
+        that the previous backend is shut down after the jobs that use it.
+        """
+        di = self.aux_data_ingestor()
+        tp = ThreadPool()
+        tp.start(di, Mock())
+
+        tp.result_cache.put(ResultCache.make_key('/api/global_mean', {'question': 'Test'}), 1,
+                            'Test')
+        tp.result_cache.put(ResultCache.make_key('/api/global_mean', {'question': 'Other'}), 2,
+                            'Other')
+
+        # a job is being computed with the previous backend while the swap happens
+        previous_backend = tp.acquire_backend()
+        previous_backend.shutdown = Mock()
+        generation = self.aux_data_ingestor()
+        generation.appended_questions = {'Test'}
+        tp.swap_data_ingestor(generation)
+        self.assertIs(tp.data_ingestor, generation)
+        self.assertIsNot(tp.backend, previous_backend)
+        previous_backend.shutdown.assert_not_called()
+
+        # its result is not cached and the backend is shut down once it is done
+        job = Job(1, {'question': 'Test'}, '/api/global_mean', Mock())
+        tp.complete_job(job, 3, previous_backend)
+        tp.release_backend(previous_backend)
+        previous_backend.shutdown.assert_called_once()
+
+        # only the cached results of the appended questions were removed
+        self.assertIsNone(tp.result_cache.get(
+            ResultCache.make_key('/api/global_mean', {'question': 'Test'})))
+        self.assertEqual(tp.result_cache.get(
+            ResultCache.make_key('/api/global_mean', {'question': 'Other'})), 2)
+
+        # the process backend can't fork new workers while the threads are running
+        os.environ['TP_EXECUTOR'] = 'process'
+        with self.assertRaises(ValueError):
+            tp.swap_data_ingestor(self.aux_data_ingestor())
+        os.environ.pop('TP_EXECUTOR')
+        self.assertIs(tp.data_ingestor, generation)
+        tp.stop()
+
+    def test_scheduler(self):
+        """
+        This method tests that the cost classes are served by weighted fair dequeuing,
+        that the jobs with a higher priority are taken first and that the priority
+        is not part of the input data of the job.
+        """
+        tp = ThreadPool()
+        tp.logger = Mock()
+
+        # the weights of the light and heavy classes are 4 and 1
+        requests = [(i, {'question': f'Q{i}'}, '/api/mean_by_category') for i in range(5)]
+        requests += [(i, {'question': f'Q{i}'}, '/api/state_mean') for i in range(5, 10)]
+        requests.append((10, {'question': 'Q10', 'priority': 'high'}, '/api/state_mean'))
+        tp.register_jobs(requests)
+        self.assertEqual(tp.num_pending_jobs_by_class(), {'light': 6, 'medium': 0, 'heavy': 5})
+
+        order = [tp.job_queue.get().job_id for _ in range(11)]
+        self.assertEqual(order, [10, 5, 0, 6, 7, 8, 9, 1, 2, 3, 4])
+        self.assertEqual(tp.jobs.get(10).input_data, {'question': 'Q10'})
+        self.assertTrue(tp.job_queue.empty())
+
+        # the sentinel is taken after the jobs that are already queued
+        tp.job_queue.put(None)
+        tp.register_job(11, {'question': 'Q11'}, '/api/best5')
+        self.assertEqual(tp.job_queue.get().job_id, 11)
+        self.assertIsNone(tp.job_queue.get())
+
+    def test_max_queued(self):
+        """
+        This method tests that the jobs above the maximum number of queued jobs are rejected
+        with the expected time to compute the queued ones.
+        """
+        os.environ['TP_MAX_QUEUED'] = '2'
+        tp = ThreadPool()
+        os.environ.pop('TP_MAX_QUEUED')
+        tp.logger = Mock()
+        tp.tasks = [Mock()]
+        tp.service_times.record('/api/mean_by_category', 3.0)
+
+        tp.register_job(1, {'question': 'Q1'}, '/api/mean_by_category')
+        with self.assertRaises(Overloaded) as context:
+            tp.register_jobs([(2, {'question': 'Q2'}, '/api/global_mean'),
+                              (3, {'question': 'Q3'}, '/api/global_mean')])
+        self.assertEqual((context.exception.status_code, context.exception.retry_after), (503, 3))
+        self.assertEqual(len(tp.jobs), 1)
+
+        # a job with a cached result is not queued, so it is admitted
+        tp.result_cache.put(ResultCache.make_key('/api/global_mean', {'question': 'Q2'}), 1)
+        tp.register_jobs([(2, {'question': 'Q2'}, '/api/global_mean'),
+                          (3, {'question': 'Q3'}, '/api/global_mean')])
+        self.assertEqual(tp.num_pending_jobs(), 2)
+        with self.assertRaises(Overloaded):
+            tp.register_job(4, {'question': 'Q4'}, '/api/global_mean')
+
+        # a claimed job frees its place in the queue
+        tp.claim_jobs(tp.job_queue.get())
+        tp.register_job(4, {'question': 'Q4'}, '/api/global_mean')
+        self.assertEqual(tp.num_pending_jobs(), 2)
+
+    def test_single_flight(self):
+        """
+        This method tests that the identical jobs submitted while a job is pending share
+        its computation and its stored result, or its failure.
+        """
+        di = self.aux_data_ingestor()
+        tp = ThreadPool()
+        tp.logger = Mock()
+
+        tp.register_job(1, {'question': 'Test'}, '/api/best5')
+        tp.register_jobs([(2, {'question': 'Test', 'priority': 'high'}, '/api/best5'),
+                          (3, {'question': 'Test'}, '/api/worst5'),
+                          (4, {'question': 'Test'}, '/api/worst5'),
+                          (5, {'question': 'Other'}, '/api/global_mean'),
+                          (6, {'question': 'Other'}, '/api/global_mean')])
+        self.assertEqual(tp.num_pending_jobs(), 3)
+
+        tp.start(di, Mock())
+        for job_id in range(1, 7):
+            self.assertTrue(tp.jobs.get(job_id).wait(5))
+        tp.stop()
+
+        self.assertEqual(tp.result_store.get(2), {'Alabama': 30.0, 'Alaska': 25.0})
+        self.assertEqual(tp.result_store.get(4), tp.result_store.get(3))
+        self.assertEqual(tp.result_store.stats()['results'], 2)
+        self.assertEqual([tp.jobs.get(job_id).status for job_id in (5, 6)], ["error", "error"])
+        self.assertEqual((tp.in_flight, tp.followers), ({}, {}))
+
+    def test_wait_for_job(self):
+        """
+        This method tests that a client can wait for a job to finish.
+        """
+        di = self.aux_data_ingestor()
+        tp = ThreadPool()
+
+        # no thread is running yet, so the job can't finish
+        tp.logger = Mock()
+        tp.register_job(1, {'question': 'Test'}, '/api/global_mean')
+        job = tp.jobs.get(1)
+        # the event is created only for a waiting client
+        self.assertIsNone(job.done_event)
+        self.assertFalse(job.wait(0.1))
+        self.assertIsNotNone(job.done_event)
+
+        # the job finishes once the threads start and the waiting client is woken up
+        tp.start(di, Mock())
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.status, "done")
+        # the waiters are dropped when the job finishes
+        self.assertEqual((job.done_event, job.done_callbacks), (None, None))
+
+        # a failed job wakes up the client as well
+        tp.register_job(2, {'question': 'Test'}, '/api/state_mean')
+        job = tp.jobs.get(2)
+        self.assertTrue(job.wait(5))
+        self.assertEqual(job.status, "error")
+        tp.stop()
+
+    def test_register_jobs(self):
+        """
+        This method tests that a batch of jobs is registered and that the pending jobs
+        of a question are claimed together, by their most expensive job, as long as they
+        have the same priority.
+        """
+        di = self.aux_data_ingestor()
+        tp = ThreadPool()
+        tp.logger = Mock()
+
+        tp.register_jobs([(1, {'question': 'Test'}, '/api/states_mean'),
+                          (2, {'question': 'Other'}, '/api/global_mean'),
+                          (3, {'question': 'Test'}, '/api/best5'),
+                          (4, {'question': 'Test'}, '/api/mean_by_category'),
+                          (5, {'question': 'Test', 'priority': 'low'}, '/api/worst5')])
+        self.assertEqual(len(tp.jobs), 5)
+        self.assertEqual(tp.num_pending_jobs(), 5)
+
+        # the light job of the question Other is taken first
+        other_job = tp.job_queue.get()
+        self.assertEqual([job.job_id for job in tp.claim_jobs(other_job)], [2])
+
+        # the medium jobs of the question Test wait for the heavy job of their group, which
+        # claims them, but not the job with a low priority
+        self.assertEqual(tp.claim_jobs(tp.job_queue.get()), [])
+        self.assertEqual(tp.num_pending_jobs(), 4)
+        self.assertEqual([job.job_id for job in tp.claim_jobs(tp.jobs.get(4))], [1, 3, 4])
+        self.assertEqual(tp.claim_jobs(tp.jobs.get(3)), [])
+        self.assertEqual([job.job_id for job in tp.claim_jobs(tp.jobs.get(5))], [5])
+        self.assertEqual(tp.num_pending_jobs(), 0)
+
+        # the claimed jobs are computed together, the job of the question Other fails
+        tp.start(di, Mock())
+        tp.tasks[0].run_job(other_job)
+        tp.tasks[0].run_group(tp.jobs.get_many([1, 3, 4]))
+        tp.stop()
+        self.assertEqual([tp.jobs.get(i).status for i in (1, 2, 3, 4)],
+                         ["done", "error", "done", "done"])
+        self.assertEqual(tp.result_store.get(3), {'Alaska': 25.0, 'Alabama': 30.0})
+        self.assertEqual(tp.result_store.get(4), {"('Alabama', 'Gender', 'Male')": 30.0,
+                                                  "('Alaska', 'Gender', 'Female')": 25.0})
+
+    def test_shared_state_registration(self):
+        """
+        This method tests that the jobs are registered in the shared state of the worker
+        processes without holding the lock of the ThreadPool, and that the rejected jobs
+        are removed from it.
+        """
+        os.environ['TP_SHARED_STATE'] = 'shared_test/state.db'
+        os.environ['TP_MAX_QUEUED'] = '2'
+        tp = ThreadPool()
+        other_tp = ThreadPool()
+        os.environ.pop('TP_SHARED_STATE')
+        os.environ.pop('TP_MAX_QUEUED')
+        tp.logger = Mock()
+
+        # record whether the lock was held by each write to the database
+        locked = []
+        execute = tp.shared_state.execute
+        tp.shared_state.execute = lambda statements: (locked.append(tp.lock.locked()),
+                                                      execute(statements))
+        tp.register_job(1, {'question': 'Test'}, '/api/global_mean')
+        with self.assertRaises(Overloaded):
+            tp.register_jobs([(2, {'question': 'Test'}, '/api/best5'),
+                              (3, {'question': 'Test'}, '/api/worst5')])
+        self.assertEqual(locked, [False, False, False])
+        self.assertEqual(other_tp.jobs.get(1).status, "running")
+        self.assertEqual(other_tp.jobs.get_many([2, 3]), [None, None])
+        shutil.rmtree('shared_test')
+
+    def test_fused_group(self):
+        """
+        This method tests that the jobs of different cost classes of a question are computed
+        with a single pass over its rows once the group is claimed.
+        """
+        di = self.aux_data_ingestor()
+        di.question_view = Mock(wraps=di.question_view)
+        tp = ThreadPool()
+        tp.logger = Mock()
+        tp.register_jobs([(1, {'question': 'Test'}, '/api/global_mean'),
+                          (2, {'question': 'Test'}, '/api/states_mean'),
+                          (3, {'question': 'Test'}, '/api/mean_by_category')])
+
+        os.environ['TP_NUM_OF_THREADS'] = '1'
+        tp.start(di, Mock())
+        os.environ.pop('TP_NUM_OF_THREADS')
+        tp.stop()
+
+        di.question_view.assert_called_once_with('Test')
+        self.assertEqual(tp.result_store.get(1), {'global_mean': 27.5})
+        self.assertEqual(tp.result_store.get(2), {'Alaska': 25.0, 'Alabama': 30.0})
+        self.assertEqual(tp.result_store.get(3), {"('Alabama', 'Gender', 'Male')": 30.0,
+                                                  "('Alaska', 'Gender', 'Female')": 25.0})